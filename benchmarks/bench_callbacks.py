@@ -0,0 +1,115 @@
+"""Бенчмарк выбора обработчика инлайн-кнопки.
+
+Сравнивает два способа при N зарегистрированных действиях:
+- chain — отдельный обработчик с фильтром F.data.startswith(...) на
+  каждое действие, как было в main.py: aiogram проверяет фильтры по
+  очереди;
+- router — один обработчик с таблицей callbacks.CallbackRouter.
+
+Для каждого способа измеряется среднее время dp.feed_update до
+кнопки первого, среднего и последнего зарегистрированного действия.
+Обработчики ничего не делают, поэтому измеряется только диспетчеризация.
+
+Пример:
+    python benchmarks/bench_callbacks.py --actions 10 50 200
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+from aiogram import Bot, Dispatcher, F
+from aiogram.types import Update
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from callbacks import CallbackRouter, pack  # noqa: E402
+
+USER_ID = 100000001
+
+
+def make_update(update_id, data):
+    return Update.model_validate({
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'Driver'},
+            'chat_instance': '1',
+            'data': data,
+            'message': {
+                'message_id': 1,
+                'date': 0,
+                'chat': {'id': USER_ID, 'type': 'private'},
+                'text': 'x',
+            },
+        },
+    })
+
+
+async def noop(callback):
+    pass
+
+
+def chain_dispatcher(actions):
+    dp = Dispatcher()
+    for index in range(actions):
+        dp.callback_query.register(noop, F.data.startswith(f"action{index}_"))
+    return dp, lambda index: f"action{index}_12345"
+
+
+def router_dispatcher(actions):
+    dp = Dispatcher()
+    router = CallbackRouter()
+    for index in range(actions):
+        router.action(f"a{index}", int)(noop)
+    router.register(dp.callback_query)
+    return dp, lambda index: pack(f"a{index}", 12345)
+
+
+async def per_update_us(dp, bot, data, iterations):
+    updates = [make_update(number, data) for number in range(iterations)]
+    # Прогрев
+    for update in updates[:50]:
+        await dp.feed_update(bot, update)
+    started = time.perf_counter()
+    for update in updates:
+        await dp.feed_update(bot, update)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+async def run(action_counts, iterations):
+    bot = Bot(token='42:fake')
+    results = []
+    try:
+        for actions in action_counts:
+            targets = {'first': 0, 'middle': actions // 2, 'last': actions - 1}
+            for scheme, build in (('chain', chain_dispatcher), ('router', router_dispatcher)):
+                dp, callback_data = build(actions)
+                result = {'actions': actions, 'scheme': scheme}
+                for name, index in targets.items():
+                    elapsed = await per_update_us(dp, bot, callback_data(index), iterations)
+                    result[f'{name}_us'] = round(elapsed, 1)
+                results.append(result)
+                print(json.dumps(result), file=sys.stderr)
+    finally:
+        await bot.session.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк выбора обработчика инлайн-кнопки")
+    parser.add_argument('--actions', type=int, nargs='+', default=[10, 50, 200],
+                        help="числа зарегистрированных действий")
+    parser.add_argument('--iterations', type=int, default=500,
+                        help="обновлений на одно измерение")
+    args = parser.parse_args(argv)
+    results = asyncio.run(run(args.actions, args.iterations))
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
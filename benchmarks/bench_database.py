@@ -0,0 +1,315 @@
+"""Бенчмарк методов database.Database на базах разного размера.
+
+Для каждого размера базы (генерируется generate_test_data.py и
+сохраняется в benchmarks/fixtures) каждый метод вызывается через
+AsyncDatabase, как в боте, при 1, 8 и 64 одновременных вызывающих.
+Результат — задержки p50/p99 и пропускная способность в JSON. Если
+передан --baseline, результаты сравниваются с ним, а при регрессии
+скрипт завершается с кодом 1.
+
+Примеры:
+    python benchmarks/bench_database.py --sizes 10k --output result.json
+    python benchmarks/bench_database.py --sizes 10k 1m --baseline baseline.json
+    python benchmarks/bench_database.py --sizes 10k --save-baseline baseline.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from database import AsyncDatabase, get_connection_manager  # noqa: E402
+from generate_test_data import generate  # noqa: E402
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+# Параметры генератора для каждого размера; число расходов равно
+# drivers * expenses_per_driver
+FIXTURES = {
+    '10k': dict(drivers=100, routes=1_000, executions_per_driver=20, expenses_per_driver=100),
+    '1m': dict(drivers=2_000, routes=50_000, executions_per_driver=100, expenses_per_driver=500),
+    '10m': dict(drivers=10_000, routes=200_000, executions_per_driver=200, expenses_per_driver=1_000),
+}
+# Конец истории фиксирован, чтобы базы совпадали при повторной генерации
+FIXTURE_UNTIL = datetime(2024, 12, 31)
+FIXTURE_SEED = 42
+
+CONCURRENCY = (1, 8, 64)
+# telegram_id водителей, от имени которых бенчмарк пишет в базу;
+# их данные удаляются после прогона
+BENCH_DRIVER_BASE = 900_000_000
+# Сколько расходов выбрать для get_expense и get_expense_by_date
+SAMPLE_SIZE = 2_000
+# Допустимое ухудшение относительно базовой линии; разница задержек меньше
+# MIN_DELTA_MS считается шумом
+REGRESSION_THRESHOLD = 0.25
+MIN_DELTA_MS = 0.1
+
+
+class Workload:
+    """Аргументы вызовов, выбранные из базы один раз перед прогоном"""
+
+    def __init__(self, db_file, seed):
+        self.rng = random.Random(seed)
+        connection = sqlite3.connect(db_file)
+        try:
+            self.drivers = [row[0] for row in connection.execute(
+                "SELECT telegram_id FROM drivers WHERE telegram_id < ?",
+                (BENCH_DRIVER_BASE,)
+            )]
+            self.routes = [row[0] for row in connection.execute(
+                "SELECT id FROM routes WHERE status = 'open'"
+            )] or [row[0] for row in connection.execute("SELECT id FROM routes")]
+            # Выборка с постоянным шагом, чтобы она не менялась между прогонами
+            count = connection.execute("SELECT MAX(id) FROM expenses").fetchone()[0] or 0
+            self.expenses = connection.execute(
+                "SELECT id, driver_id, created_at FROM expenses WHERE id % ? = 0 LIMIT ?",
+                (max(1, count // SAMPLE_SIZE), SAMPLE_SIZE)
+            ).fetchall()
+        finally:
+            connection.close()
+
+    def driver(self):
+        return self.rng.choice(self.drivers)
+
+    def expense(self):
+        return self.rng.choice(self.expenses)
+
+    def route(self):
+        return self.rng.choice(self.routes)
+
+
+async def call_start_finish(db, workload, caller):
+    """Начать и завершить маршрут от имени отдельного водителя бенчмарка"""
+    driver_id = BENCH_DRIVER_BASE + caller
+    route_id = workload.route()
+    await db.start_route(driver_id, route_id)
+    await db.finish_route(driver_id, route_id)
+
+
+def _expense_by_id(db, workload):
+    expense_id, driver_id, _ = workload.expense()
+    return db.get_expense(driver_id, expense_id)
+
+
+def _expense_by_date(db, workload):
+    _, driver_id, created_at = workload.expense()
+    return db.get_expense_by_date(driver_id, created_at)
+
+
+# Имя -> корутина вызова (db, workload, номер вызывающего)
+METHODS = {
+    'driver_exists': lambda db, w, c: db.driver_exists(w.driver()),
+    'get_active_route': lambda db, w, c: db.get_active_route(w.driver()),
+    'get_available_routes': lambda db, w, c: db.get_available_routes(),
+    'get_route_details': lambda db, w, c: db.get_route_details(w.route()),
+    'get_completed_routes': lambda db, w, c: db.get_completed_routes(w.driver()),
+    'get_completed_routes_page': lambda db, w, c: db.get_completed_routes_page(w.driver()),
+    'get_route_history_stamp': lambda db, w, c: db.get_route_history_stamp(w.driver()),
+    'get_driver_expenses': lambda db, w, c: db.get_driver_expenses(w.driver()),
+    'get_driver_expenses_page': lambda db, w, c: db.get_driver_expenses_page(w.driver()),
+    'get_driver_expenses_summary': lambda db, w, c: db.get_driver_expenses_summary(w.driver()),
+    'get_expense': lambda db, w, c: _expense_by_id(db, w),
+    'get_expense_by_date': lambda db, w, c: _expense_by_date(db, w),
+    'add_expense': lambda db, w, c: db.add_expense(
+        BENCH_DRIVER_BASE + c, 'fuel', 25000, None, 'benchmark'
+    ),
+    'start_route+finish_route': call_start_finish,
+}
+
+
+def build_fixture(size, rebuild=False):
+    """Путь к базе нужного размера; база создается при первом запуске"""
+    FIXTURES_DIR.mkdir(exist_ok=True)
+    db_file = FIXTURES_DIR / f'bench_{size}.db'
+    if db_file.exists() and not rebuild:
+        return db_file
+    for suffix in ('', '-wal', '-shm'):
+        Path(f'{db_file}{suffix}').unlink(missing_ok=True)
+    print(f"Генерация базы {size}...", file=sys.stderr)
+    started = time.perf_counter()
+    generate(
+        str(db_file), seed=FIXTURE_SEED, until=FIXTURE_UNTIL,
+        log=lambda message: None, **FIXTURES[size]
+    )
+    print(f"База {size} готова за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+    return db_file
+
+
+def cleanup(db_file):
+    """Удалить данные, записанные бенчмарком"""
+    manager = get_connection_manager(str(db_file))
+    with manager.writer() as connection:
+        connection.execute('DELETE FROM expenses WHERE driver_id >= ?', (BENCH_DRIVER_BASE,))
+        connection.execute('DELETE FROM route_executions WHERE driver_id >= ?', (BENCH_DRIVER_BASE,))
+
+
+def percentile(sorted_values, percent):
+    """Перцентиль по отсортированному списку"""
+    if not sorted_values:
+        return None
+    index = round(percent / 100 * (len(sorted_values) - 1))
+    return sorted_values[index]
+
+
+async def run_case(db, workload, call, concurrency, duration, max_ops):
+    """Вызывать метод из concurrency задач, пока не истечет время или лимит"""
+    latencies = []
+    deadline = time.perf_counter() + duration
+    budget = [max_ops]
+
+    async def caller(number):
+        while budget[0] > 0 and time.perf_counter() < deadline:
+            budget[0] -= 1
+            started = time.perf_counter()
+            await call(db, workload, number)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(caller(number) for number in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'concurrency': concurrency,
+        'ops': len(latencies),
+        'seconds': round(elapsed, 4),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 4),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 4),
+        'throughput': round(len(latencies) / elapsed, 1),
+    }
+
+
+async def bench_fixture(size, db_file, methods, concurrency_levels, duration, max_ops, seed):
+    """Прогнать все методы на одной базе"""
+    workload = Workload(db_file, seed)
+    db = AsyncDatabase(str(db_file))
+    results = []
+    try:
+        for name in methods:
+            # Прогрев: кэш страниц SQLite и кэш каталога маршрутов
+            await run_case(db, workload, METHODS[name], 1, duration / 10, 10)
+            for concurrency in concurrency_levels:
+                result = await run_case(
+                    db, workload, METHODS[name], concurrency, duration, max_ops
+                )
+                result = {'fixture': size, 'method': name, **result}
+                results.append(result)
+                print(
+                    f"{size:>4} {name:<28} x{concurrency:<3} "
+                    f"p50 {result['p50_ms']:9.3f} мс  p99 {result['p99_ms']:9.3f} мс  "
+                    f"{result['throughput']:10.1f} оп/с",
+                    file=sys.stderr
+                )
+    finally:
+        await db.close()
+        cleanup(db_file)
+        get_connection_manager(str(db_file)).close()
+    return results
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Найти случаи, где задержка или пропускная способность хуже базовой линии"""
+    previous = {
+        (item['fixture'], item['method'], item['concurrency']): item
+        for item in baseline['results']
+    }
+    regressions = []
+    for item in results:
+        old = previous.get((item['fixture'], item['method'], item['concurrency']))
+        if old is None:
+            continue
+        problems = []
+        for metric in ('p50_ms', 'p99_ms'):
+            if (item[metric] > old[metric] * (1 + threshold)
+                    and item[metric] - old[metric] > MIN_DELTA_MS):
+                problems.append(f"{metric} {old[metric]} -> {item[metric]}")
+        if old['throughput'] and item['throughput'] < old['throughput'] * (1 - threshold):
+            problems.append(f"throughput {old['throughput']} -> {item['throughput']}")
+        if problems:
+            regressions.append({
+                'fixture': item['fixture'],
+                'method': item['method'],
+                'concurrency': item['concurrency'],
+                'problems': problems,
+            })
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк методов Database")
+    parser.add_argument('--sizes', nargs='+', choices=list(FIXTURES), default=['10k'],
+                        help="размеры баз (число расходов)")
+    parser.add_argument('--methods', nargs='+', choices=list(METHODS), default=list(METHODS),
+                        help="какие методы измерять")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=list(CONCURRENCY),
+                        help="числа одновременных вызывающих")
+    parser.add_argument('--duration', type=float, default=2.0,
+                        help="наибольшая длительность одного замера, с")
+    parser.add_argument('--max-ops', type=int, default=5_000,
+                        help="наибольшее число вызовов в одном замере")
+    parser.add_argument('--seed', type=int, default=1,
+                        help="начальное значение для выбора аргументов")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="сгенерировать базы заново")
+    parser.add_argument('--output', help="записать результаты в JSON-файл")
+    parser.add_argument('--baseline', help="сравнить с сохраненными результатами")
+    parser.add_argument('--save-baseline', help="сохранить результаты как базовую линию")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="допустимое ухудшение, доля (0.25 = 25%%)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    for size in args.sizes:
+        db_file = build_fixture(size, args.rebuild)
+        results += asyncio.run(bench_fixture(
+            size, db_file, args.methods, args.concurrency,
+            args.duration, args.max_ops, args.seed
+        ))
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'fixtures': {size: FIXTURES[size] for size in args.sizes},
+        },
+        'results': results,
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        report['regressions'] = regressions
+        for regression in regressions:
+            print(
+                f"РЕГРЕССИЯ {regression['fixture']} {regression['method']} "
+                f"x{regression['concurrency']}: {'; '.join(regression['problems'])}",
+                file=sys.stderr
+            )
+        if regressions:
+            exit_code = 1
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    for path in filter(None, (args.output, args.save_baseline)):
+        Path(path).write_text(text + '\n', encoding='utf-8')
+    if not args.output:
+        print(text)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
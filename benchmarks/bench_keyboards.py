@@ -0,0 +1,100 @@
+"""Микробенчмарк построения клавиатур бота.
+
+Сравнивает, сколько стоит клавиатура на одно сообщение, если строить
+её заново (как раньше) и если брать готовую: постоянные клавиатуры
+построены при импорте keyboards.py, а списки маршрутов берутся из
+keyboards.keyboard_cache по версии каталога.
+
+Пример:
+    python benchmarks/bench_keyboards.py --routes 50
+"""
+import argparse
+import json
+import sys
+import timeit
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import keyboards  # noqa: E402
+from database import PAGE_SIZE, _completed_route_from_row, now_ms  # noqa: E402
+
+
+def make_routes(count):
+    """Строки get_available_routes"""
+    return [
+        (route_id, f"Маршрут {route_id}", f"Город {route_id}", f"Город {route_id + 1}")
+        for route_id in range(1, count + 1)
+    ]
+
+
+def make_history_rows(count):
+    """Строки страницы истории в том виде, в каком их возвращает база"""
+    finished = now_ms()
+    return [
+        (route_id, f"Маршрут {route_id}", "Алматы", "Астана",
+         finished - 86_400_000 * route_id - 36_000_000, finished - 86_400_000 * route_id,
+         1200.0, 350000.0, finished - 86_400_000 * route_id, route_id)
+        for route_id in range(1, count + 1)
+    ]
+
+
+def per_call_us(func):
+    """Время одного вызова в микросекундах"""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=5, number=number))
+    return best / number * 1e6
+
+
+def run(routes_count):
+    routes = make_routes(routes_count)
+    history_rows = make_history_rows(PAGE_SIZE)
+    cursor = history_rows[-1][-2:]
+    cache = keyboards.keyboard_cache
+    cache.set('available_routes', 1, keyboards.get_routes_keyboard(routes))
+    cache.set(('route_history', 1, None, 'older'), 1, keyboards.get_route_history_keyboard(
+        [_completed_route_from_row(row) for row in history_rows], cursor
+    ))
+
+    def build_history():
+        items = [_completed_route_from_row(row) for row in history_rows]
+        return keyboards.get_route_history_keyboard(items, cursor)
+
+    cases = {
+        'main': (keyboards._build_main_keyboard, keyboards.get_main_keyboard),
+        'expense_types': (keyboards._build_expense_types_keyboard, keyboards.get_expense_types_keyboard),
+        'routes': (
+            lambda: keyboards.get_routes_keyboard(routes),
+            lambda: cache.get('available_routes', 1)
+        ),
+        'route_history_page': (
+            build_history,
+            lambda: cache.get(('route_history', 1, None, 'older'), 1)
+        ),
+    }
+    results = []
+    for name, (build, cached) in cases.items():
+        build_us = per_call_us(build)
+        cached_us = per_call_us(cached)
+        results.append({
+            'keyboard': name,
+            'build_us': round(build_us, 2),
+            'cached_us': round(cached_us, 2),
+            'saved_us': round(build_us - cached_us, 2),
+            'speedup': round(build_us / cached_us, 1),
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Микробенчмарк клавиатур бота")
+    parser.add_argument('--routes', type=int, default=50, help="маршрутов в списке доступных")
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.routes), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
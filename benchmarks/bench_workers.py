@@ -0,0 +1,152 @@
+"""Масштабирование workers.py по числу рабочих процессов.
+
+Для каждого числа процессов бот запускается в режиме webhook во
+временном каталоге с тестовой базой, Bot API подменяется заглушкой из
+fake_telegram.py, и на webhook отправляются обновления от множества
+водителей. Печатается, сколько обновлений в секунду бот обработал (по
+его вызовам Bot API) при каждом числе процессов.
+
+Пример:
+    python benchmarks/bench_workers.py --workers 1 2 4 --updates 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from aiohttp import ClientSession
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_telegram import FakeBotAPI, post_updates, start_api, wait_quiet  # noqa: E402
+from generate_test_data import generate  # noqa: E402
+
+HOST = '127.0.0.1'
+SECRET = 'bench'
+# Сколько ждать готовности бота после запуска, в секундах
+STARTUP_TIMEOUT = 60
+
+
+async def wait_ready(url, process):
+    """Дождаться ответа 200 от /ready"""
+    deadline = time.perf_counter() + STARTUP_TIMEOUT
+    async with ClientSession() as session:
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"бот завершился с кодом {process.returncode}")
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("бот не запустился за отведенное время")
+
+
+async def run_case(workers, args, workdir):
+    api = FakeBotAPI()
+    api_runner = await start_api(api, HOST, args.api_port)
+    env = dict(
+        os.environ,
+        BOT_TOKEN='1:fake',
+        BOT_MODE='webhook',
+        WEBHOOK_HOST=HOST,
+        WEBHOOK_PORT=str(args.port),
+        WEBHOOK_SECRET=SECRET,
+        WEBHOOK_BASE_URL='',
+        TELEGRAM_API_URL=f'http://{HOST}:{args.api_port}',
+        METRICS_PORT='',
+        LOG_LEVEL='WARNING',
+        # Измеряется обработка, а не ограничение скорости отправки
+        SEND_RATE_LIMIT='0',
+        # Водители повторяют сценарий чаще, чем раз в THROTTLE_WINDOW
+        THROTTLE_WINDOW='0',
+    )
+    process = subprocess.Popen(
+        [sys.executable, str(ROOT / 'workers.py'), '--workers', str(workers)],
+        cwd=workdir,
+        env=env
+    )
+    try:
+        await wait_ready(f'http://{HOST}:{args.port}/ready', process)
+        # Прогрев: первые обращения открывают соединения и кэши
+        await post_updates(f'http://{HOST}:{args.port}/webhook', SECRET, args.users,
+                           args.concurrency, args.users, args.first_user)
+        await wait_quiet(api)
+
+        calls_before = api.calls
+        started = time.perf_counter()
+        # update_id продолжают прогрев: повторные бот отбросил бы
+        latencies, errors = await post_updates(
+            f'http://{HOST}:{args.port}/webhook', SECRET, args.updates,
+            args.concurrency, args.users, args.first_user, args.users + 1
+        )
+        await wait_quiet(api)
+        calls = api.calls - calls_before
+        if not calls:
+            raise RuntimeError("бот не вызвал Bot API во время замера")
+        processed_in = api.last_call_at - started
+    finally:
+        process.terminate()
+        process.wait(30)
+        await api_runner.cleanup()
+
+    return {
+        'workers': workers,
+        'updates': args.updates,
+        'errors': errors,
+        'bot_api_calls': calls,
+        'processed_seconds': round(processed_in, 3),
+        'processed_per_second': round(args.updates / processed_in, 1),
+    }
+
+
+async def run(args):
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        generate(os.path.join(workdir, 'transport_expenses.db'), drivers=args.drivers, log=lambda *a: None)
+        for workers in args.workers:
+            result = await run_case(workers, args, workdir)
+            print(json.dumps(result, ensure_ascii=False), file=sys.stderr)
+            results.append(result)
+
+    single = results[0]['processed_per_second']
+    for result in results:
+        result['speedup'] = round(result['processed_per_second'] / single, 2)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Масштабирование workers.py по числу процессов")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help="числа рабочих процессов")
+    parser.add_argument('--updates', type=int, default=5000, help="обновлений на прогон")
+    parser.add_argument('--concurrency', type=int, default=64, help="одновременных запросов")
+    parser.add_argument('--users', type=int, default=1000, help="число разных водителей")
+    parser.add_argument('--first-user', type=int, default=100000001,
+                        help="telegram_id первого водителя")
+    parser.add_argument('--drivers', type=int, default=100,
+                        help="водителей в тестовой базе")
+    parser.add_argument('--port', type=int, default=8090, help="порт webhook бота")
+    parser.add_argument('--api-port', type=int, default=8091, help="порт заглушки Bot API")
+    parser.add_argument('--output', help="записать результат в JSON-файл")
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(run(args))
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + '\n', encoding='utf-8')
+    print(text)
+    return 1 if any(result['errors'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+"""Имитация Telegram для нагрузочной проверки режима webhook.
+
+Две части:
+- api — заглушка Bot API: отвечает успехом на любой метод и считает
+  вызовы, чтобы бот мог работать без настоящего Telegram (FakeSession
+  делает то же внутри процесса, без HTTP);
+- post — отправляет обновления на webhook бота с заданным числом
+  одновременных запросов и печатает задержки ответа и пропускную
+  способность. С --api-port заглушка Bot API запускается в том же
+  процессе, и дополнительно измеряется, как быстро бот обработал
+  обновления (по его вызовам Bot API).
+
+Пример:
+    python benchmarks/fake_telegram.py api --port 8081
+    BOT_TOKEN=1:fake BOT_MODE=webhook WEBHOOK_SECRET=s SEND_RATE_LIMIT=0 \\
+        TELEGRAM_API_URL=http://127.0.0.1:8081 python main.py
+    python benchmarks/fake_telegram.py post --secret s --updates 5000
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import json
+import sys
+import time
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, web
+from aiogram.client.session.base import BaseSession
+
+# Методы Bot API, которые возвращают сообщение
+MESSAGE_METHODS = {
+    'sendmessage', 'sendphoto', 'senddocument', 'editmessagetext',
+    'editmessagecaption', 'editmessagereplymarkup'
+}
+# Сообщения, которые отправляют водители в нагрузке
+SCENARIO = ["/start", "📊 Мои расходы", "🚛 Мои маршруты", "📜 История маршрутов"]
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Содержимое, которое отдается вместо любого файла
+FAKE_FILE_CONTENT = b'\xff\xd8\xff\xe0' + bytes(range(256)) * 16
+
+
+def fake_result(method, chat_id, text, message_ids):
+    """Результат метода Bot API (method — имя в нижнем регистре)"""
+    if method == 'getme':
+        return {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+    if method in MESSAGE_METHODS:
+        return {
+            'message_id': next(message_ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id or 1), 'type': 'private'},
+            'text': text or '',
+        }
+    if method == 'getfile':
+        return {
+            'file_id': 'fake',
+            'file_unique_id': 'fake',
+            'file_size': len(FAKE_FILE_CONTENT),
+            'file_path': 'photos/fake.jpg',
+        }
+    return True
+
+
+class FakeBotAPI:
+    """Заглушка Bot API с подсчетом вызовов"""
+
+    def __init__(self):
+        self.calls = 0
+        self.last_call_at = None
+        self._message_ids = itertools.count(1)
+
+    async def handle(self, request):
+        method = request.match_info['method'].lower()
+        self.calls += 1
+        self.last_call_at = time.perf_counter()
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        result = fake_result(method, params.get('chat_id'), params.get('text'), self._message_ids)
+        return web.json_response({'ok': True, 'result': result})
+
+    def create_app(self):
+        app = web.Application(client_max_size=32 * 1024 * 1024)
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+
+class FakeSession(BaseSession):
+    """Сессия aiogram, которая отвечает на вызовы Bot API сама.
+
+    Ответ проходит тот же разбор, что и ответ настоящего сервера.
+    calls — число вызовов по методам.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.calls = collections.Counter()
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__.lower()
+        self.calls[name] += 1
+        result = fake_result(
+            name, getattr(method, 'chat_id', None), getattr(method, 'text', None), self._message_ids
+        )
+        content = json.dumps({'ok': True, 'result': result})
+        return self.check_response(bot, method, 200, content).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536,
+                             raise_for_status=True):
+        for start in range(0, len(FAKE_FILE_CONTENT), chunk_size):
+            yield FAKE_FILE_CONTENT[start:start + chunk_size]
+
+    async def close(self):
+        pass
+
+
+async def start_api(api, host, port):
+    runner = web.AppRunner(api.create_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def make_update(update_id, user_id, text):
+    """Обновление с текстовым сообщением водителя"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Driver'},
+            'text': text,
+        },
+    }
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[round(percent / 100 * (len(sorted_values) - 1))]
+
+
+async def post_updates(url, secret, updates, concurrency, users, first_user, first_update=1):
+    """Отправить обновления на webhook; вернуть задержки ответов и ошибки.
+
+    update_id идут подряд с first_update: бот отбрасывает уже виденные
+    update_id, поэтому следующий прогон на тот же бот должен начинаться
+    после последнего отправленного.
+    """
+    counter = itertools.count(1)
+    latencies = []
+    errors = 0
+    headers = {SECRET_HEADER: secret} if secret else {}
+
+    async def worker(session):
+        nonlocal errors
+        while True:
+            number = next(counter)
+            if number > updates:
+                return
+            user_id = first_user + number % users
+            text = SCENARIO[(number // users) % len(SCENARIO)]
+            started = time.perf_counter()
+            update = make_update(first_update + number - 1, user_id, text)
+            async with session.post(url, json=update,
+                                    headers=headers) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    connector = TCPConnector(limit=concurrency)
+    async with ClientSession(connector=connector, timeout=ClientTimeout(total=60)) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    return latencies, errors
+
+
+async def wait_quiet(api, quiet=1.0):
+    """Дождаться, пока бот перестанет вызывать Bot API"""
+    while True:
+        await asyncio.sleep(quiet / 4)
+        if api.last_call_at is None or time.perf_counter() - api.last_call_at >= quiet:
+            return
+
+
+async def run_post(args):
+    api = api_runner = None
+    if args.api_port:
+        api = FakeBotAPI()
+        api_runner = await start_api(api, args.api_host, args.api_port)
+
+    try:
+        started = time.perf_counter()
+        latencies, errors = await post_updates(
+            args.url, args.secret, args.updates, args.concurrency, args.users, args.first_user,
+            args.first_update
+        )
+        accepted_in = time.perf_counter() - started
+        latencies.sort()
+        report = {
+            'updates': args.updates,
+            'concurrency': args.concurrency,
+            'errors': errors,
+            'accept_seconds': round(accepted_in, 3),
+            'accept_per_second': round(args.updates / accepted_in, 1),
+            'response_p50_ms': round(percentile(latencies, 50) * 1000, 3),
+            'response_p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        }
+        if api is not None:
+            await wait_quiet(api)
+            report['bot_api_calls'] = api.calls
+            if not api.calls:
+                # Бот ничего не обработал (например, отбросил update_id как повторы)
+                print("Бот не вызвал Bot API ни разу", file=sys.stderr)
+                errors += 1
+            else:
+                processed_in = api.last_call_at - started
+                report.update({
+                    'processed_seconds': round(processed_in, 3),
+                    'processed_per_second': round(args.updates / processed_in, 1),
+                })
+    finally:
+        if api_runner is not None:
+            await api_runner.cleanup()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if errors else 0
+
+
+async def run_api(args):
+    api = FakeBotAPI()
+    await start_api(api, args.host, args.port)
+    print(f"Заглушка Bot API: http://{args.host}:{args.port}", file=sys.stderr)
+    while True:
+        await asyncio.sleep(5)
+        print(f"Вызовов Bot API: {api.calls}", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Имитация Telegram для режима webhook")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    api = commands.add_parser('api', help="запустить заглушку Bot API")
+    api.add_argument('--host', default='127.0.0.1')
+    api.add_argument('--port', type=int, default=8081)
+
+    post = commands.add_parser('post', help="отправить обновления на webhook")
+    post.add_argument('--url', default='http://127.0.0.1:8080/webhook')
+    post.add_argument('--secret', help="секрет webhook (WEBHOOK_SECRET бота)")
+    post.add_argument('--updates', type=int, default=1000, help="сколько обновлений отправить")
+    post.add_argument('--concurrency', type=int, default=32, help="одновременных запросов")
+    post.add_argument('--users', type=int, default=500, help="число разных водителей")
+    post.add_argument('--first-user', type=int, default=100000001,
+                      help="telegram_id первого водителя")
+    post.add_argument('--first-update', type=int, default=1,
+                      help="update_id первого обновления (бот отбрасывает повторы)")
+    post.add_argument('--api-port', type=int,
+                      help="запустить заглушку Bot API на этом порту и измерить обработку")
+    post.add_argument('--api-host', default='127.0.0.1')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == 'api':
+        asyncio.run(run_api(args))
+        return 0
+    return asyncio.run(run_post(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
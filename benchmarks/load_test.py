@@ -0,0 +1,245 @@
+"""Нагрузочный тест бота: парк виртуальных водителей.
+
+Каждый виртуальный водитель проходит сценарий: регистрация, расход с
+фото чека, начало и завершение маршрута, просмотр истории и расходов.
+Обновления передаются прямо в диспетчер main.dp, а Bot API заменен
+сессией fake_telegram.FakeSession, поэтому измеряется сам бот: его
+обработчики, FSM и база. Бот работает с тестовой базой во временном
+каталоге (или в --workdir).
+
+Печатается пропускная способность (обновлений в секунду), задержки
+обработки по шагам сценария и ожидание блокировок базы по метрикам
+database.py.
+
+Пример:
+    python benchmarks/load_test.py --drivers 2000 --concurrency 200
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_telegram import FakeSession, percentile  # noqa: E402
+from generate_test_data import generate  # noqa: E402
+
+# telegram_id первого виртуального водителя
+FIRST_DRIVER_ID = 700_000_001
+# Метрики базы (имена в database.py), по которым оценивается
+# конкуренция за соединения и запись
+DB_WAIT_METRICS = (
+    'READER_WAIT_SECONDS',
+    'WRITER_LOCK_WAIT_SECONDS',
+    'WRITE_QUEUE_WAIT_SECONDS',
+    'COMMIT_SECONDS',
+)
+
+
+class Fleet:
+    """Виртуальные водители и сбор результатов"""
+
+    def __init__(self, main, routes, think):
+        self.main = main
+        self.routes = routes
+        self.think = think
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _message(self, driver_id, **content):
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': driver_id, 'type': 'private'},
+            'from': {'id': driver_id, 'is_bot': False, 'first_name': 'Driver'},
+            **content,
+        }
+
+    def text(self, driver_id, text):
+        return {'update_id': next(self._update_ids), 'message': self._message(driver_id, text=text)}
+
+    def photo(self, driver_id):
+        file_id = f'photo-{driver_id}'
+        return {'update_id': next(self._update_ids), 'message': self._message(driver_id, photo=[
+            {'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 960},
+        ])}
+
+    def button(self, driver_id, data):
+        return {'update_id': next(self._update_ids), 'callback_query': {
+            'id': str(next(self._message_ids)),
+            'from': {'id': driver_id, 'is_bot': False, 'first_name': 'Driver'},
+            'chat_instance': str(driver_id),
+            'data': data,
+            'message': self._message(driver_id, text='...'),
+        }}
+
+    def scenario(self, driver_id, route_id):
+        """Шаги сценария водителя: (имя шага, обновление)"""
+        from callbacks import (
+            pack, EXPENSE_TYPE, ROUTE_DETAILS, ROUTE_START, ROUTE_FINISH, HISTORY_ROUTE
+        )
+        return [
+            ('start', self.text(driver_id, '/start')),
+            ('register_name', self.text(driver_id, f'Водитель {driver_id}')),
+            ('register_phone', self.text(driver_id, f'+7{driver_id:010d}')),
+            ('expense_menu', self.text(driver_id, '📝 Добавить расход')),
+            ('expense_type', self.button(driver_id, pack(EXPENSE_TYPE, 'fuel'))),
+            ('expense_amount', self.text(driver_id, '15000')),
+            ('expense_photo', self.photo(driver_id)),
+            ('expense_comment', self.text(driver_id, 'Заправка')),
+            ('routes', self.text(driver_id, '🚛 Мои маршруты')),
+            ('route_details', self.button(driver_id, pack(ROUTE_DETAILS, route_id))),
+            ('route_start', self.button(driver_id, pack(ROUTE_START, route_id))),
+            ('route_active', self.text(driver_id, '🚛 Мои маршруты')),
+            ('route_finish', self.button(driver_id, pack(ROUTE_FINISH))),
+            ('history', self.text(driver_id, '📜 История маршрутов')),
+            ('history_route', self.button(driver_id, pack(HISTORY_ROUTE, route_id))),
+            ('expenses', self.text(driver_id, '📊 Мои расходы')),
+        ]
+
+    async def drive(self, index):
+        """Провести одного водителя по сценарию"""
+        driver_id = FIRST_DRIVER_ID + index
+        route_id = self.routes[index % len(self.routes)]
+        dp, bot = self.main.dp, self.main.bot
+        for step, update in self.scenario(driver_id, route_id):
+            started = time.perf_counter()
+            try:
+                await dp.feed_raw_update(bot, update)
+            except Exception as error:
+                self.errors[f'{step}: {type(error).__name__}'] += 1
+            self.latencies[step].append(time.perf_counter() - started)
+            if self.think:
+                await asyncio.sleep(self.think)
+
+
+def latency_report(values):
+    values = sorted(values)
+    return {
+        'count': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 2),
+        'p95_ms': round(percentile(values, 95) * 1000, 2),
+        'p99_ms': round(percentile(values, 99) * 1000, 2),
+        'max_ms': round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+def db_wait_snapshot():
+    import database
+    return {getattr(database, name).name: getattr(database, name).snapshot() for name in DB_WAIT_METRICS}
+
+
+def db_wait_report(before, after):
+    """Ожидание базы за прогон: число ожиданий, среднее и суммарное время"""
+    report = {}
+    for name in before:
+        count = after[name][0] - before[name][0]
+        total = after[name][1] - before[name][1]
+        report[name] = {
+            'count': count,
+            'avg_ms': round(total / count * 1000, 3) if count else 0.0,
+            'total_s': round(total, 3),
+        }
+    return report
+
+
+async def run(args, workdir):
+    os.chdir(workdir)
+    os.environ.update(
+        BOT_TOKEN='42:fake',
+        BOT_MODE='polling',
+        METRICS_PORT='',
+        LOG_LEVEL=args.log_level,
+        THROTTLE_WINDOW=str(args.throttle_window),
+    )
+    import main
+
+    main.bot.session = FakeSession()
+    connection = sqlite3.connect('transport_expenses.db')
+    # Сначала доступные маршруты; если их меньше, чем водителей,
+    # водители начинают и уже выполненные
+    routes = [row[0] for row in connection.execute(
+        "SELECT id FROM routes ORDER BY status != 'open', id"
+    )]
+    connection.close()
+
+    fleet = Fleet(main, routes, args.think_ms / 1000)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def driver(index):
+        async with semaphore:
+            await fleet.drive(index)
+
+    await main.dp.emit_startup(bot=main.bot, dispatcher=main.dp)
+    db_before = db_wait_snapshot()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(driver(index) for index in range(args.drivers)))
+        elapsed = time.perf_counter() - started
+        db_after = db_wait_snapshot()
+    finally:
+        await main.dp.emit_shutdown(bot=main.bot, dispatcher=main.dp)
+        await main.db.close()
+
+    updates = sum(len(values) for values in fleet.latencies.values())
+    return {
+        'drivers': args.drivers,
+        'concurrency': args.concurrency,
+        'updates': updates,
+        'seconds': round(elapsed, 3),
+        'updates_per_second': round(updates / elapsed, 1),
+        'latency': latency_report(list(itertools.chain.from_iterable(fleet.latencies.values()))),
+        'latency_by_step': {step: latency_report(values) for step, values in fleet.latencies.items()},
+        'errors': dict(fleet.errors),
+        'bot_api_calls': dict(main.bot.session.calls),
+        'db_wait': db_wait_report(db_before, db_after),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с виртуальными водителями")
+    parser.add_argument('--drivers', type=int, default=1000, help="число виртуальных водителей")
+    parser.add_argument('--concurrency', type=int, default=100,
+                        help="сколько водителей проходят сценарий одновременно")
+    parser.add_argument('--think-ms', type=float, default=0,
+                        help="пауза водителя между шагами, мс")
+    parser.add_argument('--routes', type=int, default=1000, help="маршрутов в тестовой базе")
+    parser.add_argument('--history-drivers', type=int, default=100,
+                        help="водителей с историей в тестовой базе")
+    parser.add_argument('--throttle-window', type=float, default=0,
+                        help="THROTTLE_WINDOW бота; 0 — не гасить повторы водителя")
+    parser.add_argument('--workdir', help="каталог с базой бота (по умолчанию временный)")
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help="записать результат в JSON-файл")
+    args = parser.parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    with tempfile.TemporaryDirectory() as temporary:
+        workdir = args.workdir or temporary
+        db_file = os.path.join(workdir, 'transport_expenses.db')
+        if not os.path.exists(db_file):
+            generate(db_file, drivers=args.history_drivers, routes=args.routes,
+                     executions_per_driver=10, log=lambda *a: None)
+        report = asyncio.run(run(args, workdir))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + '\n', encoding='utf-8')
+    print(text)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
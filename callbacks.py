@@ -0,0 +1,130 @@
+"""Компактный формат callback_data для инлайн-кнопок.
+
+Telegram ограничивает callback_data 64 байтами, поэтому данные кнопки
+записываются как короткий префикс действия и аргументы, разделённые
+двоеточием: "e:2n9c" — показать расход с id 123456. Целые числа
+записываются в base36, строки — как есть.
+
+Все кнопки обрабатывает один CallbackRouter: префикс разбирается один
+раз, а обработчик и типы аргументов находятся по нему в словаре.
+"""
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.filters import Filter
+
+SEPARATOR = ":"
+# Ограничение Telegram на размер callback_data в байтах
+MAX_CALLBACK_DATA_BYTES = 64
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Префиксы действий
+EXPENSE_TYPE = "t"
+EXPENSE_DETAILS = "e"
+EXPENSE_RECEIPT = "rc"
+EXPENSES_PAGE = "ep"
+ROUTE_DETAILS = "r"
+ROUTE_START = "rs"
+ROUTE_FINISH = "rf"
+ROUTES_BACK = "rb"
+HISTORY_ROUTE = "h"
+HISTORY_PAGE = "hp"
+HISTORY_BACK = "hb"
+
+
+def encode_int(value):
+    """Записать целое число в base36"""
+    if value < 0:
+        return "-" + encode_int(-value)
+    if value == 0:
+        return "0"
+    digits = []
+    while value:
+        value, remainder = divmod(value, 36)
+        digits.append(DIGITS[remainder])
+    return "".join(reversed(digits))
+
+
+def decode_int(text):
+    """Прочитать целое число из base36"""
+    return int(text, 36)
+
+
+def _encode_arg(arg):
+    if isinstance(arg, str):
+        if SEPARATOR in arg:
+            raise ValueError(f"Аргумент callback_data содержит '{SEPARATOR}': {arg}")
+        return arg
+    return encode_int(int(arg))
+
+
+def pack(prefix, *args):
+    """Упаковать действие и аргументы (целые числа или строки) в callback_data"""
+    data = SEPARATOR.join([prefix, *(_encode_arg(arg) for arg in args)])
+    if len(data.encode()) > MAX_CALLBACK_DATA_BYTES:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA_BYTES} байт: {data}")
+    return data
+
+
+def unpack(data):
+    """Разобрать callback_data: (префикс, [части аргументов как строки])"""
+    if not data:
+        return None, []
+    prefix, *parts = data.split(SEPARATOR)
+    return prefix, parts
+
+
+class CallbackRouter(Filter):
+    """Таблица действий инлайн-кнопок.
+
+    Регистрируется в aiogram одним обработчиком callback_query и сам
+    служит его фильтром: разбирает callback_data, находит действие по
+    префиксу и передаёт в обработчик разобранные аргументы как args.
+    Обработчик получает только те параметры, которые объявил (как
+    обычный обработчик aiogram). Кнопки с неизвестным префиксом или
+    неверными аргументами фильтр не пропускает.
+
+    Фильтр асинхронный: синхронные фильтры (в том числе F.data...)
+    aiogram выполняет в отдельном потоке на каждую проверку.
+    """
+
+    def __init__(self):
+        # префикс -> (типы аргументов, обработчик)
+        self._actions = {}
+
+    def action(self, prefix, *types):
+        """Декоратор: обработчик кнопок с префиксом и аргументами типов types"""
+        def register(handler):
+            if prefix in self._actions:
+                raise ValueError(f"Действие {prefix!r} уже зарегистрировано")
+            self._actions[prefix] = (types, CallableObject(handler))
+            return handler
+        return register
+
+    def resolve(self, data):
+        """Найти действие: (обработчик, аргументы) или None"""
+        prefix, parts = unpack(data)
+        action = self._actions.get(prefix)
+        if action is None:
+            return None
+        types, handler = action
+        if len(parts) != len(types):
+            return None
+        try:
+            args = [decode_int(part) if kind is int else part for kind, part in zip(types, parts)]
+        except ValueError:
+            return None
+        return handler, args
+
+    async def __call__(self, callback):
+        resolved = self.resolve(callback.data)
+        if resolved is None:
+            return False
+        handler, args = resolved
+        return {"action": handler, "args": args}
+
+    async def dispatch(self, callback, action, **data):
+        """Обработчик aiogram: вызвать обработчик найденного действия"""
+        return await action.call(callback, **data)
+
+    def register(self, observer):
+        """Подключить таблицу к dp.callback_query"""
+        observer.register(self.dispatch, self)
@@ -0,0 +1,268 @@
+"""Проверка планов выполнения SQL-запросов проекта.
+
+Собирает запросы из исходников (строковые литералы, их конкатенации,
+дописывание через += и страничные варианты запросов
+Database._fetch_page), выполняет для
+каждого EXPLAIN QUERY PLAN на схеме после всех миграций и печатает
+планы. Запросы бота (database.py) выполняются на каждое действие
+водителя, поэтому полный просмотр таблицы в них считается ошибкой:
+скрипт завершается с кодом 1.
+
+В f-строках подставляемые значения заменяются на ?, как для
+placeholders(ids). Если такой запрос не разбирается (подставлялось
+имя колонки или часть SQL), он пропускается и помечается skip.
+
+Примеры:
+    python check_query_plans.py
+    python check_query_plans.py --db transport_expenses.db --verbose
+"""
+import argparse
+import ast
+import re
+import sqlite3
+import sys
+from pathlib import Path
+
+from database import _page_query
+from migrations import migrate
+
+ROOT = Path(__file__).resolve().parent
+
+# Файлы с запросами; шаблоны относительно корня проекта
+SOURCES = ['database.py', 'storage.py', 'dashboard.py', 'pages/*.py']
+# Запросы из этих файлов выполняются на горячем пути бота
+HOT_SOURCES = {'database.py', 'storage.py'}
+
+SQL_START = re.compile(r'\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|WITH)\b', re.IGNORECASE)
+# Полный просмотр таблицы: SCAN без индекса
+FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)\S+$')
+
+
+class Query:
+    def __init__(self, sql, source, line, hot, template=False):
+        self.sql = sql
+        self.source = source
+        self.line = line
+        self.hot = hot
+        # Запрос собран из f-строки с заменой подстановок на ?
+        self.template = template
+        self.plan = []
+        self.error = None
+        self.skipped = None
+
+    @property
+    def title(self):
+        return " ".join(self.sql.split())[:100]
+
+    @property
+    def scans(self):
+        return [detail for _, detail in self.plan if FULL_SCAN.match(detail)]
+
+    @property
+    def failed(self):
+        return self.error is not None or (self.hot and bool(self.scans))
+
+
+class _Template(str):
+    """Текст запроса, собранный из f-строки"""
+
+
+class _Collector(ast.NodeVisitor):
+    """Собирает SQL из одного модуля"""
+
+    def __init__(self, tree):
+        self.queries = []
+        # Строковые константы модуля: имя -> значение
+        self.constants = {}
+        # Строковые переменные текущей функции
+        self.variables = {}
+        for node in tree.body:
+            if isinstance(node, ast.Assign) and len(node.targets) == 1:
+                target = node.targets[0]
+                value = self.evaluate(node.value)
+                if isinstance(target, ast.Name) and value is not None:
+                    self.constants[target.id] = value
+
+    def evaluate(self, node):
+        """Значение строкового выражения или None, если его не вычислить"""
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            return node.value
+        if isinstance(node, ast.Name):
+            return self.variables.get(node.id, self.constants.get(node.id))
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            left, right = self.evaluate(node.left), self.evaluate(node.right)
+            if left is not None and right is not None:
+                return self._join(left, right)
+        if isinstance(node, ast.JoinedStr):
+            parts = [
+                value.value if isinstance(value, ast.Constant) else '?'
+                for value in node.values
+            ]
+            return _Template(''.join(parts))
+        return None
+
+    @staticmethod
+    def _join(left, right):
+        if isinstance(left, _Template) or isinstance(right, _Template):
+            return _Template(left + right)
+        return left + right
+
+    def add(self, sql, node):
+        if sql is not None and SQL_START.match(sql):
+            self.queries.append((sql, node.lineno))
+
+    def visit_Constant(self, node):
+        self.add(self.evaluate(node), node)
+
+    def visit_JoinedStr(self, node):
+        # Части f-строки по отдельности — не запросы
+        self.add(self.evaluate(node), node)
+
+    def visit_BinOp(self, node):
+        self.add(self.evaluate(node), node)
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        variables, self.variables = self.variables, {}
+        self.generic_visit(node)
+        self.variables = variables
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Assign(self, node):
+        self.generic_visit(node)
+        target = node.targets[0]
+        if len(node.targets) == 1 and isinstance(target, ast.Name):
+            value = self.evaluate(node.value)
+            if value is None:
+                self.variables.pop(target.id, None)
+            else:
+                self.variables[target.id] = value
+
+    def visit_AugAssign(self, node):
+        # query += " AND ...": запрос с дописанным условием
+        self.generic_visit(node)
+        if (isinstance(node.op, ast.Add) and isinstance(node.target, ast.Name)
+                and node.target.id in self.variables):
+            tail = self.evaluate(node.value)
+            if tail is None:
+                del self.variables[node.target.id]
+                return
+            sql = self.variables[node.target.id] = self._join(self.variables[node.target.id], tail)
+            self.add(sql, node)
+
+    def visit_Call(self, node):
+        # Страницы Database._fetch_page(query, params, key_columns, ...)
+        function = node.func
+        if (isinstance(function, ast.Attribute) and function.attr == '_fetch_page'
+                and len(node.args) >= 3):
+            query = self.evaluate(node.args[0])
+            key_columns = node.args[2]
+            if query is not None and isinstance(key_columns, ast.Tuple):
+                columns = [self.evaluate(element) for element in key_columns.elts]
+                if None not in columns:
+                    for direction in ('older', 'newer'):
+                        for with_cursor in (False, True):
+                            self.add(_page_query(query, columns, direction, with_cursor), node)
+        self.generic_visit(node)
+
+
+def collect_queries(root=ROOT, sources=SOURCES):
+    """Все запросы из исходников без повторов"""
+    queries = []
+    seen = set()
+    for pattern in sources:
+        for path in sorted(root.glob(pattern)):
+            source = path.relative_to(root).as_posix()
+            tree = ast.parse(path.read_text(encoding='utf-8'))
+            collector = _Collector(tree)
+            collector.visit(tree)
+            for sql, line in collector.queries:
+                key = " ".join(sql.split())
+                if key in seen:
+                    continue
+                seen.add(key)
+                queries.append(Query(sql, source, line, source in HOT_SOURCES,
+                                     isinstance(sql, _Template)))
+    return queries
+
+
+def explain(connection, query):
+    """Заполнить план запроса: список (глубина, описание шага)"""
+    try:
+        rows = connection.execute(
+            'EXPLAIN QUERY PLAN ' + query.sql,
+            [None] * query.sql.count('?')
+        ).fetchall()
+    except sqlite3.Error as error:
+        if query.template:
+            query.skipped = str(error)
+        else:
+            query.error = str(error)
+        return
+
+    depth = {0: -1}
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        query.plan.append((depth[node_id], detail))
+
+
+def open_schema(db_file=None):
+    """Соединение со схемой: существующая база только для чтения или новая в памяти"""
+    if db_file:
+        return sqlite3.connect(Path(db_file).resolve().as_uri() + '?mode=ro', uri=True)
+    connection = sqlite3.connect(':memory:')
+    migrate(connection)
+    return connection
+
+
+def report(queries, verbose=False, out=sys.stdout):
+    """Напечатать планы всех запросов"""
+    for query in queries:
+        if query.failed:
+            status = 'FAIL'
+        elif query.skipped:
+            status = 'skip'
+        else:
+            status = 'ok' if query.hot else '--'
+        print(f"[{status}] {query.source}:{query.line}  {query.title}", file=out)
+        if verbose:
+            for line in query.sql.strip().splitlines():
+                print(f"        | {line.strip()}", file=out)
+        if query.error:
+            print(f"        ошибка: {query.error}", file=out)
+        if query.skipped:
+            print(f"        не проверен (f-строка): {query.skipped}", file=out)
+        for depth, detail in query.plan:
+            print(f"        {'  ' * depth}{detail}", file=out)
+        print(file=out)
+
+    failed = [query for query in queries if query.failed]
+    hot = sum(query.hot for query in queries)
+    skipped = sum(bool(query.skipped) for query in queries)
+    print(
+        f"Запросов: {len(queries)}, горячих: {hot}, с ошибками: {len(failed)}, "
+        f"пропущено: {skipped}",
+        file=out
+    )
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка планов SQL-запросов")
+    parser.add_argument('--db', help="проверять на существующей базе (с её статистикой)")
+    parser.add_argument('--verbose', action='store_true', help="печатать текст запросов")
+    args = parser.parse_args(argv)
+
+    queries = collect_queries()
+    connection = open_schema(args.db)
+    try:
+        for query in queries:
+            explain(connection, query)
+    finally:
+        connection.close()
+    return 1 if report(queries, args.verbose) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,7 +2,9 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 from datetime import datetime, timedelta
-from database import Database
+import os
+import threading
+from database import get_connection_manager, last_change_seq, read_changes, LOCAL_TIMEZONE
 
 # Настройка страницы
 st.set_page_config(
@@ -13,58 +15,137 @@ st.set_page_config(
 
 @st.cache_resource
 def get_database_connection():
-    return Database('transport_expenses.db')
+    return get_connection_manager('transport_expenses.db')
+
+def to_local_datetime(column):
+    """Перевести колонку с миллисекундами Unix в локальное время"""
+    return pd.to_datetime(column, unit='ms', utc=True).dt.tz_convert(LOCAL_TIMEZONE).dt.tz_localize(None)
+
+# Расходы с информацией о водителях
+EXPENSES_QUERY = """
+    SELECT 
+        e.id,
+        e.driver_id,
+        d.full_name as driver_name,
+        e.expense_type,
+        e.amount,
+        e.comment,
+        e.created_at
+    FROM expenses e
+    JOIN drivers d ON e.driver_id = d.telegram_id
+"""
+
+# Маршруты с их выполнениями
+ROUTES_QUERY = """
+    SELECT 
+        r.id,
+        r.route_name,
+        r.start_point,
+        r.end_point,
+        r.distance,
+        r.price,
+        r.cargo_type,
+        re.id as execution_id,
+        re.status,
+        d.full_name as driver_name,
+        re.start_time,
+        re.end_time
+    FROM routes r
+    LEFT JOIN route_executions re ON r.id = re.route_id
+    LEFT JOIN drivers d ON re.driver_id = d.telegram_id
+"""
+
+def placeholders(values):
+    return ', '.join('?' * len(values))
+
+def load_expenses(conn, ids=None):
+    """Расходы: все или только с id из ids"""
+    query, params = EXPENSES_QUERY, None
+    if ids is not None:
+        query += f" WHERE e.id IN ({placeholders(ids)})"
+        params = list(ids)
+    expenses_df = pd.read_sql(query, conn, params=params)
+    # Преобразуем created_at в datetime
+    expenses_df['created_at'] = to_local_datetime(expenses_df['created_at'])
+    return expenses_df
+
+def load_routes(conn, route_ids=None):
+    """Маршруты с выполнениями: все или только маршруты с id из route_ids"""
+    query, params = ROUTES_QUERY, None
+    if route_ids is not None:
+        query += f" WHERE r.id IN ({placeholders(route_ids)})"
+        params = list(route_ids)
+    routes_df = pd.read_sql(query, conn, params=params)
+    # Преобразуем start_time и end_time в datetime
+    routes_df['start_time'] = to_local_datetime(routes_df['start_time'])
+    routes_df['end_time'] = to_local_datetime(routes_df['end_time'])
+    return routes_df
+
+def replace_rows(df, key, ids, fresh):
+    """Заменить строки df с key из ids строками fresh"""
+    return pd.concat([df[~df[key].isin(ids)], fresh], ignore_index=True)
+
+class DashboardData:
+    """Данные панели в памяти, общие для всех сессий Streamlit.
+
+    Загружаются целиком один раз, а затем по журналу изменений
+    (database.read_changes) перечитываются только измененные расходы и
+    маршруты.
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self.seq = None
+        self.expenses = None
+        self.routes = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Применить изменения и вернуть копии (расходы, маршруты)"""
+        with self._lock, self.manager.reader() as conn:
+            changes = None
+            if self.seq is not None:
+                seq, changes = read_changes(conn, self.seq)
+            # Имена водителей есть во всех строках: проще загрузить заново
+            if changes is None or 'drivers' in changes:
+                # Номер берется до загрузки: то, что изменится во время
+                # загрузки, будет перечитано в следующий раз
+                self.seq = last_change_seq(conn)
+                self.expenses = load_expenses(conn)
+                self.routes = load_routes(conn)
+            else:
+                expense_ids = list(changes.get('expenses', ()))
+                if expense_ids:
+                    self.expenses = replace_rows(
+                        self.expenses, 'id', expense_ids, load_expenses(conn, expense_ids)
+                    )
+                # Выполнение меняет строки своего маршрута: и прежнего
+                # (если выполнение удалено или перенесено), и текущего
+                route_ids = set(changes.get('routes', ()))
+                execution_ids = list(changes.get('route_executions', ()))
+                if execution_ids:
+                    route_ids.update(
+                        self.routes.loc[self.routes['execution_id'].isin(execution_ids), 'id']
+                    )
+                    route_ids.update(row[0] for row in conn.execute(
+                        f"SELECT route_id FROM route_executions WHERE id IN ({placeholders(execution_ids)})",
+                        execution_ids
+                    ))
+                if route_ids:
+                    route_ids = [int(route_id) for route_id in route_ids]
+                    self.routes = replace_rows(
+                        self.routes, 'id', route_ids, load_routes(conn, route_ids)
+                    )
+                self.seq = seq
+            return self.expenses.copy(), self.routes.copy()
 
-# Загрузка данных
-@st.cache_data
-def load_data():
-    with get_database_connection() as db:
-        conn = db.get_connection()
-        
-        # Загрузка расходов с информацией о водителях
-        expenses_df = pd.read_sql("""
-            SELECT 
-                e.id,
-                e.driver_id,
-                d.full_name as driver_name,
-                e.expense_type,
-                e.amount,
-                e.comment,
-                e.created_at
-            FROM expenses e
-            JOIN drivers d ON e.driver_id = d.telegram_id
-        """, conn)
-        
-        # Преобразуем created_at в datetime
-        expenses_df['created_at'] = pd.to_datetime(expenses_df['created_at'])
-        
-        # Загрузка маршрутов
-        routes_df = pd.read_sql("""
-            SELECT 
-                r.id,
-                r.route_name,
-                r.start_point,
-                r.end_point,
-                r.distance,
-                r.price,
-                r.cargo_type,
-                re.status,
-                d.full_name as driver_name,
-                re.start_time,
-                re.end_time
-            FROM routes r
-            LEFT JOIN route_executions re ON r.id = re.route_id
-            LEFT JOIN drivers d ON re.driver_id = d.telegram_id
-        """, conn)
-        
-        # Преобразуем start_time и end_time в datetime
-        routes_df['start_time'] = pd.to_datetime(routes_df['start_time'])
-        routes_df['end_time'] = pd.to_datetime(routes_df['end_time'])
-        
-        return expenses_df, routes_df
+@st.cache_resource
+def get_dashboard_data():
+    return DashboardData(get_database_connection())
 
 # Загрузка данных
-expenses_df, routes_df = load_data()
+dashboard_data = get_dashboard_data()
+expenses_df, routes_df = dashboard_data.refresh()
 
 # Заголовок дашборда
 st.title("🚛 Дашборд транспортной компании")
@@ -247,4 +328,54 @@ st.subheader("📈 Прогноз расходов")
 # Группировка по месяцам для тренда
 monthly_expenses = expenses_df.groupby(
     pd.Grouper(key='created_at', freq='M')
-)['amount'].sum().reset_index() 
\ No newline at end of file
+)['amount'].sum().reset_index() 
+
+# Чеки из архива (см. receipts.py)
+st.subheader("🧾 Последние чеки")
+
+# Сколько чеков показывать
+RECEIPTS_SHOWN = 12
+
+@st.cache_data
+def load_receipts(start, end, limit, seq):
+    # seq — номер журнала изменений: новые чеки меняют ключ кэша
+    with get_database_connection().reader() as conn:
+        receipts_df = pd.read_sql("""
+            SELECT 
+                e.created_at,
+                d.full_name as driver_name,
+                e.expense_type,
+                e.amount,
+                COALESCE(rf.thumbnail_path, e.receipt_path) as image_path
+            FROM expenses e
+            JOIN drivers d ON e.driver_id = d.telegram_id
+            LEFT JOIN receipt_files rf ON rf.file_unique_id = e.receipt_unique_id
+            WHERE e.receipt_path IS NOT NULL
+            AND e.created_at BETWEEN ? AND ?
+            ORDER BY e.created_at DESC
+            LIMIT ?
+        """, conn, params=(start, end, limit))
+    receipts_df['created_at'] = to_local_datetime(receipts_df['created_at'])
+    return receipts_df
+
+if len(date_range) == 2:
+    # Границы периода заданы в местном времени
+    period = tuple(int(moment.to_pydatetime().timestamp() * 1000) for moment in (start_datetime, end_datetime))
+else:
+    period = (0, int(datetime.now().timestamp() * 1000))
+receipts_df = load_receipts(*period, RECEIPTS_SHOWN, dashboard_data.seq)
+
+if receipts_df.empty:
+    st.info("За выбранный период скачанных чеков нет")
+else:
+    columns = st.columns(4)
+    for index, receipt in enumerate(receipts_df.itertuples()):
+        with columns[index % len(columns)]:
+            caption = (
+                f"{receipt.created_at:%d.%m.%Y %H:%M} · {receipt.driver_name}\n"
+                f"{receipt.expense_type}: {receipt.amount:,.0f} ₸"
+            )
+            if os.path.exists(receipt.image_path):
+                st.image(receipt.image_path, caption=caption, use_container_width=True)
+            else:
+                st.caption(caption + "\n(файл чека не найден)")
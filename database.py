@@ -1,190 +1,794 @@
+import asyncio
+from collections import OrderedDict
+import contextvars
+import functools
+import logging
+import os
+import queue
 import sqlite3
-from datetime import datetime
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
 import random
 import threading
 
+from metrics import REGISTRY, COUNT_BUCKETS
+from migrations import migrate
+
+logger = logging.getLogger(__name__)
+
+# Сколько миллисекунд ждать снятия блокировки другим соединением
+BUSY_TIMEOUT_MS = 5000
+# Размер пула соединений только для чтения
+READER_POOL_SIZE = 4
+# Максимальное число изменений, фиксируемых одной транзакцией
+WRITE_BATCH_SIZE = 256
+# Сколько секунд копить изменения перед фиксацией
+WRITE_BATCH_WINDOW = 0.002
+# Запросы дольше стольких миллисекунд пишутся в журнал (0 — не писать)
+SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '0'))
+
+QUERY_SECONDS = REGISTRY.histogram(
+    'db_query_seconds',
+    'Время выполнения запроса, включая ожидание соединения или фиксации',
+    ['statement']
+)
+QUERY_ROWS = REGISTRY.histogram(
+    'db_query_rows',
+    'Строк прочитано или изменено запросом',
+    ['statement'],
+    buckets=COUNT_BUCKETS
+)
+READER_WAIT_SECONDS = REGISTRY.histogram(
+    'db_reader_wait_seconds',
+    'Ожидание свободного соединения из пула читателей'
+)
+WRITER_LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    'db_writer_lock_wait_seconds',
+    'Ожидание блокировки соединения-писателя'
+)
+WRITE_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    'db_write_queue_wait_seconds',
+    'Время изменения в очереди до начала его транзакции'
+)
+COMMIT_SECONDS = REGISTRY.histogram(
+    'db_commit_seconds',
+    'Длительность фиксации пакета изменений'
+)
+WRITE_BATCH_SIZE_HISTOGRAM = REGISTRY.histogram(
+    'db_write_batch_size',
+    'Изменений в одной транзакции групповой фиксации',
+    buckets=COUNT_BUCKETS
+)
+
+# Время хранится в базе как целое число миллисекунд Unix (UTC)
+def now_ms():
+    """Текущее время в миллисекундах Unix"""
+    return time.time_ns() // 1_000_000
+
+
+def ms_to_datetime(ms):
+    """Перевести миллисекунды Unix в локальный datetime"""
+    return datetime.fromtimestamp(ms / 1000)
+
+
+# Часовой пояс сервера, в котором показывается время
+LOCAL_TIMEZONE = datetime.now().astimezone().tzinfo
+
+
+# Если установлен, изменения возвращают Future вместо ожидания фиксации
+_defer_writes = contextvars.ContextVar('defer_writes', default=False)
+
+
+def deferred_write(method):
+    """Пометить метод, который выполняет ровно одно изменение.
+
+    Такой метод возвращает результат _execute_query(fetch=None), поэтому
+    AsyncDatabase может дождаться фиксации без занятия потока.
+    """
+    method.deferred_write = True
+    return method
+
+
+class WriteQueue:
+    """Очередь изменений с групповой фиксацией.
+
+    Фоновый поток собирает изменения в пакет, пока не наберётся
+    batch_size штук или не пройдёт window секунд с первого из них, и
+    выполняет весь пакет одной транзакцией. Каждое изменение выполняется
+    в своей точке сохранения, так что ошибка одного не отменяет остальные.
+    """
+
+    def __init__(self, manager, batch_size=WRITE_BATCH_SIZE, window=WRITE_BATCH_WINDOW):
+        self._manager = manager
+        self.batch_size = batch_size
+        self.window = window
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run,
+            name='db-writer',
+            daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, query, params=(), result=None):
+        """Поставить изменение в очередь.
+
+        Возвращает Future, который завершается после фиксации транзакции.
+        Результат Future — курсор изменения или result(cursor), если
+        передана функция result.
+        """
+        future = Future()
+        self._queue.put((query, params, result, future, time.perf_counter()))
+        return future
+
+    def close(self):
+        """Зафиксировать оставшиеся изменения и остановить поток"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        item = self._queue.get(timeout=timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        """Выполнить пакет изменений одной транзакцией"""
+        outcomes = []
+        started = time.perf_counter()
+        for *_, enqueued_at in batch:
+            WRITE_QUEUE_WAIT_SECONDS.observe(started - enqueued_at)
+        # Изменения, отмененные до начала записи, не выполняются; после
+        # этого отменить Future уже нельзя
+        batch = [item for item in batch if item[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        WRITE_BATCH_SIZE_HISTOGRAM.observe(len(batch))
+        try:
+            with self._manager.writer() as connection:
+                # IMMEDIATE сразу берет блокировку записи: при нескольких
+                # процессах (workers.py) ожидание идет через busy_timeout
+                if not connection.in_transaction:
+                    connection.execute('BEGIN IMMEDIATE')
+                for query, params, result, future, _ in batch:
+                    connection.execute('SAVEPOINT write_item')
+                    try:
+                        cursor = connection.execute(query, params)
+                        value = result(cursor) if result else cursor
+                        outcomes.append((future, value, None))
+                    except Exception as error:
+                        connection.execute('ROLLBACK TO write_item')
+                        outcomes.append((future, None, error))
+                    connection.execute('RELEASE write_item')
+                commit_started = time.perf_counter()
+                connection.commit()
+                COMMIT_SECONDS.observe(time.perf_counter() - commit_started)
+        except Exception as error:
+            # Транзакция не зафиксирована: ни одно изменение пакета не сохранено
+            for _, _, _, future, _ in batch:
+                future.set_exception(error)
+            return
+
+        for future, value, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(value)
+
+
+class ConnectionManager:
+    """Соединения с базой данных: один писатель и пул читателей.
+
+    База переводится в режим WAL, поэтому читатели не ждут писателя, а
+    писатель не ждёт читателей. Все изменения идут через единственное
+    соединение-писатель под блокировкой.
+    """
+
+    def __init__(self, db_file, readers=READER_POOL_SIZE, busy_timeout=BUSY_TIMEOUT_MS):
+        self.db_file = db_file
+        self.readers = readers
+        self.busy_timeout = busy_timeout
+        self._write_lock = threading.Lock()
+        self._writer = self._open(db_file)
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        # Изменения фиксируются пакетами, поэтому fsync на каждую
+        # транзакцию обходится дёшево и даёт настоящую надёжность записи
+        self._writer.execute('PRAGMA synchronous=FULL')
+
+        # Создаем или обновляем схему
+        migrate(self._writer)
+
+        # База в памяти видна только своему соединению, пул не нужен
+        self._in_memory = db_file == ':memory:'
+        self._idle_readers = queue.LifoQueue()
+        self._opened_readers = []
+        self._readers_lock = threading.Lock()
+        self._writes = None
+        self._writes_lock = threading.Lock()
+
+    def _open(self, database, uri=False):
+        """Открыть соединение с общими настройками"""
+        connection = sqlite3.connect(
+            database,
+            uri=uri,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False
+        )
+        connection.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout)}')
+        return connection
+
+    def _open_reader(self):
+        """Открыть соединение только для чтения"""
+        uri = Path(self.db_file).resolve().as_uri() + '?mode=ro'
+        connection = self._open(uri, uri=True)
+        connection.execute('PRAGMA query_only = 1')
+        return connection
+
+    def _acquire_reader(self):
+        """Взять свободного читателя из пула или открыть нового"""
+        try:
+            return self._idle_readers.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._readers_lock:
+            if len(self._opened_readers) < self.readers:
+                connection = self._open_reader()
+                self._opened_readers.append(connection)
+                return connection
+
+        return self._idle_readers.get()
+
+    @contextmanager
+    def reader(self):
+        """Соединение для чтения из пула"""
+        if self._in_memory:
+            with self._locked_writer():
+                yield self._writer
+            return
+
+        started = time.perf_counter()
+        connection = self._acquire_reader()
+        READER_WAIT_SECONDS.observe(time.perf_counter() - started)
+        try:
+            yield connection
+        finally:
+            self._idle_readers.put(connection)
+
+    @contextmanager
+    def _locked_writer(self):
+        """Блокировка писателя с учетом времени ожидания"""
+        started = time.perf_counter()
+        with self._write_lock:
+            WRITER_LOCK_WAIT_SECONDS.observe(time.perf_counter() - started)
+            yield
+
+    @contextmanager
+    def writer(self):
+        """Соединение для записи; транзакция фиксируется при выходе"""
+        with self._locked_writer():
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def submit(self, query, params=(), result=None):
+        """Поставить изменение в очередь групповой фиксации (см. WriteQueue)"""
+        if self._writes is None:
+            with self._writes_lock:
+                if self._writes is None:
+                    self._writes = WriteQueue(self)
+        return self._writes.submit(query, params, result)
+
+    def close(self):
+        """Закрыть все соединения"""
+        with _managers_lock:
+            if _managers.get(self._key) is self:
+                del _managers[self._key]
+        if self._writes is not None:
+            self._writes.close()
+            self._writes = None
+        with self._readers_lock:
+            for connection in self._opened_readers:
+                connection.close()
+            self._opened_readers.clear()
+        with self._write_lock:
+            self._writer.close()
+
+    @property
+    def _key(self):
+        return os.path.abspath(self.db_file)
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_connection_manager(db_file):
+    """Получить общий для процесса менеджер соединений к файлу базы"""
+    if db_file == ':memory:':
+        return ConnectionManager(db_file)
+
+    key = os.path.abspath(db_file)
+    with _managers_lock:
+        manager = _managers.get(key)
+        if manager is None:
+            manager = ConnectionManager(db_file)
+            _managers[key] = manager
+        return manager
+
+
+# Сколько строк журнала changes читать одним запросом
+CHANGES_PAGE_SIZE = 1000
+
+
+def last_change_seq(connection):
+    """Номер последнего изменения в журнале changes (0 — изменений не было)"""
+    # Очистка журнала оставляет последнюю строку, поэтому MAX(seq) не убывает
+    return connection.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+
+
+def read_changes(connection, since, limit=CHANGES_PAGE_SIZE):
+    """Изменения из журнала changes после номера since.
+
+    Журнал читается страницами по limit строк до конца. Возвращает
+    (seq, changes): seq — номер последнего прочитанного изменения,
+    changes — {таблица: {id: последняя операция}}. Вместо changes
+    возвращается None, если данные надо загрузить заново целиком:
+    изменения после since уже удалены из журнала или данные были
+    сброшены. Номер для следующего чтения тогда берется из
+    last_change_seq до загрузки.
+    """
+    seq, changes = since, {}
+    while True:
+        rows = connection.execute('''
+            SELECT seq, entity, entity_id, op
+            FROM changes
+            WHERE seq > ?
+            ORDER BY seq
+            LIMIT ?
+        ''', (seq, limit)).fetchall()
+        if not rows:
+            return seq, changes
+        # Номера идут подряд, пропуск значит, что журнал уже очищен
+        if rows[0][0] != seq + 1:
+            return since, None
+
+        for _, entity, entity_id, op in rows:
+            if op == 'reset':
+                return since, None
+            changes.setdefault(entity, {})[entity_id] = op
+        seq = rows[-1][0]
+        if len(rows) < limit:
+            return seq, changes
+
+
+# Кэш каталога маршрутов: размер, время жизни записи и как часто (в
+# секундах) сверять версию каталога с базой, чтобы увидеть изменения
+# из других процессов
+ROUTES_CACHE_SIZE = 256
+ROUTES_CACHE_TTL = 60
+CATALOGUE_VERSION_CHECK_INTERVAL = 1.0
+
+
+class VersionedCache:
+    """LRU-кэш с временем жизни записей и версией данных.
+
+    Запись считается действительной, только пока версия данных совпадает
+    с версией, при которой она была сохранена. Поэтому для сброса кэша
+    достаточно изменить версию.
+    """
+
+    def __init__(self, maxsize=ROUTES_CACHE_SIZE, ttl=ROUTES_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """Получить (найдено, значение) для ключа при данной версии"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, entry_version, expires_at = entry
+                if entry_version == version and expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, version, value):
+        """Сохранить значение, вытеснив самую старую запись при переполнении"""
+        with self._lock:
+            self._entries[key] = (value, version, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Удалить все записи"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Счетчики попаданий и промахов"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries)
+            }
+
+
+# Размер страницы в списках расходов и истории маршрутов
+PAGE_SIZE = 10
+
+# Расходы водителя; ключ страницы (created_at, id) выбирается последним
+_EXPENSES_QUERY = '''
+    SELECT 
+        e.id,
+        e.amount,
+        e.expense_type,
+        e.receipt_photo,
+        e.comment,
+        e.created_at,
+        r.route_name,
+        e.created_at,
+        e.id
+    FROM expenses e
+    LEFT JOIN route_executions re ON e.route_execution_id = re.id
+    LEFT JOIN routes r ON re.route_id = r.id
+    WHERE e.driver_id = ?
+'''
+
+# Завершенные маршруты водителя; ключ страницы (end_time, id выполнения)
+_COMPLETED_ROUTES_QUERY = '''
+    SELECT 
+        r.id,
+        r.route_name,
+        r.start_point,
+        r.end_point,
+        re.start_time,
+        re.end_time,
+        r.distance,
+        r.price,
+        re.end_time,
+        re.id
+    FROM route_executions re
+    JOIN routes r ON re.route_id = r.id
+    WHERE re.driver_id = ? 
+    AND re.status = 'completed'
+'''
+
+
+def _page_query(query, key_columns, direction, with_cursor):
+    """Дополнить запрос условием и порядком страницы по ключу (время, id)"""
+    time_column, id_column = key_columns
+    if direction == 'newer':
+        comparison, order = '>', 'ASC'
+    else:
+        comparison, order = '<', 'DESC'
+
+    # Строкам без времени (миграция 4 оставляет NULL вместо нераспознанной
+    # даты) нельзя выдать курсор, поэтому в постраничный список они не попадают
+    query += f' AND {time_column} IS NOT NULL'
+    if with_cursor:
+        query += f' AND ({time_column}, {id_column}) {comparison} (?, ?)'
+    return query + f' ORDER BY {time_column} {order}, {id_column} {order} LIMIT ?'
+
+
+def _expense_from_row(expense):
+    """Преобразовать строку _EXPENSES_QUERY в словарь расхода"""
+    return {
+        'id': expense[0],
+        'amount': float(expense[1]),
+        'type': expense[2],
+        'receipt': expense[3],
+        'comment': expense[4],
+        'date': ms_to_datetime(expense[5]) if expense[5] is not None else datetime.now(),
+        'timestamp': expense[5],
+        'route': expense[6] if expense[6] else 'Без маршрута'
+    }
+
+
+def _completed_route_from_row(route):
+    """Преобразовать строку _COMPLETED_ROUTES_QUERY в кортеж маршрута"""
+    route_id, name, start, end, start_time, end_time, distance, price = route[:8]
+    return (
+        route_id, name, start, end,
+        ms_to_datetime(start_time) if start_time is not None else None,
+        ms_to_datetime(end_time) if end_time is not None else None,
+        distance, price
+    )
+
+
+def _record_query(name, started):
+    """Учесть время запроса и записать медленный запрос в журнал"""
+    elapsed = time.perf_counter() - started
+    QUERY_SECONDS.observe(elapsed, statement=name)
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        logger.warning("Медленный запрос %s: %.1f мс", name, elapsed * 1000)
+
+
 class Database:
     def __init__(self, db_file):
         self.db_file = db_file
-        self.connection = None
-        self._lock = threading.Lock()
-        self._connect()
-    
-    def _connect(self):
-        """Установить соединение с базой данных"""
-        if not self.connection:
-            self.connection = sqlite3.connect(self.db_file, check_same_thread=False)
-            
-            # Создаем таблицу drivers если её нет
-            self._execute_query('''
-                CREATE TABLE IF NOT EXISTS drivers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER UNIQUE NOT NULL,
-                    full_name TEXT NOT NULL,
-                    phone TEXT NOT NULL
-                )
-            ''')
-            
-            # Создаем таблицу routes если её нет
-            self._execute_query('''
-                CREATE TABLE IF NOT EXISTS routes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    route_name TEXT NOT NULL,
-                    start_point TEXT NOT NULL,
-                    end_point TEXT NOT NULL,
-                    distance INTEGER NOT NULL,
-                    price REAL NOT NULL,
-                    cargo_type TEXT
-                )
-            ''')
-            
-            # Создаем таблицу route_executions если её нет
-            self._execute_query('''
-                CREATE TABLE IF NOT EXISTS route_executions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    route_id INTEGER NOT NULL,
-                    driver_id INTEGER NOT NULL,
-                    start_time TIMESTAMP,
-                    end_time TIMESTAMP,
-                    status TEXT DEFAULT 'pending',
-                    FOREIGN KEY (route_id) REFERENCES routes (id),
-                    FOREIGN KEY (driver_id) REFERENCES drivers (id)
-                )
-            ''')
-            
-            # Создаем таблицу expenses если её нет
-            self._execute_query('''
-                CREATE TABLE IF NOT EXISTS expenses (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    driver_id INTEGER NOT NULL,
-                    expense_type TEXT NOT NULL,
-                    amount REAL NOT NULL,
-                    receipt_photo TEXT,
-                    comment TEXT,
-                    route_execution_id INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (driver_id) REFERENCES drivers (id),
-                    FOREIGN KEY (route_execution_id) REFERENCES route_executions (id)
-                )
-            ''')
-            
-            self.connection.commit()
-    
-    def __enter__(self):
-        self._connect()
-        return self
-    
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if exc_type:
-            self.connection.rollback()
-        else:
-            self.connection.commit()
+        self._manager = get_connection_manager(db_file)
+        self._routes_cache = VersionedCache()
+        self._catalogue_version = None
+        self._catalogue_checked_at = 0.0
+        # Растет при каждом изменении каталога этим процессом
+        self._catalogue_generation = 0
+        self._catalogue_lock = threading.Lock()
     
-    def _execute_query(self, query, params=None):
-        """Выполнить запрос с блокировкой"""
-        with self._lock:
-            self._connect()
-            cursor = self.connection.cursor()
-            if params:
-                cursor.execute(query, params)
+    def _execute_query(self, query, params=None, fetch='all', result=None, on_commit=None,
+                       name='query'):
+        """Выполнить запрос.
+
+        fetch='all' или 'one' читает через пул читателей и возвращает
+        строки; fetch=None ставит изменение в очередь групповой фиксации,
+        дожидается её и возвращает курсор (lastrowid, rowcount) или
+        result(cursor). Внутри AsyncDatabase вместо ожидания
+        возвращается Future. on_commit вызывается после фиксации.
+        name — имя запроса в метриках и журнале медленных запросов.
+        """
+        started = time.perf_counter()
+        if fetch is None:
+            def execute(cursor):
+                QUERY_ROWS.observe(max(cursor.rowcount, 0), statement=name)
+                return result(cursor) if result else cursor
+
+            future = self._manager.submit(query, params or (), execute)
+            future.add_done_callback(lambda _: _record_query(name, started))
+            if on_commit is not None:
+                future.add_done_callback(lambda _: on_commit())
+            if _defer_writes.get():
+                return future
+            return future.result()
+
+        with self._manager.reader() as connection:
+            cursor = connection.execute(query, params or ())
+            if fetch == 'one':
+                rows = cursor.fetchone()
+                count = int(rows is not None)
             else:
-                cursor.execute(query)
-            return cursor
+                rows = cursor.fetchall()
+                count = len(rows)
+        QUERY_ROWS.observe(count, statement=name)
+        _record_query(name, started)
+        return rows
+    
+    def ping(self):
+        """Проверить, что база отвечает на запросы"""
+        return self._execute_query('SELECT 1', fetch='one', name='ping')[0] == 1
     
     def driver_exists(self, telegram_id):
         """Проверить существование водителя"""
-        cursor = self._execute_query(
+        result = self._execute_query(
             "SELECT COUNT(*) FROM drivers WHERE telegram_id = ?", 
-            (telegram_id,)
+            (telegram_id,),
+            fetch='one',
+            name='driver_exists'
         )
-        return cursor.fetchone()[0] > 0
+        return result[0] > 0
     
+    @deferred_write
     def add_driver(self, telegram_id, full_name, phone):
         """Добавить нового водителя"""
-        self._execute_query(
+        return self._execute_query(
             "INSERT INTO drivers (telegram_id, full_name, phone) VALUES (?, ?, ?)",
-            (telegram_id, full_name, phone)
+            (telegram_id, full_name, phone),
+            fetch=None,
+            result=lambda cursor: cursor.lastrowid,
+            name='add_driver'
         )
-        self.connection.commit()
     
     def get_active_route(self, driver_id):
-        """Получить активный маршрут водителя"""
-        cursor = self._execute_query('''
-            SELECT r.id, r.route_name, r.start_point, r.end_point, re.start_time
+        """Получить активный маршрут водителя:
+        (id маршрута, название, откуда, куда, начало, id выполнения)"""
+        result = self._execute_query('''
+            SELECT r.id, r.route_name, r.start_point, r.end_point, re.start_time, re.id
             FROM route_executions re
             JOIN routes r ON r.id = re.route_id
             WHERE re.driver_id = ? AND re.status = 'in_progress'
-        ''', (driver_id,))
-        result = cursor.fetchone()
+        ''', (driver_id,), fetch='one', name='get_active_route')
         if result:
-            route_id, name, start, end, start_time = result
-            start_time = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S.%f')
-            return route_id, name, start, end, start_time
+            route_id, name, start, end, start_time, execution_id = result
+            return route_id, name, start, end, ms_to_datetime(start_time), execution_id
         return None
     
+    def get_catalogue_version(self):
+        """Версия каталога маршрутов (растет при любом изменении маршрутов)"""
+        now = time.monotonic()
+        version = self._catalogue_version
+        if version is None or now - self._catalogue_checked_at >= CATALOGUE_VERSION_CHECK_INTERVAL:
+            generation = self._catalogue_generation
+            version = self._execute_query(
+                "SELECT version FROM cache_versions WHERE name = 'routes'",
+                fetch='one',
+                name='get_catalogue_version'
+            )[0]
+            with self._catalogue_lock:
+                # Если каталог изменили во время чтения, прочитанная версия
+                # могла устареть: не запоминаем ее, следующий вызов перечитает
+                if generation == self._catalogue_generation:
+                    # Версия только растет; более раннее чтение могло завершиться позже
+                    if self._catalogue_version is not None:
+                        version = max(version, self._catalogue_version)
+                    self._catalogue_version = version
+                    self._catalogue_checked_at = now
+        return version
+    
+    def _invalidate_catalogue(self):
+        """Перечитать версию каталога при следующем обращении"""
+        with self._catalogue_lock:
+            self._catalogue_generation += 1
+            self._catalogue_version = None
+    
+    def _cached_catalogue(self, key, load):
+        """Прочитать данные каталога маршрутов через кэш"""
+        version = self.get_catalogue_version()
+        found, value = self._routes_cache.get(key, version)
+        if not found:
+            value = load()
+            self._routes_cache.set(key, version, value)
+        return value
+    
+    def cache_stats(self):
+        """Счетчики кэша каталога маршрутов"""
+        return self._routes_cache.stats()
+    
     def get_available_routes(self):
         """Получить список доступных маршрутов (исключая завершенные)"""
-        cursor = self._execute_query('''
-            SELECT r.id, r.route_name, r.start_point, r.end_point
-            FROM routes r
-            WHERE NOT EXISTS (
-                SELECT 1 
-                FROM route_executions re 
-                WHERE re.route_id = r.id 
-                AND re.status = 'completed'
-            )
-        ''')
-        return cursor.fetchall()
+        return self._cached_catalogue('available_routes', self._load_available_routes)
     
+    def _load_available_routes(self):
+        # Статус маршрута поддерживается триггерами (см. migrations.py)
+        return self._execute_query('''
+            SELECT id, route_name, start_point, end_point
+            FROM routes
+            WHERE status = 'open'
+            ORDER BY id
+        ''', name='get_available_routes')
+    
+    @deferred_write
     def start_route(self, driver_id, route_id):
-        """Начать выполнение маршрута"""
-        self._execute_query(
-            'INSERT INTO route_executions (route_id, driver_id, start_time, status) VALUES (?, ?, ?, ?)',
-            (route_id, driver_id, datetime.now(), 'in_progress')
+        """Начать выполнение маршрута и вернуть id выполнения.
+
+        Возвращает None, если у водителя уже есть маршрут в пути: это
+        проверяет уникальный индекс idx_route_executions_active, поэтому
+        из двух одновременных нажатий маршрут начнет только одно.
+        """
+        return self._execute_query('''
+            INSERT INTO route_executions (route_id, driver_id, start_time, status)
+            VALUES (?, ?, ?, 'in_progress')
+            ON CONFLICT (driver_id) WHERE status = 'in_progress' DO NOTHING
+        ''', (route_id, driver_id, now_ms()),
+            fetch=None,
+            result=lambda cursor: cursor.lastrowid if cursor.rowcount else None,
+            on_commit=self._invalidate_catalogue,
+            name='start_route'
         )
-        self.connection.commit()
     
+    @deferred_write
     def finish_route(self, driver_id, route_id):
-        """Завершить маршрут"""
-        self._execute_query('''
+        """Завершить маршрут; возвращает число завершенных выполнений"""
+        return self._execute_query('''
             UPDATE route_executions 
             SET status = 'completed', 
                 end_time = ? 
             WHERE driver_id = ? 
             AND route_id = ? 
             AND status = 'in_progress'
-        ''', (datetime.now(), driver_id, route_id))
-        self.connection.commit()
+        ''', (now_ms(), driver_id, route_id), fetch=None,
+            result=lambda cursor: cursor.rowcount,
+            on_commit=self._invalidate_catalogue,
+            name='finish_route')
     
     def get_completed_routes(self, driver_id):
         """Получить завершенные маршруты водителя"""
-        cursor = self._execute_query('''
-            SELECT 
-                r.id,
-                r.route_name,
-                r.start_point,
-                r.end_point,
-                re.start_time,
-                re.end_time,
-                r.distance,
-                r.price
-            FROM routes r
-            JOIN route_executions re ON re.route_id = r.id
-            WHERE re.driver_id = ? 
-            AND re.status = 'completed'
-            ORDER BY re.end_time DESC
-        ''', (driver_id,))
-        return cursor.fetchall()
+        routes = self._execute_query(
+            _COMPLETED_ROUTES_QUERY + ' ORDER BY re.end_time DESC',
+            (driver_id,),
+            name='get_completed_routes'
+        )
+        return [_completed_route_from_row(row) for row in routes]
+    
+    def get_route_history_stamp(self, driver_id):
+        """Отметка истории маршрутов водителя: id последнего завершенного
+        выполнения (None, если завершенных нет)"""
+        row = self._execute_query('''
+            SELECT id FROM route_executions
+            WHERE driver_id = ? AND status = 'completed'
+            ORDER BY end_time DESC, id DESC
+            LIMIT 1
+        ''', (driver_id,), fetch='one', name='get_route_history_stamp')
+        return row[0] if row else None
+    
+    def get_completed_routes_page(self, driver_id, cursor=None, direction='older', limit=PAGE_SIZE):
+        """Получить страницу завершенных маршрутов (новые сначала).
+
+        Возвращает словарь: items — маршруты в формате get_completed_routes,
+        older/newer — курсоры соседних страниц или None, если их нет.
+        """
+        rows, older, newer = self._fetch_page(
+            _COMPLETED_ROUTES_QUERY, (driver_id,),
+            ('re.end_time', 're.id'), cursor, direction, limit,
+            name='get_completed_routes_page'
+        )
+        return {
+            'items': [_completed_route_from_row(row) for row in rows],
+            'older': older,
+            'newer': newer
+        }
+    
+    def _fetch_page(self, query, params, key_columns, cursor, direction, limit, name='page'):
+        """Выбрать страницу по ключу (время, id) без OFFSET.
+
+        Ключевые колонки должны быть последними в выборке. cursor — ключ
+        крайней записи показанной страницы; direction='older' выбирает
+        записи после неё, 'newer' — до неё. Возвращает строки без ключевых
+        колонок и курсоры соседних страниц.
+        """
+        query = _page_query(query, key_columns, direction, cursor is not None)
+        params = tuple(params)
+        if cursor is not None:
+            params += tuple(cursor)
+
+        rows = self._execute_query(query, params + (limit + 1,), name=name)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if direction == 'newer':
+            rows.reverse()
+            has_older, has_newer = cursor is not None, has_more
+        else:
+            has_older, has_newer = has_more, cursor is not None
+
+        older = tuple(rows[-1][-2:]) if rows and has_older else None
+        newer = tuple(rows[0][-2:]) if rows and has_newer else None
+        return [row[:-2] for row in rows], older, newer
     
     def close(self):
-        """Закрыть соединение с базой данных"""
-        if self.connection:
-            self.connection.close()
-            self.connection = None
+        """Закрыть соединения с базой данных"""
+        self._manager.close()
     
     def get_route_details(self, route_id):
         """Получить детальную информацию о маршруте"""
-        cursor = self._execute_query('''
+        return self._cached_catalogue(
+            ('route_details', route_id),
+            lambda: self._load_route_details(route_id)
+        )
+    
+    def _load_route_details(self, route_id):
+        result = self._execute_query('''
             SELECT 
                 route_name,
                 start_point,
@@ -194,9 +798,8 @@ class Database:
                 cargo_type
             FROM routes 
             WHERE id = ?
-        ''', (route_id,))
+        ''', (route_id,), fetch='one', name='get_route_details')
         
-        result = cursor.fetchone()
         if result:
             return {
                 'name': result[0],
@@ -208,9 +811,10 @@ class Database:
             }
         return None
     
+    @deferred_write
     def add_test_route(self):
         """Добавить тестовый маршрут"""
-        cursor = self._execute_query('''
+        return self._execute_query('''
             INSERT INTO routes (
                 route_name, 
                 start_point, 
@@ -226,47 +830,94 @@ class Database:
             random.randint(1000, 2000),
             random.randint(100000, 500000),
             "Общие грузы"
-        ))
-        self.connection.commit()
-        return cursor.lastrowid
+        ), fetch=None, result=lambda cursor: cursor.lastrowid,
+            on_commit=self._invalidate_catalogue, name='add_test_route')
     
     def get_driver_expenses(self, driver_id):
         """Получить все расходы водителя"""
-        cursor = self._execute_query('''
-            SELECT 
-                e.id,
-                e.amount,
-                e.expense_type,
-                e.receipt_photo,
-                e.comment,
-                e.created_at,
-                r.route_name
-            FROM expenses e
-            LEFT JOIN route_executions re ON e.route_execution_id = re.id
-            LEFT JOIN routes r ON re.route_id = r.id
-            WHERE e.driver_id = ?
-            ORDER BY e.created_at DESC
-        ''', (driver_id,))
-        
-        expenses = cursor.fetchall()
-        result = []
-        
-        for expense in expenses:
-            result.append({
-                'id': expense[0],
-                'amount': float(expense[1]),
-                'type': expense[2],
-                'receipt': expense[3],
-                'comment': expense[4],
-                'date': datetime.strptime(expense[5], '%Y-%m-%d %H:%M:%S.%f') if expense[5] else datetime.now(),
-                'route': expense[6] if expense[6] else 'Без маршрута'
-            })
-        
-        return result
+        expenses = self._execute_query(
+            _EXPENSES_QUERY + ' ORDER BY e.created_at DESC',
+            (driver_id,),
+            name='get_driver_expenses'
+        )
+        return [_expense_from_row(expense) for expense in expenses]
     
-    def add_expense(self, driver_id, expense_type, amount, receipt_photo, comment, route_execution_id=None):
-        """Добавить новый расход"""
-        self._execute_query('''
+    def get_driver_expenses_page(self, driver_id, cursor=None, direction='older', limit=PAGE_SIZE):
+        """Получить страницу расходов водителя (новые сначала).
+
+        Возвращает словарь: items — расходы в формате get_driver_expenses,
+        older/newer — курсоры соседних страниц или None, если их нет.
+        """
+        rows, older, newer = self._fetch_page(
+            _EXPENSES_QUERY, (driver_id,),
+            ('e.created_at', 'e.id'), cursor, direction, limit,
+            name='get_driver_expenses_page'
+        )
+        return {
+            'items': [_expense_from_row(row) for row in rows],
+            'older': older,
+            'newer': newer
+        }
+    
+    def get_driver_expenses_summary(self, driver_id):
+        """Получить количество и общую сумму расходов водителя"""
+        # Итоги по типам поддерживаются триггерами (см. migrations.py)
+        count, total = self._execute_query('''
+            SELECT COALESCE(SUM(count), 0), COALESCE(SUM(total), 0)
+            FROM expense_totals
+            WHERE driver_id = ? AND kind = 'type'
+        ''', (driver_id,), fetch='one', name='get_driver_expenses_summary')
+        return count, float(total)
+    
+    def get_expense_totals_by_type(self, driver_id):
+        """Количество и сумма расходов водителя по типам: [(тип, количество, сумма)]"""
+        return self._execute_query('''
+            SELECT key, count, total
+            FROM expense_totals
+            WHERE driver_id = ? AND kind = 'type' AND count > 0
+            ORDER BY total DESC
+        ''', (driver_id,), name='get_expense_totals_by_type')
+    
+    def get_expense_totals_by_month(self, driver_id, months=12):
+        """Расходы водителя за последние months месяцев, новые сначала:
+        [('ГГГГ-ММ', количество, сумма)]"""
+        return self._execute_query('''
+            SELECT key, count, total
+            FROM expense_totals
+            WHERE driver_id = ? AND kind = 'month' AND count > 0
+            ORDER BY key DESC
+            LIMIT ?
+        ''', (driver_id, months), name='get_expense_totals_by_month')
+    
+    def get_expense_totals_by_route_execution(self, driver_id, limit=PAGE_SIZE):
+        """Расходы по последним limit выполнениям маршрутов водителя:
+        [(id выполнения, название маршрута, количество, сумма)]"""
+        return self._execute_query('''
+            SELECT t.key, r.route_name, t.count, t.total
+            FROM expense_totals t
+            LEFT JOIN route_executions re ON re.id = t.key
+            LEFT JOIN routes r ON r.id = re.route_id
+            WHERE t.driver_id = ? AND t.kind = 'execution' AND t.count > 0
+            ORDER BY t.key DESC
+            LIMIT ?
+        ''', (driver_id, limit), name='get_expense_totals_by_route_execution')
+    
+    def get_recent_expenses_total(self, driver_id, days=30):
+        """Количество и сумма расходов водителя за последние days дней,
+        включая сегодняшний (по местному времени)"""
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        count, total = self._execute_query('''
+            SELECT COALESCE(SUM(count), 0), COALESCE(SUM(total), 0)
+            FROM expense_totals
+            WHERE driver_id = ? AND kind = 'day' AND key >= ?
+        ''', (driver_id, since), fetch='one', name='get_recent_expenses_total')
+        return count, float(total)
+    
+    @deferred_write
+    def add_expense(self, driver_id, expense_type, amount, receipt_photo, comment, route_execution_id=None,
+                    receipt_unique_id=None):
+        """Добавить новый расход и вернуть его id"""
+        return self._execute_query('''
             INSERT INTO expenses (
                 driver_id, 
                 expense_type, 
@@ -274,8 +925,9 @@ class Database:
                 receipt_photo, 
                 comment, 
                 route_execution_id,
+                receipt_unique_id,
                 created_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             driver_id,
             expense_type,
@@ -283,13 +935,27 @@ class Database:
             receipt_photo,
             comment,
             route_execution_id,
-            datetime.now()
-        ))
-        self.connection.commit()
+            receipt_unique_id,
+            now_ms()
+        ), fetch=None, result=lambda cursor: cursor.lastrowid, name='add_expense')
     
-    def get_expense_by_date(self, driver_id, date_str):
-        """Получить расход по дате"""
-        cursor = self._execute_query('''
+    def get_expense(self, driver_id, expense_id):
+        """Получить расход водителя по id"""
+        return self._execute_query('''
+            SELECT 
+                expense_type,
+                amount,
+                receipt_photo,
+                comment,
+                created_at,
+                receipt_path
+            FROM expenses 
+            WHERE id = ? AND driver_id = ?
+        ''', (expense_id, driver_id), fetch='one', name='get_expense')
+    
+    def get_expense_by_date(self, driver_id, created_at):
+        """Получить расход по времени создания (мс Unix)"""
+        return self._execute_query('''
             SELECT 
                 expense_type,
                 amount,
@@ -298,5 +964,159 @@ class Database:
                 created_at
             FROM expenses 
             WHERE driver_id = ? AND created_at = ?
-        ''', (driver_id, date_str))
-        return cursor.fetchone()
+        ''', (driver_id, created_at), fetch='one', name='get_expense_by_date')
+    
+    def get_receipt_file(self, file_unique_id):
+        """Файл чека в архиве: (путь, путь миниатюры) или None"""
+        return self._execute_query(
+            "SELECT path, thumbnail_path FROM receipt_files WHERE file_unique_id = ?",
+            (file_unique_id,),
+            fetch='one',
+            name='get_receipt_file'
+        )
+    
+    @deferred_write
+    def add_receipt_file(self, file_unique_id, sha256, path, thumbnail_path, size):
+        """Записать скачанный файл чека (повторная запись игнорируется)"""
+        return self._execute_query('''
+            INSERT INTO receipt_files (file_unique_id, sha256, path, thumbnail_path, size, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (file_unique_id) DO NOTHING
+        ''', (file_unique_id, sha256, path, thumbnail_path, size, now_ms()),
+            fetch=None, name='add_receipt_file')
+    
+    @deferred_write
+    def set_expense_receipt_path(self, expense_id, path):
+        """Записать путь к архивной копии чека расхода"""
+        return self._execute_query(
+            "UPDATE expenses SET receipt_path = ? WHERE id = ?",
+            (path, expense_id),
+            fetch=None,
+            result=lambda cursor: cursor.rowcount,
+            name='set_expense_receipt_path'
+        )
+    
+    def get_pending_receipts(self, limit):
+        """Расходы с еще не скачанными чеками: (id, file_id, file_unique_id)"""
+        return self._execute_query('''
+            SELECT id, receipt_photo, receipt_unique_id
+            FROM expenses
+            WHERE receipt_unique_id IS NOT NULL AND receipt_path IS NULL
+            ORDER BY id
+            LIMIT ?
+        ''', (limit,), name='get_pending_receipts')
+    
+    def get_last_change_seq(self):
+        """Номер последнего изменения в журнале (см. last_change_seq)"""
+        started = time.perf_counter()
+        with self._manager.reader() as connection:
+            seq = last_change_seq(connection)
+        _record_query('get_last_change_seq', started)
+        return seq
+    
+    def get_changes_since(self, seq, limit=CHANGES_PAGE_SIZE):
+        """Изменения после номера seq (см. read_changes)"""
+        started = time.perf_counter()
+        with self._manager.reader() as connection:
+            result = read_changes(connection, seq, limit)
+        _record_query('get_changes_since', started)
+        return result
+    
+    @deferred_write
+    def prune_changes(self, before_ms):
+        """Удалить из журнала изменения старше before_ms (мс Unix).
+
+        Последнее изменение остается, чтобы читатели с устаревшим номером
+        увидели пропуск и загрузили данные заново.
+        """
+        return self._execute_query('''
+            DELETE FROM changes
+            WHERE changed_at < ?
+            AND seq < (SELECT MAX(seq) FROM changes)
+        ''', (before_ms,), fetch=None, result=lambda cursor: cursor.rowcount, name='prune_changes')
+    
+    def get_pending_notifications(self, limit):
+        """Неотправленные уведомления: (id, chat_id, текст, попыток)"""
+        return self._execute_query('''
+            SELECT id, chat_id, text, attempts
+            FROM notifications
+            WHERE status = 'pending'
+            ORDER BY id
+            LIMIT ?
+        ''', (limit,), name='get_pending_notifications')
+    
+    @deferred_write
+    def mark_notification_sent(self, notification_id):
+        """Отметить уведомление отправленным"""
+        return self._execute_query('''
+            UPDATE notifications
+            SET status = 'sent', attempts = attempts + 1, error = NULL, sent_at = ?
+            WHERE id = ?
+        ''', (now_ms(), notification_id), fetch=None, name='mark_notification_sent')
+    
+    @deferred_write
+    def mark_notification_failed(self, notification_id, error, final):
+        """Записать неудачную попытку; final — больше не отправлять"""
+        return self._execute_query('''
+            UPDATE notifications
+            SET attempts = attempts + 1,
+                error = ?,
+                status = CASE WHEN ? THEN 'failed' ELSE status END
+            WHERE id = ?
+        ''', (error, bool(final), notification_id), fetch=None, name='mark_notification_failed')
+
+
+class AsyncDatabase:
+    """Асинхронная обёртка над Database.
+
+    Все запросы выполняются в выделенных потоках, поэтому долгий запрос
+    не блокирует цикл событий бота. Любой публичный метод Database
+    доступен как корутина с теми же аргументами.
+    """
+
+    def __init__(self, db_file, max_workers=None):
+        self._db = Database(db_file)
+        if max_workers is None:
+            # Читатели из пула работают параллельно, плюс поток для записи
+            max_workers = self._db._manager.readers + 1
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix='db'
+        )
+
+    def __getattr__(self, name):
+        attr = getattr(self._db, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        if getattr(attr, 'deferred_write', False):
+            # Изменение только ставится в очередь, поток не занимается
+            @functools.wraps(attr)
+            async def method(*args, **kwargs):
+                token = _defer_writes.set(True)
+                try:
+                    future = attr(*args, **kwargs)
+                finally:
+                    _defer_writes.reset(token)
+                return await asyncio.wrap_future(future)
+
+            return method
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            return await self._run(attr, *args, **kwargs)
+
+        return method
+
+    async def _run(self, func, *args, **kwargs):
+        """Выполнить функцию в потоке базы данных"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(func, *args, **kwargs)
+        )
+
+    async def close(self):
+        """Закрыть соединения и остановить потоки базы данных"""
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=True)
@@ -1,114 +1,365 @@
-import sqlite3
-import random
-from datetime import datetime, timedelta
-import names  # pip install names
+"""Генератор тестовых данных.
 
-# Подключение к базе данных
-conn = sqlite3.connect('transport_expenses.db')
-cursor = conn.cursor()
+Заполняет базу водителями, маршрутами, выполнениями маршрутов и
+расходами. При одинаковых параметрах (включая --seed и --until) база
+получается одинаковой. Активность водителей распределена неравномерно:
+несколько водителей дают большую часть выполнений и расходов.
 
-# Очистка существующих данных
-cursor.execute('DELETE FROM route_executions')
-cursor.execute('DELETE FROM routes')
-cursor.execute('DELETE FROM expenses')
-cursor.execute('DELETE FROM drivers')
+Примеры:
+    python generate_test_data.py
+    python generate_test_data.py --db bench.db --drivers 2000 \\
+        --routes 200000 --executions-per-driver 200 \\
+        --expenses-per-driver 5000 --until 2024-12-31
+"""
+import argparse
+import bisect
+import itertools
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
 
-# Константы для генерации данных
-DRIVERS_COUNT = 10
-ROUTES_COUNT = 20
-EXECUTIONS_PER_ROUTE = 15
-EXPENSES_PER_DRIVER = 100
+from migrations import migrate, restore_schema_objects
 
 CITIES = [
-    "Алматы", "Астана", "Шымкент", "Караганда", "Актобе", 
+    "Алматы", "Астана", "Шымкент", "Караганда", "Актобе",
     "Тараз", "Павлодар", "Усть-Каменогорск", "Семей", "Атырау",
     "Костанай", "Кызылорда", "Актау", "Петропавловск", "Талдыкорган"
 ]
 
 CARGO_TYPES = [
-    "Продукты питания", "Стройматериалы", "Техника", 
+    "Продукты питания", "Стройматериалы", "Техника",
     "Мебель", "Одежда", "Автозапчасти", "Топливо",
     "Медикаменты", "Химикаты", "Металлопрокат"
 ]
 
+# тип: (минимальная сумма, максимальная сумма, комментарий, относительная частота)
 EXPENSE_TYPES = {
-    "fuel": (20000, 50000, "Заправка"),
-    "oil": (15000, 35000, "Замена масла"),
-    "tires": (80000, 150000, "Новые шины"),
-    "repair": (30000, 100000, "Ремонт"),
-    "food": (5000, 15000, "Питание"),
-    "parking": (2000, 5000, "Парковка")
+    "fuel": (20000, 50000, "Заправка", 50),
+    "oil": (15000, 35000, "Замена масла", 8),
+    "tires": (80000, 150000, "Новые шины", 2),
+    "repair": (30000, 100000, "Ремонт", 5),
+    "food": (5000, 15000, "Питание", 25),
+    "parking": (2000, 5000, "Парковка", 10)
 }
 
-# Генерация водителей
-print("Генерация водителей...")
-drivers = []
-for i in range(DRIVERS_COUNT):
-    telegram_id = random.randint(100000000, 999999999)
-    full_name = names.get_full_name()
-    phone = f"+7{random.randint(7000000000, 7999999999)}"
-    created_at = datetime.now() - timedelta(days=random.randint(30, 365))
-    
-    cursor.execute(
-        'INSERT INTO drivers (telegram_id, full_name, phone, created_at) VALUES (?, ?, ?, ?)',
-        (telegram_id, full_name, phone, created_at)
-    )
-    drivers.append((telegram_id, full_name))
-
-# Генерация маршрутов
-print("Генерация маршрутов...")
-routes = []
-for i in range(ROUTES_COUNT):
-    start_point = random.choice(CITIES)
-    end_point = random.choice([city for city in CITIES if city != start_point])
-    route_name = f"Маршрут {start_point}-{end_point}"
-    distance = random.randint(300, 2000)
-    price = distance * random.randint(500, 1000)  # Цена зависит от расстояния
-    cargo_type = random.choice(CARGO_TYPES)
-    created_at = datetime.now() - timedelta(days=random.randint(30, 365))
-    
-    cursor.execute('''
-        INSERT INTO routes (route_name, start_point, end_point, distance, price, cargo_type, created_at)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (route_name, start_point, end_point, distance, price, cargo_type, created_at))
-    routes.append(cursor.lastrowid)
-
-# Генерация выполненных маршрутов
-print("Генерация выполненных маршрутов...")
-for route_id in routes:
-    for _ in range(random.randint(5, EXECUTIONS_PER_ROUTE)):
-        driver_id = random.choice(drivers)[0]
-        start_time = datetime.now() - timedelta(days=random.randint(1, 365))
-        # Время в пути зависит от расстояния
-        cursor.execute('SELECT distance FROM routes WHERE id = ?', (route_id,))
-        distance = cursor.fetchone()[0]
-        travel_hours = distance / random.randint(50, 70)  # Средняя скорость 50-70 км/ч
-        end_time = start_time + timedelta(hours=travel_hours)
-        
-        cursor.execute('''
-            INSERT INTO route_executions (route_id, driver_id, start_time, end_time, status)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (route_id, driver_id, start_time, end_time, 'completed'))
-
-# Генерация расходов
-print("Генерация расходов...")
-for driver_id, _ in drivers:
-    for _ in range(EXPENSES_PER_DRIVER):
-        expense_type = random.choice(list(EXPENSE_TYPES.keys()))
-        min_amount, max_amount, comment_template = EXPENSE_TYPES[expense_type]
-        amount = random.randint(min_amount, max_amount)
-        
-        # Генерация случайного комментария
-        comment = f"{comment_template} - {random.choice(['Плановый', 'Внеплановый', 'Срочный'])}"
-        created_at = datetime.now() - timedelta(days=random.randint(1, 365))
-        
-        cursor.execute('''
-            INSERT INTO expenses (driver_id, expense_type, amount, receipt_photo, comment, created_at)
+FIRST_NAMES = [
+    "Айдар", "Арман", "Ерлан", "Нурлан", "Даурен", "Бауыржан", "Серик",
+    "Алексей", "Дмитрий", "Сергей", "Андрей", "Максим", "Руслан", "Тимур",
+    "Асхат", "Марат", "Жандос", "Канат", "Ержан", "Виктор"
+]
+
+LAST_NAMES = [
+    "Ахметов", "Сулейменов", "Касымов", "Жумабаев", "Нурпеисов", "Абенов",
+    "Иванов", "Петров", "Смирнов", "Козлов", "Ким", "Ли", "Омаров",
+    "Искаков", "Тулегенов", "Бекмуратов", "Садыков", "Попов", "Волков"
+]
+
+# Сколько строк вставлять одним executemany и фиксировать одной транзакцией
+BATCH_SIZE = 100_000
+# Доля водителей, у которых последний маршрут еще в пути
+IN_PROGRESS_SHARE = 0.3
+# Доля расходов, привязанных к выполнению маршрута
+LINKED_EXPENSE_SHARE = 0.7
+# Доля расходов в утреннюю смену (6:00-10:00)
+MORNING_SHIFT_SHARE = 0.4
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+
+
+def to_ms(moment):
+    """Время в миллисекундах Unix, как его хранит база"""
+    return int(moment.timestamp() * 1000)
+
+
+def skewed_counts(total, buckets, skew):
+    """Разделить total на buckets частей по закону Ципфа с показателем skew"""
+    if not buckets:
+        return []
+    weights = [1 / (rank + 1) ** skew for rank in range(buckets)]
+    weight_sum = sum(weights)
+    counts = [int(total * weight / weight_sum) for weight in weights]
+    # Остаток от округления отдаем самым активным
+    for index in range(total - sum(counts)):
+        counts[index % buckets] += 1
+    return counts
+
+
+def insert_batches(conn, query, rows, batch_size=BATCH_SIZE):
+    """Вставить строки пакетами, каждый пакет одной транзакцией"""
+    inserted = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return inserted
+        conn.executemany(query, batch)
+        conn.commit()
+        inserted += len(batch)
+
+
+def drop_indexes(conn, tables):
+    """Удалить индексы таблиц на время загрузки (их вернет restore_schema_objects)"""
+    placeholders = ", ".join("?" for _ in tables)
+    indexes = conn.execute(f"""
+        SELECT name FROM sqlite_master
+        WHERE type = 'index' AND sql IS NOT NULL
+        AND tbl_name IN ({placeholders})
+    """, tables).fetchall()
+    for (name,) in indexes:
+        conn.execute(f"DROP INDEX {name}")
+    conn.commit()
+
+
+def drop_triggers(conn, prefix):
+    """Удалить триггеры с именем на prefix (их вернет restore_schema_objects)"""
+    triggers = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE ?",
+        (prefix + '%',)
+    ).fetchall()
+    for (name,) in triggers:
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.commit()
+
+
+def next_id(conn, table):
+    """Следующий свободный id таблицы"""
+    return conn.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}").fetchone()[0]
+
+
+def clear_data(conn):
+    """Удалить существующие данные"""
+    conn.execute('DELETE FROM expenses')
+    conn.execute('DELETE FROM route_executions')
+    conn.execute('DELETE FROM routes')
+    conn.execute('DELETE FROM drivers')
+    conn.commit()
+
+
+def generate(db_file, seed=42, drivers=10, routes=20, executions_per_driver=30,
+             expenses_per_driver=100, days=365, until=None, skew=1.1,
+             append=False, batch_size=BATCH_SIZE, log=print):
+    """Сгенерировать данные в базе db_file и вернуть число строк по таблицам.
+
+    until — момент окончания истории (по умолчанию начало текущих суток).
+    """
+    rng = random.Random(seed)
+    if until is None:
+        until = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    until_ms = to_ms(until)
+    period_ms = days * DAY_MS
+
+    conn = sqlite3.connect(db_file)
+    migrate(conn)
+    # Итоги расходов пересчитываются один раз после загрузки, а не
+    # триггерами на каждый расход; в журнал изменений вместо записи на
+    # каждую строку пишется один сброс (см. restore_schema_objects)
+    drop_triggers(conn, 'trg_expense_totals_')
+    drop_triggers(conn, 'trg_changes_')
+    # Удаленные индексы и триггеры возвращаются, даже если загрузка
+    # прервана; если не успеет и это, их вернет migrate() при запуске
+    try:
+        if not append:
+            clear_data(conn)
+
+        # Загрузка без журнала и fsync: при сбое базу проще сгенерировать заново
+        conn.execute('PRAGMA journal_mode=DELETE')
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('PRAGMA cache_size=-262144')
+        # Индексы строятся один раз после загрузки, а не при каждой вставке
+        drop_indexes(conn, ('expenses', 'route_executions', 'routes'))
+
+        # Водители: telegram_id не пересекаются с уже загруженными
+        log("Генерация водителей...")
+        first_telegram_id = conn.execute(
+            "SELECT COALESCE(MAX(telegram_id), 100000000) + 1 FROM drivers"
+        ).fetchone()[0]
+        driver_ids = [first_telegram_id + index for index in range(drivers)]
+        insert_batches(conn, 'INSERT INTO drivers (telegram_id, full_name, phone) VALUES (?, ?, ?)', (
+            (
+                telegram_id,
+                f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                f"+7{rng.randint(7000000000, 7999999999)}"
+            )
+            for telegram_id in driver_ids
+        ), batch_size)
+
+        # Маршруты
+        log("Генерация маршрутов...")
+        first_route_id = next_id(conn, 'routes')
+        distances = []
+
+        def route_rows():
+            for index in range(routes):
+                start_point = rng.choice(CITIES)
+                end_point = rng.choice([city for city in CITIES if city != start_point])
+                distance = rng.randint(300, 2000)
+                distances.append(distance)
+                yield (
+                    first_route_id + index,
+                    f"Маршрут {start_point}-{end_point}",
+                    start_point,
+                    end_point,
+                    distance,
+                    distance * rng.randint(500, 1000),  # Цена зависит от расстояния
+                    rng.choice(CARGO_TYPES),
+                    until_ms - rng.randrange(period_ms)
+                )
+
+        insert_batches(conn, '''
+            INSERT INTO routes (id, route_name, start_point, end_point, distance, price, cargo_type, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', route_rows(), batch_size)
+
+        # Выполнения маршрутов: самые активные водители выполняют больше
+        log("Генерация выполнений маршрутов...")
+        first_execution_id = next_id(conn, 'route_executions')
+        execution_counts = skewed_counts(executions_per_driver * drivers, drivers, skew)
+        # telegram_id водителя -> (id первого выполнения, времена начала по порядку)
+        driver_executions = {}
+
+        def execution_rows():
+            execution_id = first_execution_id
+            for driver_id, count in zip(driver_ids, execution_counts):
+                if not routes or not count:
+                    continue
+                starts = sorted(until_ms - rng.randrange(period_ms) for _ in range(count))
+                driver_executions[driver_id] = (execution_id, starts)
+                for number, start_time in enumerate(starts):
+                    route_index = rng.randrange(routes)
+                    # Средняя скорость 50-70 км/ч
+                    travel_ms = int(distances[route_index] / rng.randint(50, 70) * HOUR_MS)
+                    # В пути может быть только последний маршрут водителя
+                    if number == count - 1 and rng.random() < IN_PROGRESS_SHARE:
+                        end_time, status = None, 'in_progress'
+                    else:
+                        end_time, status = start_time + travel_ms, 'completed'
+                    yield (
+                        execution_id,
+                        first_route_id + route_index,
+                        driver_id,
+                        start_time,
+                        end_time,
+                        status
+                    )
+                    execution_id += 1
+
+        insert_batches(conn, '''
+            INSERT INTO route_executions (id, route_id, driver_id, start_time, end_time, status)
             VALUES (?, ?, ?, ?, ?, ?)
-        ''', (driver_id, expense_type, amount, 'test_receipt.jpg', comment, created_at))
+        ''', execution_rows(), batch_size)
+
+        # Расходы: чаще в утреннюю смену, большая часть привязана к выполнению
+        log("Генерация расходов...")
+        expense_counts = skewed_counts(expenses_per_driver * drivers, drivers, skew)
+        expense_types = list(EXPENSE_TYPES)
+        cumulative_weights = list(itertools.accumulate(
+            EXPENSE_TYPES[expense_type][3] for expense_type in expense_types
+        ))
+
+        def expense_rows():
+            for driver_id, count in zip(driver_ids, expense_counts):
+                first_execution, starts = driver_executions.get(driver_id, (None, []))
+                for _ in range(count):
+                    expense_type = expense_types[bisect.bisect(
+                        cumulative_weights, rng.random() * cumulative_weights[-1]
+                    )]
+                    min_amount, max_amount, comment_template, _ = EXPENSE_TYPES[expense_type]
+                    day_start = until_ms - (rng.randrange(days) + 1) * DAY_MS
+                    if rng.random() < MORNING_SHIFT_SHARE:
+                        created_at = day_start + 6 * HOUR_MS + rng.randrange(4 * HOUR_MS)
+                    else:
+                        created_at = day_start + rng.randrange(DAY_MS)
+
+                    # Привязка к последнему выполнению, начатому до расхода
+                    route_execution_id = None
+                    if starts and rng.random() < LINKED_EXPENSE_SHARE:
+                        position = bisect.bisect(starts, created_at)
+                        if position:
+                            route_execution_id = first_execution + position - 1
+
+                    yield (
+                        driver_id,
+                        expense_type,
+                        rng.randint(min_amount, max_amount),
+                        'test_receipt.jpg',
+                        f"{comment_template} - {rng.choice(['Плановый', 'Внеплановый', 'Срочный'])}",
+                        route_execution_id,
+                        created_at
+                    )
+
+        insert_batches(conn, '''
+            INSERT INTO expenses (driver_id, expense_type, amount, receipt_photo, comment, route_execution_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', expense_rows(), batch_size)
+    finally:
+        log("Построение индексов и пересчет итогов расходов...")
+        restore_schema_objects(conn)
+
+    conn.execute('ANALYZE')
+    # Журнал changes быстро растет после запуска бота: статистика по одной
+    # строке увела бы чтение журнала в полный просмотр
+    conn.execute("DELETE FROM sqlite_stat1 WHERE tbl = 'changes'")
+    conn.commit()
+    conn.execute('PRAGMA journal_mode=WAL')
+
+    counts = {
+        table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ('drivers', 'routes', 'route_executions', 'expenses')
+    }
+    conn.close()
+    return counts
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Генерация тестовых данных")
+    parser.add_argument('--db', default='transport_expenses.db',
+                        help="путь к базе (по умолчанию transport_expenses.db)")
+    parser.add_argument('--seed', type=int, default=42,
+                        help="начальное значение генератора случайных чисел")
+    parser.add_argument('--drivers', type=int, default=10,
+                        help="количество водителей")
+    parser.add_argument('--routes', type=int, default=20,
+                        help="количество маршрутов")
+    parser.add_argument('--executions-per-driver', type=int, default=30,
+                        help="среднее число выполнений маршрутов на водителя")
+    parser.add_argument('--expenses-per-driver', type=int, default=100,
+                        help="среднее число расходов на водителя")
+    parser.add_argument('--days', type=int, default=365,
+                        help="за сколько дней генерировать историю")
+    parser.add_argument('--until', type=lambda value: datetime.strptime(value, '%Y-%m-%d'),
+                        help="последний день истории, ГГГГ-ММ-ДД (по умолчанию вчера)")
+    parser.add_argument('--skew', type=float, default=1.1,
+                        help="неравномерность активности водителей (0 — равномерно)")
+    parser.add_argument('--append', action='store_true',
+                        help="добавить данные, не удаляя существующие")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help="строк в одной транзакции")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started = time.perf_counter()
+    counts = generate(
+        args.db,
+        seed=args.seed,
+        drivers=args.drivers,
+        routes=args.routes,
+        executions_per_driver=args.executions_per_driver,
+        expenses_per_driver=args.expenses_per_driver,
+        days=args.days,
+        until=args.until + timedelta(days=1) if args.until else None,
+        skew=args.skew,
+        append=args.append,
+        batch_size=args.batch_size
+    )
+    elapsed = time.perf_counter() - started
+    print(", ".join(f"{table}: {count}" for table, count in counts.items()))
+    print(f"Генерация тестовых данных завершена за {elapsed:.1f} с "
+          f"({sum(counts.values()) / elapsed:.0f} строк/с)")
 
-# Сохранение изменений
-conn.commit()
-conn.close()
 
-print("Генерация тестовых данных завершена!") 
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
+import functools
+
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
-from datetime import datetime
+from callbacks import (
+    pack, EXPENSE_TYPE, EXPENSE_DETAILS, EXPENSE_RECEIPT, EXPENSES_PAGE, ROUTE_DETAILS,
+    ROUTE_START, ROUTE_FINISH, ROUTES_BACK, HISTORY_ROUTE, HISTORY_PAGE, HISTORY_BACK
+)
+from database import VersionedCache
 
-def get_main_keyboard():
-    keyboard = ReplyKeyboardMarkup(
+# Клавиатуры, построенные по данным из базы, хранятся вместе с версией
+# данных (см. main.cached_keyboard): размер кэша и время жизни записи
+KEYBOARD_CACHE_SIZE = 4096
+KEYBOARD_CACHE_TTL = 300
+keyboard_cache = VersionedCache(maxsize=KEYBOARD_CACHE_SIZE, ttl=KEYBOARD_CACHE_TTL)
+
+def _build_main_keyboard():
+    return ReplyKeyboardMarkup(
         keyboard=[
             [KeyboardButton(text="📝 Добавить расход")],
             [KeyboardButton(text="📊 Мои расходы")],
@@ -15,26 +27,63 @@ def get_main_keyboard():
         ],
         resize_keyboard=True
     )
-    return keyboard
 
-def get_expense_types_keyboard():
+# Типы расходов: (название, код в базе)
+EXPENSE_TYPES = [
+    ("Бензин", "fuel"),
+    ("Масло", "oil"),
+    ("Шины", "tires")
+]
+
+def _build_expense_types_keyboard():
     builder = InlineKeyboardBuilder()
-    expenses = [
-        ("Бензин", "fuel"),
-        ("Масло", "oil"),
-        ("Шины", "tires")
-    ]
     
-    for expense_name, callback_data in expenses:
+    for expense_name, callback_data in EXPENSE_TYPES:
         builder.add(InlineKeyboardButton(
             text=expense_name,
-            callback_data=f"expense_{callback_data}"
+            callback_data=pack(EXPENSE_TYPE, callback_data)
         ))
     
     builder.adjust(1)
     return builder.as_markup()
 
-def get_expense_list_keyboard(expenses):
+# Клавиатуры, которые не зависят от данных, строятся один раз; объекты
+# общие для всех сообщений, поэтому изменять их нельзя
+MAIN_KEYBOARD = _build_main_keyboard()
+EXPENSE_TYPES_KEYBOARD = _build_expense_types_keyboard()
+FINISH_ROUTE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="✅ Завершить текущий маршрут", callback_data=pack(ROUTE_FINISH))]
+])
+BACK_TO_HISTORY_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="↩️ Назад к истории", callback_data=pack(HISTORY_BACK))]
+])
+
+def get_main_keyboard():
+    return MAIN_KEYBOARD
+
+def get_expense_types_keyboard():
+    return EXPENSE_TYPES_KEYBOARD
+
+def add_page_navigation(keyboard, action, older=None, newer=None):
+    """Добавляет ряд кнопок перехода между страницами списка.
+
+    Кнопка передаёт действию направление и курсор (время, id).
+    """
+    buttons = []
+    if newer:
+        buttons.append(InlineKeyboardButton(
+            text="⬅️ Новее",
+            callback_data=pack(action, "newer", *newer)
+        ))
+    if older:
+        buttons.append(InlineKeyboardButton(
+            text="Старше ➡️",
+            callback_data=pack(action, "older", *older)
+        ))
+    if buttons:
+        keyboard.row(*buttons)
+
+def get_expense_list_keyboard(expenses, older=None, newer=None):
     """Создает инлайн клавиатуру со списком расходов"""
     keyboard = InlineKeyboardBuilder()
     
@@ -45,8 +94,8 @@ def get_expense_list_keyboard(expenses):
             
         # Создаем текст кнопки
         button_text = f"{formatted_date} | {expense['type']} | {formatted_amount} ₸"
-        # Создаем callback_data с датой
-        callback_data = f"show_expense_{expense['date'].strftime('%Y-%m-%d %H:%M:%S.%f')}"
+        # Кнопка ссылается на расход по его id
+        callback_data = pack(EXPENSE_DETAILS, expense['id'])
         
         keyboard.add(InlineKeyboardButton(
             text=button_text,
@@ -54,68 +103,70 @@ def get_expense_list_keyboard(expenses):
         ))
     
     keyboard.adjust(1)  # Размещаем кнопки в один столбец
+    add_page_navigation(keyboard, EXPENSES_PAGE, older, newer)
     return keyboard.as_markup()
 
-def get_receipt_button(expense_date):
+def get_receipt_button(expense_id):
     """Создает кнопку для просмотра чека"""
     keyboard = InlineKeyboardBuilder()
     keyboard.add(InlineKeyboardButton(
         text="📸 Показать чек",
-        callback_data=f"show_receipt_{expense_date}"
+        callback_data=pack(EXPENSE_RECEIPT, expense_id)
     ))
     return keyboard.as_markup()
 
 def get_routes_keyboard(routes, active_route=None):
     """Создает клавиатуру со списком маршрутов"""
-    keyboard = InlineKeyboardBuilder()
-    
-    for route_id, name, start, end in routes:
-        button_text = f"🚚 {name} ({start} → {end})"
-        keyboard.add(InlineKeyboardButton(
-            text=button_text,
-            callback_data=f"route_{route_id}"
-        ))
+    if active_route and not routes:
+        return FINISH_ROUTE_KEYBOARD
+    # Ряды собираются списком: InlineKeyboardBuilder копирует всю
+    # клавиатуру при каждом add, и длинный список строится за квадрат
+    rows = [
+        [InlineKeyboardButton(
+            text=f"🚚 {name} ({start} → {end})",
+            callback_data=pack(ROUTE_DETAILS, route_id)
+        )]
+        for route_id, name, start, end in routes
+    ]
     
     if active_route:
-        keyboard.add(InlineKeyboardButton(
+        rows.append([InlineKeyboardButton(
             text="✅ Завершить текущий маршрут",
-            callback_data="finish_route"
-        ))
+            callback_data=pack(ROUTE_FINISH)
+        )])
     
-    keyboard.adjust(1)
-    return keyboard.as_markup() 
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
+@functools.lru_cache(maxsize=KEYBOARD_CACHE_SIZE)
 def get_route_details_keyboard(route_id):
     """Создает клавиатуру для начала маршрута"""
     keyboard = InlineKeyboardBuilder()
     keyboard.add(InlineKeyboardButton(
         text="🚀 Начать маршрут",
-        callback_data=f"start_route_{route_id}"
+        callback_data=pack(ROUTE_START, route_id)
     ))
     keyboard.add(InlineKeyboardButton(
         text="↩️ Назад к списку",
-        callback_data="back_to_routes"
+        callback_data=pack(ROUTES_BACK)
     ))
     keyboard.adjust(1)
     return keyboard.as_markup() 
 
-def get_route_history_keyboard(routes):
+def get_route_history_keyboard(routes, older=None, newer=None):
     """Создает клавиатуру с историей маршрутов"""
     keyboard = InlineKeyboardBuilder()
     
     for route_id, name, start, end, start_time, end_time, distance, price in routes:
-        try:
-            start_date = datetime.strptime(start_time, '%Y-%m-%d %H:%M:%S.%f').strftime("%d.%m.%Y")
-            end_date = datetime.strptime(end_time, '%Y-%m-%d %H:%M:%S.%f').strftime("%d.%m.%Y")
-        except:
-            start_date = "???"
-            end_date = "???"
+        # Время уже преобразовано в datetime в get_completed_routes
+        start_date = start_time.strftime("%d.%m.%Y") if start_time else "???"
+        end_date = end_time.strftime("%d.%m.%Y") if end_time else "???"
             
         button_text = f"🏁 {name} ({start_date} - {end_date})"
         keyboard.add(InlineKeyboardButton(
             text=button_text,
-            callback_data=f"history_route_{route_id}"
+            callback_data=pack(HISTORY_ROUTE, route_id)
         ))
     
     keyboard.adjust(1)
+    add_page_navigation(keyboard, HISTORY_PAGE, older, newer)
     return keyboard.as_markup()
\ No newline at end of file
@@ -1,12 +1,21 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-from database import Database
-from keyboards import get_main_keyboard, get_expense_types_keyboard, get_expense_list_keyboard, get_receipt_button, get_routes_keyboard, get_route_details_keyboard, get_route_history_keyboard
+from aiogram.types import Message, CallbackQuery, FSInputFile, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
+from database import AsyncDatabase, ms_to_datetime, now_ms
+from keyboards import get_main_keyboard, get_expense_types_keyboard, get_expense_list_keyboard, get_receipt_button, get_routes_keyboard, get_route_details_keyboard, get_route_history_keyboard, keyboard_cache, BACK_TO_HISTORY_KEYBOARD, EXPENSE_TYPES
+from callbacks import CallbackRouter, EXPENSE_TYPE, EXPENSE_DETAILS, EXPENSE_RECEIPT, EXPENSES_PAGE, ROUTE_DETAILS, ROUTE_START, ROUTE_FINISH, ROUTES_BACK, HISTORY_ROUTE, HISTORY_PAGE, HISTORY_BACK
+from metrics import start_metrics_server
+from middlewares import DuplicateUpdateMiddleware, HandlerTimingMiddleware, ThrottlingMiddleware, UpdateTimingMiddleware
+from webhook import create_webhook_app, start_webhook_server
+from storage import SQLiteStorage
+from receipts import ReceiptArchiver
+from sender import NotificationSender, SendLimiter
 from datetime import datetime
 import os
 from dotenv import load_dotenv
@@ -15,14 +24,118 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Инициализация логгера
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
+
+# Режим получения обновлений: 'polling' или 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Настройки webhook: адрес, который слушает бот, путь и секрет, который
+# Telegram передает в заголовке X-Telegram-Bot-Api-Secret-Token.
+# Если задан WEBHOOK_BASE_URL, бот сам регистрирует webhook при запуске
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL')
+# Собственный сервер Bot API (например, локальный или тестовый)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
 
 # Инициализация бота и диспетчера
-bot = Bot(token=os.getenv('BOT_TOKEN'))
-dp = Dispatcher()
+session = None
+if TELEGRAM_API_URL:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+bot = Bot(token=os.getenv('BOT_TOKEN'), session=session)
+# Состояния FSM хранятся в базе и переживают перезапуск бота
+dp = Dispatcher(storage=SQLiteStorage("transport_expenses.db"))
+
+# Метрики времени обработки (см. middlewares.py)
+dp.update.outer_middleware(UpdateTimingMiddleware())
+dp.message.middleware(HandlerTimingMiddleware())
+dp.callback_query.middleware(HandlerTimingMiddleware())
+
+# Подавление повторов: сколько последних update_id помнить и в течение
+# скольких секунд одинаковое нажатие или команда водителя считается повтором
+SEEN_UPDATES_LIMIT = int(os.getenv('SEEN_UPDATES_LIMIT', '10000'))
+THROTTLE_WINDOW = float(os.getenv('THROTTLE_WINDOW', '1.0'))
+dp.update.outer_middleware(DuplicateUpdateMiddleware(SEEN_UPDATES_LIMIT))
+throttling = ThrottlingMiddleware(THROTTLE_WINDOW)
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+
+# Все инлайн-кнопки обрабатываются через таблицу действий (см. callbacks.py)
+callback_router = CallbackRouter()
+callback_router.register(dp.callback_query)
+
+# Адрес HTTP-сервера метрик Prometheus; пустой METRICS_PORT отключает его
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = os.getenv('METRICS_PORT', '9100')
+
+# Инициализация базы данных (запросы выполняются вне цикла событий)
+db = AsyncDatabase("transport_expenses.db")
+
+# Каталог архива фото чеков (пустой RECEIPTS_DIR отключает архив), сколько
+# чеков скачивается одновременно и сколько может ждать в очереди.
+# RECEIPT_BACKFILL=0 — не досылать при запуске чеки, не скачанные ранее
+RECEIPTS_DIR = os.getenv('RECEIPTS_DIR', 'receipts')
+RECEIPT_WORKERS = int(os.getenv('RECEIPT_WORKERS', '4'))
+RECEIPT_QUEUE_SIZE = int(os.getenv('RECEIPT_QUEUE_SIZE', '1000'))
+RECEIPT_BACKFILL = os.getenv('RECEIPT_BACKFILL', '1') == '1'
+receipt_archiver = None
+if RECEIPTS_DIR:
+    receipt_archiver = ReceiptArchiver(
+        bot, db, RECEIPTS_DIR,
+        queue_size=RECEIPT_QUEUE_SIZE,
+        workers=RECEIPT_WORKERS,
+        backfill=RECEIPT_BACKFILL
+    )
+    dp.startup.register(receipt_archiver.start)
+    dp.shutdown.register(receipt_archiver.close)
+
+# Ограничение исходящих сообщений (см. sender.py): сообщений в секунду на
+# весь бот и в один чат, 0 — без ограничения. Ответы водителям
+# отправляются раньше рассылок
+SEND_RATE_LIMIT = float(os.getenv('SEND_RATE_LIMIT', '30'))
+SEND_CHAT_RATE_LIMIT = float(os.getenv('SEND_CHAT_RATE_LIMIT', '1'))
+send_limiter = None
+if SEND_RATE_LIMIT > 0:
+    send_limiter = SendLimiter(SEND_RATE_LIMIT, SEND_CHAT_RATE_LIMIT)
+    bot.session.middleware(send_limiter)
+    dp.shutdown.register(send_limiter.close)
+
+# Как часто (в секундах) проверять уведомления водителям из таблицы
+# notifications; 0 — не отправлять их из этого процесса
+NOTIFICATIONS_POLL_INTERVAL = float(os.getenv('NOTIFICATIONS_POLL_INTERVAL', '2'))
+if NOTIFICATIONS_POLL_INTERVAL > 0:
+    notification_sender = NotificationSender(bot, db, NOTIFICATIONS_POLL_INTERVAL)
+    dp.startup.register(notification_sender.start)
+    dp.shutdown.register(notification_sender.close)
+
+# Сколько дней хранить журнал изменений changes (по нему обновляют данные
+# страницы веб-интерфейса); 0 — не очищать журнал из этого процесса
+CHANGES_RETENTION_DAYS = float(os.getenv('CHANGES_RETENTION_DAYS', '7'))
+# Как часто (в секундах) очищать журнал
+CHANGES_PRUNE_INTERVAL = 3600
+changes_pruning = None
+
+async def prune_changes_loop():
+    while True:
+        try:
+            removed = await db.prune_changes(now_ms() - int(CHANGES_RETENTION_DAYS * 86_400_000))
+            logging.debug("Из журнала изменений удалено %s записей", removed)
+        except Exception:
+            logging.exception("Не удалось очистить журнал изменений")
+        await asyncio.sleep(CHANGES_PRUNE_INTERVAL)
+
+async def start_changes_pruning():
+    global changes_pruning
+    changes_pruning = asyncio.create_task(prune_changes_loop())
 
-# Инициализация базы данных
-db = Database("transport_expenses.db")
+async def stop_changes_pruning():
+    if changes_pruning is not None:
+        changes_pruning.cancel()
+
+if CHANGES_RETENTION_DAYS > 0:
+    dp.startup.register(start_changes_pruning)
+    dp.shutdown.register(stop_changes_pruning)
 
 # Определение состояний FSM
 class ExpenseStates(StatesGroup):
@@ -38,17 +151,16 @@ class RegistrationStates(StatesGroup):
 # Обработчик команды /start
 @dp.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
-    with db as database:
-        if not database.driver_exists(message.from_user.id):
-            await message.answer(
-                "Добро пожаловать! Для начала работы, пожалуйста, отправьте свое полное имя."
-            )
-            await state.set_state(RegistrationStates.waiting_for_name)
-        else:
-            await message.answer(
-                "Выберите действие:",
-                reply_markup=get_main_keyboard()
-            )
+    if not await db.driver_exists(message.from_user.id):
+        await message.answer(
+            "Добро пожаловать! Для начала работы, пожалуйста, отправьте свое полное имя."
+        )
+        await state.set_state(RegistrationStates.waiting_for_name)
+    else:
+        await message.answer(
+            "Выберите действие:",
+            reply_markup=get_main_keyboard()
+        )
 
 # Добавьте новые обработчики для регистрации
 @dp.message(StateFilter(RegistrationStates.waiting_for_name))
@@ -64,13 +176,12 @@ async def process_phone(message: Message, state: FSMContext):
     phone = message.text
     user_data = await state.get_data()
     
-    with db as database:
-        # Сохраняем водителя в базу данных
-        database.add_driver(
-            telegram_id=message.from_user.id,
-            full_name=user_data['full_name'],
-            phone=phone
-        )
+    # Сохраняем водителя в базу данных
+    await db.add_driver(
+        telegram_id=message.from_user.id,
+        full_name=user_data['full_name'],
+        phone=phone
+    )
     
     await message.answer(
         "Регистрация успешно завершена! Теперь вы можете пользоваться ботом.",
@@ -101,9 +212,9 @@ async def cmd_cancel(message: Message, state: FSMContext):
     )
 
 # Обновляем обработчик выбора типа расхода
-@dp.callback_query(F.data.startswith("expense_"))
-async def process_expense_type(callback: CallbackQuery, state: FSMContext):
-    expense_type = callback.data.split("_")[1]
+@callback_router.action(EXPENSE_TYPE, str)
+async def process_expense_type(callback: CallbackQuery, args: list, state: FSMContext):
+    expense_type = args[0]
     await state.update_data(expense_type=expense_type)
     
     await callback.message.edit_text(
@@ -160,7 +271,7 @@ async def process_receipt(message: Message, state: FSMContext):
         return
 
     photo = message.photo[-1]
-    await state.update_data(receipt_photo=photo.file_id)
+    await state.update_data(receipt_photo=photo.file_id, receipt_unique_id=photo.file_unique_id)
     
     await message.answer(
         "Добавьте комментарий к расходу:\n"
@@ -182,17 +293,21 @@ async def process_comment(message: Message, state: FSMContext):
     user_data = await state.get_data()
     
     # Сохраняем расход в базу данных
-    active_route = db.get_active_route(message.from_user.id)
-    route_execution_id = active_route[0] if active_route else None
+    active_route = await db.get_active_route(message.from_user.id)
+    route_execution_id = active_route[5] if active_route else None
     
-    db.add_expense(
+    expense_id = await db.add_expense(
         driver_id=message.from_user.id,
         expense_type=user_data['expense_type'],
         amount=user_data['amount'],
         receipt_photo=user_data['receipt_photo'],
         comment=message.text,
-        route_execution_id=route_execution_id
+        route_execution_id=route_execution_id,
+        receipt_unique_id=user_data.get('receipt_unique_id')
     )
+    # Чек скачивается в архив в фоне
+    if receipt_archiver is not None and user_data.get('receipt_unique_id'):
+        receipt_archiver.submit(expense_id, user_data['receipt_photo'], user_data['receipt_unique_id'])
     
     await state.clear()
     await message.answer(
@@ -200,21 +315,18 @@ async def process_comment(message: Message, state: FSMContext):
         reply_markup=get_main_keyboard()
     )
 
-# Добавляем обработчик для просмотра расходов
-@dp.message(F.text == "📊 Мои расходы")
-async def show_expenses(message: Message):
-    expenses = db.get_driver_expenses(message.from_user.id)
-    
+# Страница списка расходов: текст и клавиатура (None, если расходов нет)
+async def render_expenses_page(driver_id, cursor=None, direction='older'):
+    page = await db.get_driver_expenses_page(driver_id, cursor, direction)
+    expenses = page['items']
     if not expenses:
-        await message.answer(
-            "У вас пока нет зарегистрированных расходов.",
-            reply_markup=get_main_keyboard()
-        )
-        return
+        return None, None
     
-    total_amount = sum(expense['amount'] for expense in expenses)
+    # Общая сумма считается в базе, а не по загруженным строкам
+    count, total_amount = await db.get_driver_expenses_summary(driver_id)
     formatted_total = "{:,}".format(int(total_amount)).replace(",", " ")
     
+    separator = '—' * 30 + '\n'
     expense_list = []
     for expense in expenses:
         formatted_amount = "{:,}".format(int(expense['amount'])).replace(",", " ")
@@ -228,32 +340,54 @@ async def show_expenses(message: Message):
         )
         expense_list.append(expense_text)
     
-    await message.answer(
-        f"📊 Ваши расходы:\n\n"
+    text = (
+        f"📊 Ваши расходы (всего {count}):\n\n"
         f"{'—' * 30}\n"
-        f"{('—' * 30 + '\n').join(expense_list)}"
+        f"{separator.join(expense_list)}"
         f"{'—' * 30}\n"
-        f"Общая сумма: {formatted_total} тг",
-        reply_markup=get_expense_list_keyboard(expenses)
+        f"Общая сумма: {formatted_total} тг"
     )
+    return text, get_expense_list_keyboard(expenses, page['older'], page['newer'])
+
+# Добавляем обработчик для просмотра расходов
+@dp.message(F.text == "📊 Мои расходы")
+async def show_expenses(message: Message):
+    text, keyboard = await render_expenses_page(message.from_user.id)
+    
+    if not text:
+        await message.answer(
+            "У вас пока нет зарегистрированных расходов.",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    await message.answer(text, reply_markup=keyboard)
+
+# Обработчик перехода между страницами расходов
+@callback_router.action(EXPENSES_PAGE, str, int, int)
+async def show_expenses_page(callback: CallbackQuery, args: list):
+    direction, created_at, expense_id = args
+    text, keyboard = await render_expenses_page(callback.from_user.id, (created_at, expense_id), direction)
+    
+    if not text:
+        await callback.answer("Больше расходов нет")
+        return
+    
+    await callback.message.edit_text(text, reply_markup=keyboard)
+    await callback.answer()
 
 # Добавляем обработчик нажатия на расход
-@dp.callback_query(F.data.startswith("show_expense_"))
-async def show_expense_details(callback: CallbackQuery):
-    expense_date = callback.data.replace("show_expense_", "")
-    expense = db.get_expense_by_date(callback.from_user.id, expense_date)
+@callback_router.action(EXPENSE_DETAILS, int)
+async def show_expense_details(callback: CallbackQuery, args: list):
+    expense_id = args[0]
+    expense = await db.get_expense(callback.from_user.id, expense_id)
     
     if not expense:
         await callback.answer("Информация о расходе не найдена")
         return
     
-    exp_type, amount, receipt_photo, comment, date_str = expense
-    
-    try:
-        date = datetime.strptime(date_str, '%Y-%m-%d %H:%M:%S.%f')
-        formatted_date = date.strftime("%d.%m.%Y %H:%M")
-    except:
-        formatted_date = date_str
+    exp_type, amount, receipt_photo, comment, created_at, _ = expense
+    formatted_date = ms_to_datetime(created_at).strftime("%d.%m.%Y %H:%M")
         
     try:
         formatted_amount = "{:,}".format(int(float(amount))).replace(",", " ")
@@ -269,20 +403,19 @@ async def show_expense_details(callback: CallbackQuery):
     
     await callback.message.edit_text(
         response,
-        reply_markup=get_receipt_button(expense_date)
+        reply_markup=get_receipt_button(expense_id)
     )
 
 # Добавляем обработчик кнопки показа чека
-@dp.callback_query(F.data.startswith("show_receipt_"))
-async def show_receipt(callback: CallbackQuery):
-    expense_date = callback.data.replace("show_receipt_", "")
-    expense = db.get_expense_by_date(callback.from_user.id, expense_date)
+@callback_router.action(EXPENSE_RECEIPT, int)
+async def show_receipt(callback: CallbackQuery, args: list):
+    expense = await db.get_expense(callback.from_user.id, args[0])
     
     if not expense:
         await callback.answer("Чек не найден")
         return
     
-    _, _, receipt_photo, _, _ = expense
+    _, _, receipt_photo, _, _, receipt_path = expense
     
     if receipt_photo:
         try:
@@ -291,19 +424,98 @@ async def show_receipt(callback: CallbackQuery):
                 caption="🧾 Фото чека"
             )
             await callback.answer()
+            return
         except Exception as e:
             logging.error(f"Error sending receipt photo: {e}")
-            await callback.answer("Не удалось загрузить фото чека")
+        # Telegram не отдал файл: отправляем копию из архива
+        if receipt_path and os.path.exists(receipt_path):
+            try:
+                await callback.message.answer_photo(
+                    FSInputFile(receipt_path),
+                    caption="🧾 Фото чека"
+                )
+                await callback.answer()
+                return
+            except Exception as e:
+                logging.error(f"Error sending archived receipt: {e}")
+        await callback.answer("Не удалось загрузить фото чека")
     else:
         await callback.answer("Чек отсутствует")
 
+# Клавиатура из кэша keyboards.keyboard_cache; build — корутина, которая
+# строит клавиатуру при промахе. Без version запись действует, пока не
+# изменится каталог маршрутов (версия растет при любом изменении маршрутов
+# и их выполнений) — так кэшируются общие для всех водителей списки
+async def cached_keyboard(key, build, version=None):
+    if version is None:
+        version = await db.get_catalogue_version()
+    found, keyboard = keyboard_cache.get(key, version)
+    if not found:
+        keyboard = await build()
+        keyboard_cache.set(key, version, keyboard)
+    return keyboard
+
+# Клавиатура доступных маршрутов (None, если маршрутов нет)
+async def render_available_routes():
+    async def build():
+        routes = await db.get_available_routes()
+        return get_routes_keyboard(routes) if routes else None
+    return await cached_keyboard('available_routes', build)
+
+def format_amount(amount):
+    return "{:,}".format(int(amount)).replace(",", " ")
+
+# Сводка расходов водителя; все суммы берутся из итогов в базе
+@dp.message(Command("stats"))
+async def show_stats(message: Message):
+    driver_id = message.from_user.id
+    (count, total), week, month, by_type, by_month, by_route = await asyncio.gather(
+        db.get_driver_expenses_summary(driver_id),
+        db.get_recent_expenses_total(driver_id, 7),
+        db.get_recent_expenses_total(driver_id, 30),
+        db.get_expense_totals_by_type(driver_id),
+        db.get_expense_totals_by_month(driver_id, 6),
+        db.get_expense_totals_by_route_execution(driver_id, 5)
+    )
+    if not count:
+        await message.answer(
+            "У вас пока нет зарегистрированных расходов.",
+            reply_markup=get_main_keyboard()
+        )
+        return
+    
+    type_names = {code: name for name, code in EXPENSE_TYPES}
+    lines = [
+        "📈 Статистика расходов\n",
+        f"Всего: {count} на {format_amount(total)} тг",
+        f"За 7 дней: {week[0]} на {format_amount(week[1])} тг",
+        f"За 30 дней: {month[0]} на {format_amount(month[1])} тг",
+        "\n📋 По типам:",
+    ]
+    lines += [
+        f"• {type_names.get(expense_type, expense_type)}: {format_amount(amount)} тг ({number})"
+        for expense_type, number, amount in by_type
+    ]
+    lines.append("\n📅 По месяцам:")
+    lines += [
+        f"• {datetime.strptime(month_key, '%Y-%m').strftime('%m.%Y')}: {format_amount(amount)} тг ({number})"
+        for month_key, number, amount in by_month
+    ]
+    if by_route:
+        lines.append("\n🚛 По последним маршрутам:")
+        lines += [
+            f"• {route_name or f'Выполнение {execution_id}'}: {format_amount(amount)} тг ({number})"
+            for execution_id, route_name, number, amount in by_route
+        ]
+    await message.answer("\n".join(lines), reply_markup=get_main_keyboard())
+
 # Добавляем обработчик для маршрутов
 @dp.message(F.text == "🚛 Мои маршруты")
 async def show_routes(message: Message):
-    active_route = db.get_active_route(message.from_user.id)
+    active_route = await db.get_active_route(message.from_user.id)
     
     if active_route:
-        route_id, name, start, end, start_time = active_route
+        route_id, name, start, end, start_time, _ = active_route
         try:
             # start_time уже является объектом datetime после преобразования в get_active_route
             formatted_time = start_time.strftime("%d.%m.%Y %H:%M")
@@ -321,8 +533,8 @@ async def show_routes(message: Message):
         )
         return
     
-    routes = db.get_available_routes()
-    if not routes:
+    keyboard = await render_available_routes()
+    if not keyboard:
         await message.answer(
             "На данный момент нет доступных маршрутов.\n"
             "Нажмите '➕ Добавить тестовый маршрут' для создания тестового маршрута.",
@@ -332,14 +544,14 @@ async def show_routes(message: Message):
     
     await message.answer(
         "📋 Доступные маршруты:",
-        reply_markup=get_routes_keyboard(routes)
+        reply_markup=keyboard
     )
 
 # Обработчик выбора маршрута для показа деталей
-@dp.callback_query(F.data.startswith("route_"))
-async def show_route_details(callback: CallbackQuery):
-    route_id = int(callback.data.replace("route_", ""))
-    route = db.get_route_details(route_id)
+@callback_router.action(ROUTE_DETAILS, int)
+async def show_route_details(callback: CallbackQuery, args: list):
+    route_id = args[0]
+    route = await db.get_route_details(route_id)
     
     if not route:
         await callback.answer("Маршрут не найден")
@@ -364,19 +576,16 @@ async def show_route_details(callback: CallbackQuery):
     )
 
 # Обработчик начала маршрута
-@dp.callback_query(F.data.startswith("start_route_"))
-async def start_route(callback: CallbackQuery):
-    route_id = int(callback.data.replace("start_route_", ""))
-    
-    # Проверяем, нет ли уже активного маршрута
-    active_route = db.get_active_route(callback.from_user.id)
-    if active_route:
-        await callback.answer("У вас уже есть активный маршрут!")
-        return
+@callback_router.action(ROUTE_START, int)
+async def start_route(callback: CallbackQuery, args: list):
+    route_id = args[0]
     
     try:
-        db.start_route(callback.from_user.id, route_id)
-        route = db.get_route_details(route_id)
+        # Маршрут не начнется, если у водителя уже есть активный
+        if await db.start_route(callback.from_user.id, route_id) is None:
+            await callback.answer("У вас уже есть активный маршрут!")
+            return
+        route = await db.get_route_details(route_id)
         
         await callback.message.edit_text(
             f"✅ Маршрут успешно начат!\n\n"
@@ -391,34 +600,33 @@ async def start_route(callback: CallbackQuery):
         await callback.answer("Произошла ошибка при начале маршрута")
 
 # Добавляем обработчик для возврата к списку маршрутов
-@dp.callback_query(F.data == "back_to_routes")
+@callback_router.action(ROUTES_BACK)
 async def back_to_routes(callback: CallbackQuery):
-    routes = db.get_available_routes()
     await callback.message.edit_text(
         "📋 Доступные маршруты:",
-        reply_markup=get_routes_keyboard(routes)
+        reply_markup=await render_available_routes()
     )
 
 # Добавляем обработчик для создания тестового маршрута
 @dp.message(F.text == "➕ Добавить тестовый маршрут")
 async def add_test_route(message: Message):
-    route_id = db.add_test_route()
+    route_id = await db.add_test_route()
     await message.answer(
         "✅ Тестовый маршрут упешно добавлен!",
         reply_markup=get_main_keyboard()
     )
 
 # Добавляем обработчик для завершения маршрута
-@dp.callback_query(F.data == "finish_route")
+@callback_router.action(ROUTE_FINISH)
 async def finish_active_route(callback: CallbackQuery):
-    active_route = db.get_active_route(callback.from_user.id)
+    active_route = await db.get_active_route(callback.from_user.id)
     if not active_route:
         await callback.answer("У вас нет активного маршрута")
         return
     
     route_id = active_route[0]  # Получаем ID маршрута
     try:
-        db.finish_route(callback.from_user.id, route_id)
+        await db.finish_route(callback.from_user.id, route_id)
         # Сначала редактируем сообщение с инлайн клавиатурой
         await callback.message.edit_text(
             "✅ Маршрут успешно завершен!",
@@ -436,12 +644,26 @@ async def finish_active_route(callback: CallbackQuery):
         logging.error(f"Error finishing route: {e}")
         await callback.answer("Произошла ошибка при завершении маршрута")
 
+# Клавиатура страницы истории маршрутов (None, если маршрутов нет).
+# История меняется, только когда водитель завершает маршрут, поэтому
+# запись кэша привязана к его последнему завершенному выполнению, а не к
+# версии каталога, которую сбрасывает любой водитель
+async def render_route_history_page(driver_id, cursor=None, direction='older'):
+    async def build():
+        page = await db.get_completed_routes_page(driver_id, cursor, direction)
+        if not page['items']:
+            return None
+        return get_route_history_keyboard(page['items'], page['older'], page['newer'])
+    stamp = await db.get_route_history_stamp(driver_id)
+    return await cached_keyboard(('route_history', driver_id, cursor, direction), build,
+                                 ('history', stamp))
+
 # Обработчик для истории маршрутов
 @dp.message(F.text == "📜 История маршрутов")
 async def show_route_history(message: Message):
-    completed_routes = db.get_completed_routes(message.from_user.id)
+    keyboard = await render_route_history_page(message.from_user.id)
     
-    if not completed_routes:
+    if not keyboard:
         await message.answer(
             "У вас пока нет завершенных маршрутов.",
             reply_markup=get_main_keyboard()
@@ -450,14 +672,27 @@ async def show_route_history(message: Message):
     
     await message.answer(
         "📜 История завершенных маршрутов:",
-        reply_markup=get_route_history_keyboard(completed_routes)
+        reply_markup=keyboard
     )
 
+# Обработчик перехода между страницами истории маршрутов
+@callback_router.action(HISTORY_PAGE, str, int, int)
+async def show_route_history_page(callback: CallbackQuery, args: list):
+    direction, end_time, execution_id = args
+    keyboard = await render_route_history_page(callback.from_user.id, (end_time, execution_id), direction)
+    
+    if not keyboard:
+        await callback.answer("Больше маршрутов нет")
+        return
+    
+    await callback.message.edit_reply_markup(reply_markup=keyboard)
+    await callback.answer()
+
 # Добавляем обработчик для просмотра деталей завершенного маршрута
-@dp.callback_query(F.data.startswith("history_route_"))
-async def show_completed_route_details(callback: CallbackQuery):
-    route_id = int(callback.data.replace("history_route_", ""))
-    route = db.get_route_details(route_id)
+@callback_router.action(HISTORY_ROUTE, int)
+async def show_completed_route_details(callback: CallbackQuery, args: list):
+    route_id = args[0]
+    route = await db.get_route_details(route_id)
     
     if not route:
         await callback.answer("Маршрут не найден")
@@ -481,12 +716,6 @@ async def show_completed_route_details(callback: CallbackQuery):
         distance = route['distance']
         cargo = route['cargo']
     
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="↩️ Назад к истории", callback_data="back_to_history")]
-        ]
-    )
-    
     await callback.message.edit_text(
         f"📜 Информация о завершенном маршруте:\n\n"
         f"📍 Маршрут: {name}\n"
@@ -495,14 +724,14 @@ async def show_completed_route_details(callback: CallbackQuery):
         f"📏 Расстояние: {distance} км\n"
         f"💰 Стоимость: {formatted_price} тенге\n"
         f"📦 Груз: {cargo}\n",
-        reply_markup=keyboard
+        reply_markup=BACK_TO_HISTORY_KEYBOARD
     )
 
 # Добавляем обработчик для возврата к истории маршрутов
-@dp.callback_query(F.data == "back_to_history")
+@callback_router.action(HISTORY_BACK)
 async def back_to_history(callback: CallbackQuery):
-    completed_routes = db.get_completed_routes(callback.from_user.id)
-    if not completed_routes:
+    keyboard = await render_route_history_page(callback.from_user.id)
+    if not keyboard:
         await callback.message.edit_text(
             "У вас пока нет завершенных маршрутов.",
             reply_markup=None
@@ -511,12 +740,50 @@ async def back_to_history(callback: CallbackQuery):
         
     await callback.message.edit_text(
         "📜 История завершенных маршрутов:",
-        reply_markup=get_route_history_keyboard(completed_routes)
+        reply_markup=keyboard
     )
 
+# Кнопки, которых нет в таблице действий (например, в старых сообщениях)
+@dp.callback_query()
+async def unknown_callback(callback: CallbackQuery):
+    await callback.answer("Кнопка устарела, откройте меню заново")
+
+# Запуск бота в режиме webhook
+async def run_webhook():
+    app = create_webhook_app(
+        dp, bot,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        ready_check=db.ping
+    )
+    runner = await start_webhook_server(app, WEBHOOK_HOST, WEBHOOK_PORT)
+    logging.info("Webhook слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    try:
+        if WEBHOOK_BASE_URL:
+            await bot.set_webhook(
+                WEBHOOK_BASE_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
 # Запуск бота
 async def main():
-    await dp.start_polling(bot)
+    metrics_runner = None
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(METRICS_HOST, int(METRICS_PORT))
+    try:
+        if BOT_MODE == 'webhook':
+            await run_webhook()
+        else:
+            await dp.start_polling(bot)
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await db.close()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
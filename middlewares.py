@@ -0,0 +1,163 @@
+"""Промежуточные обработчики (middleware) бота"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    'bot_handler_seconds',
+    'Время работы обработчика',
+    ['handler']
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    'bot_handler_errors_total',
+    'Исключения в обработчиках',
+    ['handler']
+)
+UPDATE_SECONDS = REGISTRY.histogram(
+    'bot_update_seconds',
+    'Полное время обработки обновления, включая фильтры и состояние',
+    ['event']
+)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Время работы обработчиков.
+
+    Регистрируется как внутренний middleware событий (message,
+    callback_query), когда обработчик уже выбран.
+    """
+
+    async def __call__(self, handler, event, data):
+        # Для инлайн-кнопок — обработчик действия из callbacks.CallbackRouter
+        handler_object = data.get('action') or data.get('handler')
+        name = handler_object.callback.__name__ if handler_object else 'unknown'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """Полное время обработки обновления; внешний middleware dp.update"""
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            UPDATE_SECONDS.observe(time.perf_counter() - started, event=event.event_type)
+
+SUPPRESSED_UPDATES = REGISTRY.counter(
+    'bot_suppressed_total',
+    'Обновления, не дошедшие до обработчика',
+    ['reason']
+)
+
+
+class DuplicateUpdateMiddleware(BaseMiddleware):
+    """Отбрасывает обновления с уже обработанным update_id.
+
+    Telegram повторяет доставку, если не получил ответ на webhook, а
+    при перезапуске long polling может прийти то же обновление.
+    Внешний middleware dp.update; помнит последние limit идентификаторов.
+    """
+
+    def __init__(self, limit=10_000):
+        self.limit = limit
+        self._seen = OrderedDict()
+
+    async def __call__(self, handler, event, data):
+        update_id = event.update_id
+        if update_id in self._seen:
+            SUPPRESSED_UPDATES.inc(reason='duplicate_update')
+            return None
+        self._seen[update_id] = None
+        if len(self._seen) > self.limit:
+            self._seen.popitem(last=False)
+        return await handler(event, data)
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Гасит повторные одинаковые запросы водителя.
+
+    Запрос — это текст сообщения вне сценария FSM или callback_data
+    кнопки. Одинаковый запрос не передается обработчику, если такой же
+    еще выполняется или был принят меньше window секунд назад: повтор
+    дожидается первого запроса и возвращает его результат. Ответ
+    водителю отправляет обработчик первого запроса в тот же чат. На
+    повторное нажатие кнопки сразу отправляется ответ, чтобы у водителя
+    не крутился индикатор загрузки.
+    Внешний middleware событий message и callback_query.
+    """
+
+    def __init__(self, window=1.0):
+        self.window = window
+        # (telegram_id, запрос) -> (время приема, результат обработки), в порядке приема
+        self._accepted = OrderedDict()
+        # (telegram_id, запрос) -> результат обработки выполняющегося запроса
+        self._in_flight = {}
+
+    async def __call__(self, handler, event, data):
+        key = self._request_key(event, data)
+        if key is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        self._forget_older_than(now - self.window)
+        if key in self._in_flight:
+            return await self._suppress(event, 'in_flight', self._in_flight[key])
+        if key in self._accepted:
+            return await self._suppress(event, 'debounced', self._accepted[key][1])
+
+        outcome = asyncio.get_running_loop().create_future()
+        self._accepted[key] = (now, outcome)
+        self._in_flight[key] = outcome
+        result = None
+        try:
+            result = await handler(event, data)
+            return result
+        finally:
+            del self._in_flight[key]
+            # При ошибке повторы получают None, исключение остается у первого
+            outcome.set_result(result)
+
+    @staticmethod
+    def _request_key(event, data):
+        if event.from_user is None:
+            return None
+        if isinstance(event, CallbackQuery):
+            return event.from_user.id, event.data
+        # Ввод в сценарии FSM (сумма, комментарий) может законно повторяться
+        if data.get('raw_state') is not None or not event.text:
+            return None
+        return event.from_user.id, event.text
+
+    def _forget_older_than(self, cutoff):
+        while self._accepted:
+            key, (accepted_at, _) = next(iter(self._accepted.items()))
+            if accepted_at >= cutoff:
+                break
+            del self._accepted[key]
+
+    @staticmethod
+    async def _suppress(event, reason, outcome):
+        SUPPRESSED_UPDATES.inc(reason=reason)
+        if isinstance(event, CallbackQuery):
+            try:
+                await event.answer()
+            except Exception as error:
+                logger.debug("Не удалось ответить на повторное нажатие: %s", error)
+        # shield: отмена повтора не должна отменять общий результат
+        return await asyncio.shield(outcome)
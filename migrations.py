@@ -0,0 +1,666 @@
+"""Версионированные миграции схемы базы данных.
+
+Номер применённой версии хранится в PRAGMA user_version. Каждая миграция
+выполняется один раз, в одной транзакции вместе с обновлением версии.
+Новые изменения схемы добавляются только в конец списка MIGRATIONS.
+
+Индексы и триггеры, созданные миграциями, но отсутствующие в базе
+(generate_test_data.py удаляет их на время загрузки), migrate() создает
+заново при каждом запуске.
+"""
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+# Время в миллисекундах Unix в SQL
+_NOW_MS = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+
+def _create_tables(connection):
+    """Базовые таблицы"""
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS drivers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            full_name TEXT NOT NULL,
+            phone TEXT NOT NULL
+        )
+    ''')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS routes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            route_name TEXT NOT NULL,
+            start_point TEXT NOT NULL,
+            end_point TEXT NOT NULL,
+            distance INTEGER NOT NULL,
+            price REAL NOT NULL,
+            cargo_type TEXT
+        )
+    ''')
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS route_executions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            route_id INTEGER NOT NULL,
+            driver_id INTEGER NOT NULL,
+            start_time TIMESTAMP,
+            end_time TIMESTAMP,
+            status TEXT DEFAULT 'pending',
+            FOREIGN KEY (route_id) REFERENCES routes (id),
+            FOREIGN KEY (driver_id) REFERENCES drivers (id)
+        )
+    ''')
+    connection.execute(f'''
+        CREATE TABLE IF NOT EXISTS expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            driver_id INTEGER NOT NULL,
+            expense_type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            receipt_photo TEXT,
+            comment TEXT,
+            route_execution_id INTEGER,
+            created_at TIMESTAMP DEFAULT ({_NOW_MS}),
+            FOREIGN KEY (driver_id) REFERENCES drivers (id),
+            FOREIGN KEY (route_execution_id) REFERENCES route_executions (id)
+        )
+    ''')
+
+
+def _add_routes_created_at(connection):
+    """Время создания маршрута (заполняется страницей управления маршрутами)"""
+    if not _column_exists(connection, 'routes', 'created_at'):
+        connection.execute('ALTER TABLE routes ADD COLUMN created_at TIMESTAMP')
+
+
+def _create_indexes(connection):
+    """Индексы для запросов бота и страниц"""
+    # Активный маршрут водителя и история его маршрутов
+    connection.execute('''
+        CREATE INDEX IF NOT EXISTS idx_route_executions_driver_status
+        ON route_executions (driver_id, status, route_id)
+    ''')
+    # Проверка доступности маршрута в get_available_routes
+    connection.execute('''
+        CREATE INDEX IF NOT EXISTS idx_route_executions_route_status
+        ON route_executions (route_id, status)
+    ''')
+    # Расходы водителя в порядке добавления
+    connection.execute('''
+        CREATE INDEX IF NOT EXISTS idx_expenses_driver_created
+        ON expenses (driver_id, created_at)
+    ''')
+    # Расходы по выполнению маршрута
+    connection.execute('''
+        CREATE INDEX IF NOT EXISTS idx_expenses_route_execution
+        ON expenses (route_execution_id)
+    ''')
+
+
+def _timestamps_to_epoch_ms(connection):
+    """Перевести время из текста в целые миллисекунды Unix (UTC)"""
+    # Текст записывался как str(datetime.now()) в локальном времени,
+    # модификатор 'utc' переводит его в UTC
+    columns = [
+        ('expenses', 'created_at'),
+        ('route_executions', 'start_time'),
+        ('route_executions', 'end_time'),
+        ('routes', 'created_at'),
+    ]
+    for table, column in columns:
+        _text_to_epoch_ms(connection, table, column, "'utc'")
+
+
+def _text_to_epoch_ms(connection, table, column, modifier=None):
+    """Перевести текстовое время колонки в миллисекунды Unix.
+
+    Текст, который SQLite не разбирает, становится NULL; число таких
+    строк пишется в журнал.
+    """
+    julianday = f'julianday({column}, {modifier})' if modifier else f'julianday({column})'
+    unparsed = connection.execute(f'''
+        SELECT COUNT(*) FROM {table}
+        WHERE typeof({column}) = 'text' AND {julianday} IS NULL
+    ''').fetchone()[0]
+    if unparsed:
+        logger.warning(
+            "%s.%s: %d значений не удалось разобрать как время, они заменены на NULL",
+            table, column, unparsed
+        )
+    connection.execute(f'''
+        UPDATE {table}
+        SET {column} = CAST(
+            ROUND(({julianday} - 2440587.5) * 86400000)
+            AS INTEGER
+        )
+        WHERE typeof({column}) = 'text'
+    ''')
+
+
+def _create_history_index(connection):
+    """Индекс для постраничной истории завершенных маршрутов"""
+    connection.execute('''
+        CREATE INDEX IF NOT EXISTS idx_route_executions_completed
+        ON route_executions (driver_id, end_time)
+        WHERE status = 'completed'
+    ''')
+
+
+def _create_catalogue_version(connection):
+    """Версия каталога маршрутов для кэша в database.VersionedCache"""
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    connection.execute(
+        "INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('routes', 0)"
+    )
+    # Версия растет при любом изменении маршрутов и их выполнений,
+    # кто бы ни писал в базу: бот или страницы
+    events = [
+        ('routes_insert', 'INSERT ON routes'),
+        ('routes_update', 'UPDATE ON routes'),
+        ('routes_delete', 'DELETE ON routes'),
+        ('route_executions_insert', 'INSERT ON route_executions'),
+        ('route_executions_update', 'UPDATE OF status ON route_executions'),
+        ('route_executions_delete', 'DELETE ON route_executions'),
+    ]
+    for name, event in events:
+        connection.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_catalogue_version_{name}
+            AFTER {event}
+            BEGIN
+                UPDATE cache_versions SET version = version + 1 WHERE name = 'routes';
+            END
+        ''')
+
+
+def _materialize_route_status(connection):
+    """Статус маршрута: 'open' — доступен, 'completed' — уже выполнен"""
+    if not _column_exists(connection, 'routes', 'status'):
+        connection.execute(
+            "ALTER TABLE routes ADD COLUMN status TEXT NOT NULL DEFAULT 'open'"
+        )
+    connection.execute('''
+        UPDATE routes
+        SET status = 'completed'
+        WHERE EXISTS (
+            SELECT 1
+            FROM route_executions re
+            WHERE re.route_id = routes.id
+            AND re.status = 'completed'
+        )
+    ''')
+    # Список доступных маршрутов читается целиком из индекса
+    connection.execute('''
+        CREATE INDEX IF NOT EXISTS idx_routes_open
+        ON routes (id, route_name, start_point, end_point)
+        WHERE status = 'open'
+    ''')
+
+    # Статус поддерживают триггеры при любом изменении выполнений
+    connection.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_route_status_insert
+        AFTER INSERT ON route_executions
+        WHEN NEW.status = 'completed'
+        BEGIN
+            UPDATE routes SET status = 'completed' WHERE id = NEW.route_id;
+        END
+    ''')
+    connection.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_route_status_complete
+        AFTER UPDATE OF status ON route_executions
+        WHEN NEW.status = 'completed'
+        BEGIN
+            UPDATE routes SET status = 'completed' WHERE id = NEW.route_id;
+        END
+    ''')
+    # Если завершенное выполнение удалено или изменено, статус пересчитывается
+    recompute = '''
+        UPDATE routes
+        SET status = CASE WHEN EXISTS (
+            SELECT 1
+            FROM route_executions re
+            WHERE re.route_id = OLD.route_id
+            AND re.status = 'completed'
+        ) THEN 'completed' ELSE 'open' END
+        WHERE id = OLD.route_id;
+    '''
+    connection.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_route_status_reopen
+        AFTER UPDATE OF status ON route_executions
+        WHEN OLD.status = 'completed' AND NEW.status IS NOT 'completed'
+        BEGIN
+            {recompute}
+        END
+    ''')
+    connection.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_route_status_delete
+        AFTER DELETE ON route_executions
+        WHEN OLD.status = 'completed'
+        BEGIN
+            {recompute}
+        END
+    ''')
+
+
+def _create_fsm_states(connection):
+    """Состояния и данные FSM бота (storage.SQLiteStorage)"""
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    # Удаление устаревших состояний
+    connection.execute('''
+        CREATE INDEX IF NOT EXISTS idx_fsm_states_updated
+        ON fsm_states (updated_at)
+    ''')
+
+
+# Разрезы таблицы expense_totals: (вид, ключ, условие). В выражениях
+# {row} — префикс строки расхода: NEW. или OLD. в триггерах, пусто при
+# пересчете. Дни и месяцы считаются в местном времени, как их видит водитель
+_EXPENSE_TOTALS_KEYS = [
+    ('type', "{row}expense_type", "1"),
+    ('month', "strftime('%Y-%m', {row}created_at / 1000, 'unixepoch', 'localtime')",
+     "{row}created_at IS NOT NULL"),
+    ('day', "date({row}created_at / 1000, 'unixepoch', 'localtime')",
+     "{row}created_at IS NOT NULL"),
+    ('execution', "{row}route_execution_id", "{row}route_execution_id IS NOT NULL"),
+]
+
+
+def _expense_totals_changes(row, sign):
+    """Операторы триггера, добавляющие (sign='+') или вычитающие (sign='-')
+    расход строки row из итогов"""
+    statements = []
+    for kind, key, condition in _EXPENSE_TOTALS_KEYS:
+        key = key.format(row=row)
+        condition = condition.format(row=row)
+        statements.append(f'''
+            INSERT INTO expense_totals (driver_id, kind, key, count, total)
+            SELECT {row}driver_id, '{kind}', {key}, {sign}1, {sign}{row}amount
+            WHERE {condition}
+            ON CONFLICT (driver_id, kind, key) DO UPDATE SET
+                count = count + excluded.count,
+                total = total + excluded.total;
+        ''')
+    return ''.join(statements)
+
+
+def rebuild_expense_totals(connection):
+    """Пересчитать expense_totals по таблице expenses"""
+    connection.execute('DELETE FROM expense_totals')
+    for kind, key, condition in _EXPENSE_TOTALS_KEYS:
+        key = key.format(row='')
+        connection.execute(f'''
+            INSERT INTO expense_totals (driver_id, kind, key, count, total)
+            SELECT driver_id, '{kind}', {key}, COUNT(*), SUM(amount)
+            FROM expenses
+            WHERE {condition.format(row='')}
+            GROUP BY driver_id, {key}
+        ''')
+
+
+def _create_expense_totals(connection):
+    """Итоги расходов водителя по типам, месяцам, дням и выполнениям маршрутов.
+
+    Поддерживаются триггерами, поэтому сводка читает несколько строк по
+    первичному ключу, сколько бы расходов ни было у водителя. Строки с
+    нулевым количеством (после удаления расходов) не удаляются.
+    """
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS expense_totals (
+            driver_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            key NOT NULL,
+            count INTEGER NOT NULL,
+            total REAL NOT NULL,
+            PRIMARY KEY (driver_id, kind, key)
+        ) WITHOUT ROWID
+    ''')
+    connection.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_expense_totals_insert
+        AFTER INSERT ON expenses
+        BEGIN
+            {_expense_totals_changes('NEW.', '+')}
+        END
+    ''')
+    connection.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_expense_totals_delete
+        AFTER DELETE ON expenses
+        BEGIN
+            {_expense_totals_changes('OLD.', '-')}
+        END
+    ''')
+    connection.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_expense_totals_update
+        AFTER UPDATE OF driver_id, expense_type, amount, route_execution_id, created_at
+        ON expenses
+        BEGIN
+            {_expense_totals_changes('OLD.', '-')}
+            {_expense_totals_changes('NEW.', '+')}
+        END
+    ''')
+    rebuild_expense_totals(connection)
+
+
+def _unique_active_route(connection):
+    """Не больше одного маршрута в пути у водителя.
+
+    Если у водителя уже несколько маршрутов в пути, остается последний
+    начатый, остальные отменяются (статус cancelled).
+    """
+    connection.execute('''
+        UPDATE route_executions
+        SET status = 'cancelled'
+        WHERE status = 'in_progress'
+        AND EXISTS (
+            SELECT 1 FROM route_executions newer
+            WHERE newer.driver_id = route_executions.driver_id
+            AND newer.status = 'in_progress'
+            AND (newer.start_time > route_executions.start_time
+                 OR (newer.start_time = route_executions.start_time
+                     AND newer.id > route_executions.id))
+        )
+    ''')
+    connection.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_route_executions_active
+        ON route_executions (driver_id)
+        WHERE status = 'in_progress'
+    ''')
+
+
+def _create_receipt_files(connection):
+    """Архив фото чеков (см. receipts.py).
+
+    receipt_files — скачанные файлы по file_unique_id Telegram, у
+    расхода receipt_unique_id — какой файл архивировать, receipt_path —
+    путь к файлу в архиве, когда он скачан.
+    """
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS receipt_files (
+            file_unique_id TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL,
+            path TEXT NOT NULL,
+            thumbnail_path TEXT,
+            size INTEGER NOT NULL,
+            created_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    for column in ('receipt_unique_id', 'receipt_path'):
+        if not _column_exists(connection, 'expenses', column):
+            connection.execute(f'ALTER TABLE expenses ADD COLUMN {column} TEXT')
+    # Расходы, чеки которых еще не скачаны
+    connection.execute('''
+        CREATE INDEX IF NOT EXISTS idx_expenses_receipt_pending
+        ON expenses (id)
+        WHERE receipt_unique_id IS NOT NULL AND receipt_path IS NULL
+    ''')
+
+
+def _create_notifications(connection):
+    """Очередь уведомлений водителям, которую отправляет бот (см. sender.py)"""
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            created_at INTEGER NOT NULL,
+            sent_at INTEGER
+        )
+    ''')
+    connection.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notifications_pending
+        ON notifications (id)
+        WHERE status = 'pending'
+    ''')
+
+
+# Таблицы, изменения которых пишутся в журнал changes
+CHANGE_LOG_TABLES = ('drivers', 'routes', 'route_executions', 'expenses')
+
+
+def create_change_log_triggers(connection):
+    """Триггеры, которые пишут в changes каждое изменение таблиц CHANGE_LOG_TABLES"""
+    for table in CHANGE_LOG_TABLES:
+        for op, row in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD')):
+            connection.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_changes_{table}_{op}
+                AFTER {op.upper()} ON {table}
+                BEGIN
+                    INSERT INTO changes (entity, entity_id, op, changed_at)
+                    VALUES ('{table}', {row}.id, '{op}', {_NOW_MS});
+                END
+            ''')
+
+
+def _create_change_log(connection):
+    """Журнал изменений для читателей, обновляющих данные по частям.
+
+    seq растет монотонно (AUTOINCREMENT не использует номера повторно).
+    Строка с entity = '*' и op = 'reset' означает, что данные изменены
+    целиком (например, генератором тестовых данных).
+    """
+    connection.execute('''
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            changed_at INTEGER NOT NULL
+        )
+    ''')
+    connection.execute('''
+        CREATE INDEX IF NOT EXISTS idx_changes_changed_at
+        ON changes (changed_at)
+    ''')
+    create_change_log_triggers(connection)
+
+
+def _fix_expense_route_executions(connection):
+    """Привязать расходы к выполнениям маршрутов, а не к маршрутам.
+
+    Бот записывал в expenses.route_execution_id id маршрута. Привязка
+    верна, если выполнение с этим id шло у водителя в момент расхода.
+    Иначе, если в тот момент шло выполнение маршрута с этим id, расход
+    привязывается к нему; остальные расходы не меняются. Итоги
+    expense_totals пересчитывает триггер.
+    """
+    running = '''
+        re.driver_id = expenses.driver_id
+        AND re.start_time <= expenses.created_at
+        AND (re.end_time IS NULL OR re.end_time >= expenses.created_at)
+    '''
+    connection.execute(f'''
+        UPDATE expenses
+        SET route_execution_id = (
+            SELECT re.id FROM route_executions re
+            WHERE re.route_id = expenses.route_execution_id AND {running}
+            ORDER BY re.start_time DESC
+            LIMIT 1
+        )
+        WHERE route_execution_id IS NOT NULL
+        AND NOT EXISTS (
+            SELECT 1 FROM route_executions re
+            WHERE re.id = expenses.route_execution_id AND {running}
+        )
+        AND EXISTS (
+            SELECT 1 FROM route_executions re
+            WHERE re.route_id = expenses.route_execution_id AND {running}
+        )
+    ''')
+
+
+def _expenses_created_at_default(connection):
+    """Время расхода по умолчанию — миллисекунды Unix, а не текст.
+
+    До этой миграции вставка без created_at записывала CURRENT_TIMESTAMP
+    (текст в UTC). Такие значения переводятся в миллисекунды, а таблица
+    пересоздается с новым значением по умолчанию: SQLite не умеет
+    изменять DEFAULT колонки. Индексы и триггеры таблицы создаются заново,
+    счетчик AUTOINCREMENT сохраняется.
+    """
+    # Триггеры итогов и журнала изменений обновляют переведенные строки
+    _text_to_epoch_ms(connection, 'expenses', 'created_at')
+
+    columns = connection.execute('PRAGMA table_info(expenses)').fetchall()
+    if any(row[1] == 'created_at' and row[4] == _NOW_MS for row in columns):
+        return
+
+    table_sql = connection.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'expenses'"
+    ).fetchone()[0]
+    new_sql = table_sql.replace(
+        'DEFAULT CURRENT_TIMESTAMP', f'DEFAULT ({_NOW_MS})', 1
+    ).replace('expenses', 'expenses_new', 1)
+    objects = [sql for (sql,) in connection.execute('''
+        SELECT sql FROM sqlite_master
+        WHERE tbl_name = 'expenses' AND type IN ('index', 'trigger') AND sql IS NOT NULL
+    ''')]
+    sequence = connection.execute(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'expenses'"
+    ).fetchone()
+    column_names = ', '.join(row[1] for row in columns)
+
+    connection.execute(new_sql)
+    connection.execute(
+        f'INSERT INTO expenses_new ({column_names}) SELECT {column_names} FROM expenses'
+    )
+    connection.execute('DROP TABLE expenses')
+    connection.execute('ALTER TABLE expenses_new RENAME TO expenses')
+    for sql in objects:
+        connection.execute(sql)
+    if sequence:
+        connection.execute(
+            "UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = 'expenses'",
+            sequence
+        )
+
+
+# (версия, функция миграции) в порядке применения
+MIGRATIONS = [
+    (1, _create_tables),
+    (2, _add_routes_created_at),
+    (3, _create_indexes),
+    (4, _timestamps_to_epoch_ms),
+    (5, _create_history_index),
+    (6, _create_catalogue_version),
+    (7, _materialize_route_status),
+    (8, _create_fsm_states),
+    (9, _create_expense_totals),
+    (10, _unique_active_route),
+    (11, _create_receipt_files),
+    (12, _create_notifications),
+    (13, _create_change_log),
+    (14, _fix_expense_route_executions),
+    (15, _expenses_created_at_default),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def _column_exists(connection, table, column):
+    """Проверить наличие колонки в таблице"""
+    columns = connection.execute(f'PRAGMA table_info({table})').fetchall()
+    return any(row[1] == column for row in columns)
+
+
+def get_schema_version(connection):
+    """Получить текущую версию схемы"""
+    return connection.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(connection):
+    """Применить к базе все недостающие миграции и вернуть пропавшие
+    индексы и триггеры.
+
+    Транзакция открывается через BEGIN IMMEDIATE, поэтому бот и страницы,
+    запущенные одновременно, не применят одну миграцию дважды.
+    """
+    _upgrade(connection)
+    restore_schema_objects(connection)
+
+
+def _upgrade(connection):
+    """Применить недостающие миграции"""
+    if get_schema_version(connection) >= SCHEMA_VERSION:
+        return
+
+    connection.commit()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        # Версию перечитываем под блокировкой записи
+        version = get_schema_version(connection)
+        for target, step in MIGRATIONS:
+            if target <= version:
+                continue
+            step(connection)
+            connection.execute(f'PRAGMA user_version = {target}')
+        connection.execute('COMMIT')
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+
+
+# Индексы и триггеры схемы после всех миграций: {имя: CREATE ...}
+_schema_objects = None
+
+
+def _expected_schema_objects():
+    """Индексы и триггеры, которые создают миграции на пустой базе"""
+    global _schema_objects
+    if _schema_objects is None:
+        connection = sqlite3.connect(':memory:')
+        try:
+            _upgrade(connection)
+            _schema_objects = dict(connection.execute('''
+                SELECT name, sql FROM sqlite_master
+                WHERE type IN ('index', 'trigger') AND sql IS NOT NULL
+            ''').fetchall())
+        finally:
+            connection.close()
+    return _schema_objects
+
+
+def _missing_schema_objects(connection):
+    existing = {name for (name,) in connection.execute('SELECT name FROM sqlite_master')}
+    return [name for name in _expected_schema_objects() if name not in existing]
+
+
+def restore_schema_objects(connection):
+    """Создать индексы и триггеры миграций, которых нет в базе.
+
+    Если не было триггеров итогов расходов, итоги пересчитываются; если не
+    было триггеров журнала изменений, в журнал пишется сброс, чтобы
+    читатели загрузили данные заново. Возвращает имена созданных объектов.
+    """
+    if not _missing_schema_objects(connection):
+        return []
+
+    connection.commit()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        missing = _missing_schema_objects(connection)
+        for name in missing:
+            connection.execute(_expected_schema_objects()[name])
+        if any(name.startswith('trg_expense_totals_') for name in missing):
+            rebuild_expense_totals(connection)
+        if any(name.startswith('trg_changes_') for name in missing):
+            connection.execute(f'''
+                INSERT INTO changes (entity, entity_id, op, changed_at)
+                VALUES ('*', 0, 'reset', {_NOW_MS})
+            ''')
+        connection.execute('COMMIT')
+    except Exception:
+        connection.execute('ROLLBACK')
+        raise
+    return missing
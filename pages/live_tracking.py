@@ -1,11 +1,11 @@
 import streamlit as st
 import folium
 from folium import plugins
-import sqlite3
 import pandas as pd
 from datetime import datetime, timedelta
 from streamlit_folium import folium_static
 import random
+from database import get_connection_manager
 
 # Настройка страницы
 st.set_page_config(
@@ -17,11 +17,12 @@ st.set_page_config(
 # Подключение к базе данных
 @st.cache_resource
 def get_database_connection():
-    return sqlite3.connect('transport_expenses.db', check_same_thread=False)
+    return get_connection_manager('transport_expenses.db')
 
 # Загрузка данных о водителях
-def load_drivers(conn):
-    return pd.read_sql("SELECT telegram_id, full_name FROM drivers", conn)
+def load_drivers(manager):
+    with manager.reader() as conn:
+        return pd.read_sql("SELECT telegram_id, full_name FROM drivers", conn)
 
 # Демонстрационные данные о местоположении (основные города Казахстана)
 DEMO_LOCATIONS = {
@@ -154,13 +155,13 @@ def create_map(vehicles_df):
     return m
 
 # Получаем соединение с базой данных
-conn = get_database_connection()
+manager = get_database_connection()
 
 # Заголовок страницы
 st.title("🗺️ Отслеживание транспорта в реальном времени")
 
 # Загружаем данные о водителях
-drivers_df = load_drivers(conn)
+drivers_df = load_drivers(manager)
 
 # Генерируем демонстрационные данные
 vehicles_df = generate_demo_vehicle_data(drivers_df)
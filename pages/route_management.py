@@ -1,7 +1,6 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
-from datetime import datetime
+from database import get_connection_manager, last_change_seq, now_ms, LOCAL_TIMEZONE
 
 # Настройка страницы
 st.set_page_config(
@@ -13,41 +12,60 @@ st.set_page_config(
 # Подключение к базе данных
 @st.cache_resource
 def get_database_connection():
-    conn = sqlite3.connect('transport_expenses.db', check_same_thread=False)
-    return conn
+    return get_connection_manager('transport_expenses.db')
 
 # Функции для работы с данными
-def load_drivers(conn):
-    return pd.read_sql("SELECT telegram_id, full_name FROM drivers", conn)
+def to_local_datetime(column):
+    """Перевести колонку с миллисекундами Unix в локальное время"""
+    return pd.to_datetime(column, unit='ms', utc=True).dt.tz_convert(LOCAL_TIMEZONE).dt.tz_localize(None)
 
-def load_cities(conn):
-    cities_start = pd.read_sql("SELECT DISTINCT start_point FROM routes", conn)
-    cities_end = pd.read_sql("SELECT DISTINCT end_point FROM routes", conn)
+def get_change_seq(manager):
+    """Номер последнего изменения данных; им помечены кэши загрузки ниже"""
+    with manager.reader() as conn:
+        return last_change_seq(conn)
+
+# Загрузки кэшируются до следующего изменения данных (аргумент seq),
+# поэтому перерисовка страницы без изменений не обращается к базе
+@st.cache_data
+def load_drivers(_manager, seq):
+    with _manager.reader() as conn:
+        return pd.read_sql("SELECT telegram_id, full_name FROM drivers", conn)
+
+@st.cache_data
+def load_cities(_manager, seq):
+    with _manager.reader() as conn:
+        cities_start = pd.read_sql("SELECT DISTINCT start_point FROM routes", conn)
+        cities_end = pd.read_sql("SELECT DISTINCT end_point FROM routes", conn)
     return pd.concat([cities_start['start_point'], cities_end['end_point']]).unique()
 
-def load_cargo_types(conn):
-    return pd.read_sql("SELECT DISTINCT cargo_type FROM routes", conn)['cargo_type'].unique()
+@st.cache_data
+def load_cargo_types(_manager, seq):
+    with _manager.reader() as conn:
+        return pd.read_sql("SELECT DISTINCT cargo_type FROM routes", conn)['cargo_type'].unique()
 
-def load_active_routes(conn):
-    return pd.read_sql("""
-        SELECT 
-            r.route_name,
-            r.start_point,
-            r.end_point,
-            r.distance,
-            r.price,
-            r.cargo_type,
-            d.full_name as driver_name,
-            re.start_time,
-            re.status
-        FROM routes r
-        JOIN route_executions re ON r.id = re.route_id
-        JOIN drivers d ON re.driver_id = d.telegram_id
-        WHERE re.status IN ('assigned', 'in_progress')
-        ORDER BY re.start_time DESC
-    """, conn)
+@st.cache_data
+def load_active_routes(_manager, seq):
+    with _manager.reader() as conn:
+        return pd.read_sql("""
+            SELECT 
+                r.route_name,
+                r.start_point,
+                r.end_point,
+                r.distance,
+                r.price,
+                r.cargo_type,
+                d.full_name as driver_name,
+                re.start_time,
+                re.status
+            FROM routes r
+            JOIN route_executions re ON r.id = re.route_id
+            JOIN drivers d ON re.driver_id = d.telegram_id
+            WHERE re.status IN ('assigned', 'in_progress')
+            ORDER BY re.start_time DESC
+        """, conn)
 
-def load_filtered_routes(conn, selected_driver, selected_status, selected_cargo):
+@st.cache_data
+def load_filtered_routes(_manager, seq, selected_driver, selected_status, selected_cargo):
     query = """
         SELECT 
             r.route_name,
@@ -65,96 +83,91 @@ def load_filtered_routes(conn, selected_driver, selected_status, selected_cargo)
         JOIN drivers d ON re.driver_id = d.telegram_id
         WHERE 1=1
     """
+    params = []
     
     if selected_driver != 'Все':
-        query += f" AND d.full_name = '{selected_driver}'"
+        query += " AND d.full_name = ?"
+        params.append(selected_driver)
     if selected_status != 'Все':
-        query += f" AND re.status = '{selected_status}'"
+        query += " AND re.status = ?"
+        params.append(selected_status)
     if selected_cargo != 'Все':
-        query += f" AND r.cargo_type = '{selected_cargo}'"
+        query += " AND r.cargo_type = ?"
+        params.append(selected_cargo)
     
     query += " ORDER BY re.start_time DESC"
     
-    return pd.read_sql(query, conn)
+    with _manager.reader() as conn:
+        return pd.read_sql(query, conn, params=params)
 
 # Функция для добавления нового маршрута
-def add_new_route(conn, route_data):
-    cursor = conn.cursor()
-    
+def add_new_route(manager, route_data):
     try:
-        # Проверяем существование таблиц
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS routes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                route_name TEXT,
-                start_point TEXT,
-                end_point TEXT,
-                distance INTEGER,
-                price INTEGER,
-                cargo_type TEXT,
-                created_at DATETIME
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS route_executions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                route_id INTEGER,
-                driver_id INTEGER,
-                start_time DATETIME,
-                end_time DATETIME,
-                status TEXT,
-                FOREIGN KEY (route_id) REFERENCES routes(id),
-                FOREIGN KEY (driver_id) REFERENCES drivers(telegram_id)
-            )
-        """)
-
-        # Добавление маршрута
-        cursor.execute("""
-            INSERT INTO routes 
-            (route_name, start_point, end_point, distance, price, cargo_type, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            f"Маршрут {route_data['start_point']}-{route_data['end_point']}",
-            route_data['start_point'],
-            route_data['end_point'],
-            route_data['distance'],
-            route_data['price'],
-            route_data['cargo_type'],
-            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        ))
-        
-        route_id = cursor.lastrowid
-        
-        # Добавление назначения маршрута водителю
-        if route_data['driver_id']:
+        with manager.writer() as conn:
+            cursor = conn.cursor()
+            
+            # Добавление маршрута; версию каталога для кэша бота
+            # увеличивают триггеры базы
             cursor.execute("""
-                INSERT INTO route_executions 
-                (route_id, driver_id, start_time, status)
-                VALUES (?, ?, ?, ?)
+                INSERT INTO routes 
+                (route_name, start_point, end_point, distance, price, cargo_type, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
             """, (
-                route_id, 
-                route_data['driver_id'], 
-                datetime.now().strftime('%Y-%m-%d %H:%M:%S'), 
-                'assigned'
+                f"Маршрут {route_data['start_point']}-{route_data['end_point']}",
+                route_data['start_point'],
+                route_data['end_point'],
+                route_data['distance'],
+                route_data['price'],
+                route_data['cargo_type'],
+                now_ms()
             ))
-        
-        conn.commit()
+            
+            route_id = cursor.lastrowid
+            
+            # Добавление назначения маршрута водителю
+            if route_data['driver_id']:
+                cursor.execute("""
+                    INSERT INTO route_executions 
+                    (route_id, driver_id, start_time, status)
+                    VALUES (?, ?, ?, ?)
+                """, (
+                    route_id, 
+                    route_data['driver_id'], 
+                    now_ms(), 
+                    'assigned'
+                ))
+                
+                # Уведомление водителю отправит бот (таблица notifications)
+                formatted_price = "{:,}".format(int(route_data['price'])).replace(",", " ")
+                cursor.execute("""
+                    INSERT INTO notifications (chat_id, text, created_at)
+                    VALUES (?, ?, ?)
+                """, (
+                    route_data['driver_id'],
+                    f"🚛 Вам назначен маршрут!\n\n"
+                    f"🏁 Откуда: {route_data['start_point']}\n"
+                    f"🏁 Куда: {route_data['end_point']}\n"
+                    f"📏 Расстояние: {route_data['distance']} км\n"
+                    f"💰 Стоимость: {formatted_price} тенге\n"
+                    f"📦 Груз: {route_data['cargo_type']}",
+                    now_ms()
+                ))
+            
         return True, "Маршрут успешно добавлен!"
     except Exception as e:
-        conn.rollback()
         return False, f"Ошибка при добавлении маршрута: {str(e)}"
 
 # Получаем соединение с базой данных
-conn = get_database_connection()
+manager = get_database_connection()
 
 # Заголовок страницы
 st.title("🚛 Управление маршрутами")
 
 # Загрузка начальных данных
-drivers = load_drivers(conn)
-cities = load_cities(conn)
-cargo_types = load_cargo_types(conn)
+change_seq = get_change_seq(manager)
+drivers = load_drivers(manager, change_seq)
+cities = load_cities(manager, change_seq)
+cargo_types = load_cargo_types(manager, change_seq)
 
 # Создание формы для добавления маршрута
 with st.form("add_route_form"):
@@ -208,7 +221,7 @@ with st.form("add_route_form"):
                 'cargo_type': cargo_type
             }
             
-            success, message = add_new_route(conn, route_data)
+            success, message = add_new_route(manager, route_data)
             if success:
                 st.success(message)
                 # Заменяем experimental_rerun на rerun
@@ -219,11 +232,11 @@ with st.form("add_route_form"):
 # Отображение текущих активных маршрутов
 st.subheader("Активные маршруты")
 
-active_routes = load_active_routes(conn)
+active_routes = load_active_routes(manager, change_seq)
  
 if not active_routes.empty:
     # Форматирование данных для отображения
-    active_routes['start_time'] = pd.to_datetime(active_routes['start_time']).dt.strftime('%Y-%m-%d %H:%M')
+    active_routes['start_time'] = to_local_datetime(active_routes['start_time']).dt.strftime('%Y-%m-%d %H:%M')
     active_routes['price'] = active_routes['price'].apply(lambda x: f"{x:,.0f} ₸")
     active_routes['distance'] = active_routes['distance'].apply(lambda x: f"{x:,.0f} км")
     
@@ -261,12 +274,12 @@ with col3:
     )
 
 # Загрузка и отображение отфильтрованных данных
-filtered_routes = load_filtered_routes(conn, selected_driver, selected_status, selected_cargo)
+filtered_routes = load_filtered_routes(manager, change_seq, selected_driver, selected_status, selected_cargo)
 
 if not filtered_routes.empty:
     # Форматирование данных
-    filtered_routes['start_time'] = pd.to_datetime(filtered_routes['start_time']).dt.strftime('%Y-%m-%d %H:%M')
-    filtered_routes['end_time'] = pd.to_datetime(filtered_routes['end_time']).dt.strftime('%Y-%m-%d %H:%M')
+    filtered_routes['start_time'] = to_local_datetime(filtered_routes['start_time']).dt.strftime('%Y-%m-%d %H:%M')
+    filtered_routes['end_time'] = to_local_datetime(filtered_routes['end_time']).dt.strftime('%Y-%m-%d %H:%M')
     filtered_routes['price'] = filtered_routes['price'].apply(lambda x: f"{x:,.0f} ₸")
     filtered_routes['distance'] = filtered_routes['distance'].apply(lambda x: f"{x:,.0f} км")
     
@@ -0,0 +1,186 @@
+"""Архив фото чеков на диске.
+
+После сохранения расхода его чек ставится в очередь, и фоновые задачи
+скачивают файл из Telegram, не задерживая ответ водителю. Файлы
+хранятся по sha256 содержимого (receipts/ab/cd/abcd....jpg), поэтому
+одинаковые фото занимают место один раз, а фото, уже скачанное по
+file_unique_id, повторно не скачивается. Путь к файлу записывается в
+expenses.receipt_path.
+
+Миниатюры строятся в отдельных процессах, если установлен Pillow.
+Чеки, которые не удалось скачать или не поместились в очередь,
+остаются в базе без receipt_path и ставятся в очередь при следующем
+запуске.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from metrics import REGISTRY
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Сколько чеков может ждать скачивания
+RECEIPT_QUEUE_SIZE = 1000
+# Сколько чеков скачивается одновременно
+RECEIPT_WORKERS = 4
+# Процессов для построения миниатюр
+THUMBNAIL_PROCESSES = 1
+# Наибольшая сторона миниатюры в пикселях
+THUMBNAIL_SIZE = 320
+
+RECEIPTS = REGISTRY.counter(
+    'receipts_total',
+    'Чеки, поставленные в архив',
+    ['result']
+)
+RECEIPT_QUEUE = REGISTRY.gauge('receipt_queue_size', 'Чеков в очереди на скачивание')
+RECEIPT_SECONDS = REGISTRY.histogram(
+    'receipt_archive_seconds',
+    'Скачивание и сохранение одного чека'
+)
+
+
+def content_path(root, digest, suffix):
+    """Путь файла в архиве по sha256 содержимого"""
+    return Path(root, digest[:2], digest[2:4], digest + suffix)
+
+
+def _write_file(path, content):
+    """Записать файл, если его еще нет (через временный файл)"""
+    if path.exists():
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Одно и то же фото могут сохранять несколько задач сразу
+    temporary = path.with_name(f'{path.name}.{uuid.uuid4().hex}.tmp')
+    temporary.write_bytes(content)
+    os.replace(temporary, path)
+
+
+def make_thumbnail(source, destination, size):
+    """Построить миниатюру JPEG (выполняется в отдельном процессе)"""
+    destination = Path(destination)
+    if destination.exists():
+        return str(destination)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    temporary = destination.with_name(f'{destination.name}.{uuid.uuid4().hex}.tmp')
+    with Image.open(source) as image:
+        image.thumbnail((size, size))
+        image.convert('RGB').save(temporary, 'JPEG', quality=80)
+    os.replace(temporary, destination)
+    return str(destination)
+
+
+class ReceiptArchiver:
+    """Очередь и фоновые задачи архивации чеков.
+
+    start() и close() подключаются к запуску и остановке диспетчера.
+    submit() не ждет: если очередь заполнена, чек останется
+    неархивированным до следующего запуска.
+    """
+
+    def __init__(self, bot, db, root, queue_size=RECEIPT_QUEUE_SIZE, workers=RECEIPT_WORKERS,
+                 thumbnail_processes=THUMBNAIL_PROCESSES, thumbnail_size=THUMBNAIL_SIZE,
+                 backfill=True):
+        self.bot = bot
+        self.db = db
+        self.root = Path(root)
+        self.workers = workers
+        self.thumbnail_processes = thumbnail_processes
+        self.thumbnail_size = thumbnail_size
+        self.backfill = backfill
+        self._queue = asyncio.Queue(queue_size)
+        self._tasks = []
+        self._pool = None
+
+    def submit(self, expense_id, file_id, file_unique_id):
+        """Поставить чек расхода в очередь; False, если очередь заполнена"""
+        try:
+            self._queue.put_nowait((expense_id, file_id, file_unique_id))
+        except asyncio.QueueFull:
+            RECEIPTS.inc(result='dropped')
+            logger.warning("Очередь чеков заполнена, чек расхода %s отложен", expense_id)
+            return False
+        RECEIPT_QUEUE.set(self._queue.qsize())
+        return True
+
+    async def start(self):
+        if Image is not None and self.thumbnail_processes:
+            self._pool = ProcessPoolExecutor(self.thumbnail_processes)
+        elif Image is None:
+            logger.info("Pillow не установлен, миниатюры чеков не строятся")
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        if self.backfill:
+            # Чеки, не скачанные до остановки
+            for expense_id, file_id, file_unique_id in await self.db.get_pending_receipts(
+                    self._queue.maxsize):
+                if not self.submit(expense_id, file_id, file_unique_id):
+                    break
+
+    async def close(self):
+        """Остановить архивацию; незаконченные чеки останутся в очереди базы"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def join(self):
+        """Дождаться, пока очередь опустеет"""
+        await self._queue.join()
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            RECEIPT_QUEUE.set(self._queue.qsize())
+            started = time.perf_counter()
+            try:
+                RECEIPTS.inc(result=await self.archive(*job))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                RECEIPTS.inc(result='failed')
+                logger.exception("Не удалось сохранить чек расхода %s", job[0])
+            finally:
+                RECEIPT_SECONDS.observe(time.perf_counter() - started)
+                self._queue.task_done()
+
+    async def archive(self, expense_id, file_id, file_unique_id):
+        """Сохранить чек расхода в архив; возвращает результат для метрик"""
+        stored = await self.db.get_receipt_file(file_unique_id)
+        if stored is not None:
+            await self.db.set_expense_receipt_path(expense_id, stored[0])
+            return 'deduplicated'
+
+        file = await self.bot.get_file(file_id)
+        content = (await self.bot.download_file(file.file_path)).getvalue()
+        digest = hashlib.sha256(content).hexdigest()
+        path = content_path(self.root, digest, Path(file.file_path or '').suffix or '.jpg')
+        await asyncio.to_thread(_write_file, path, content)
+
+        thumbnail_path = None
+        if self._pool is not None:
+            try:
+                thumbnail_path = await asyncio.get_running_loop().run_in_executor(
+                    self._pool, make_thumbnail, str(path),
+                    str(content_path(self.root / 'thumbnails', digest, '.jpg')),
+                    self.thumbnail_size
+                )
+            except Exception:
+                logger.exception("Не удалось построить миниатюру чека %s", path)
+
+        await self.db.add_receipt_file(file_unique_id, digest, str(path), thumbnail_path, len(content))
+        await self.db.set_expense_receipt_path(expense_id, str(path))
+        return 'archived'
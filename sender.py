@@ -0,0 +1,287 @@
+"""Исходящие сообщения бота: ограничение скорости и уведомления.
+
+SendLimiter — middleware сессии aiogram: каждый запрос к Bot API,
+адресованный чату, ждет разрешения от общего ограничителя (Telegram
+допускает около 30 сообщений в секунду на бота и около одного в
+секунду в один чат, с короткими всплесками). Ответы водителям в
+обработчиках проходят раньше массовых рассылок: рассылка выполняется
+внутри bulk_sends(). Если Telegram все же ответил RetryAfter, отправка
+во все чаты приостанавливается на указанное время (ограничение может
+быть общим на бота) и запрос повторяется.
+
+NotificationSender отправляет уведомления из таблицы notifications,
+куда их пишут страницы веб-интерфейса. Уведомление доставляется хотя
+бы один раз: если бот остановится между отправкой и отметкой в базе,
+оно будет отправлено повторно.
+"""
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import logging
+import time
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Сообщений в секунду на весь бот
+SEND_RATE = 30
+# Сообщений в секунду в один чат и сколько можно отправить подряд
+CHAT_RATE = 1
+CHAT_BURST = 3
+# Сколько раз повторять запрос после RetryAfter
+SEND_RETRIES = 3
+
+# Приоритеты отправки: меньше — раньше
+INTERACTIVE = 0
+BULK = 1
+_PRIORITY_NAMES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+_send_priority = contextvars.ContextVar('send_priority', default=INTERACTIVE)
+
+# Как часто (в секундах) проверять новые уведомления
+NOTIFICATIONS_POLL_INTERVAL = 2.0
+# Сколько уведомлений отправлять за один проход
+NOTIFICATIONS_BATCH_SIZE = 50
+# После скольких неудачных попыток уведомление больше не отправляется
+NOTIFICATION_ATTEMPTS = 5
+
+SEND_WAIT_SECONDS = REGISTRY.histogram(
+    'bot_send_wait_seconds',
+    'Ожидание разрешения на отправку запроса в чат',
+    ['priority']
+)
+SEND_WAITING = REGISTRY.gauge('bot_send_waiting', 'Запросов ждут разрешения на отправку')
+SEND_RETRIES_TOTAL = REGISTRY.counter(
+    'bot_send_retries_total',
+    'Повторы запросов после RetryAfter'
+)
+NOTIFICATIONS = REGISTRY.counter(
+    'notifications_total',
+    'Уведомления из таблицы notifications',
+    ['result']
+)
+
+
+@contextlib.contextmanager
+def bulk_sends():
+    """Отправлять сообщения внутри блока с низким приоритетом"""
+    token = _send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        _send_priority.reset(token)
+
+
+class _Bucket:
+    """Ведро токенов: rate в секунду, не больше burst подряд"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+
+    def _refill(self, now):
+        if now > self.updated_at:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def delay(self, now):
+        """Через сколько секунд будет токен (0 — есть сейчас)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return max(self.updated_at - now, 0) + (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, until):
+        """Не выдавать токены до момента until"""
+        self.tokens = 0
+        self.updated_at = max(self.updated_at, until)
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class SendLimiter(BaseRequestMiddleware):
+    """Ограничение скорости запросов к чатам с приоритетом ответов.
+
+    Ожидающие запросы получают разрешения по одному из фоновой задачи:
+    первым — запрос с наименьшим приоритетом среди тех, чей чат может
+    принять сообщение, при равном приоритете — пришедший раньше.
+    Запросы без chat_id (answerCallbackQuery, getFile) не ограничиваются.
+    """
+
+    def __init__(self, rate=SEND_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 retries=SEND_RETRIES):
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.retries = retries
+        self._global = _Bucket(rate, max(1, rate), time.monotonic())
+        self._chats = {}
+        # (приоритет, номер, chat_id, Future)
+        self._waiters = []
+        self._order = itertools.count()
+        self._wakeup = None
+        self._task = None
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        for attempt in itertools.count():
+            await self.acquire(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as error:
+                if attempt >= self.retries:
+                    raise
+                SEND_RETRIES_TOTAL.inc()
+                logger.warning("Telegram просит подождать %s с перед отправкой в чат %s",
+                               error.retry_after, chat_id)
+                self.pause(chat_id, error.retry_after)
+
+    async def acquire(self, chat_id):
+        """Дождаться разрешения отправить сообщение в чат"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._grant())
+        priority = _send_priority.get()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((priority, next(self._order), chat_id, future))
+        SEND_WAITING.set(len(self._waiters))
+        self._wakeup.set()
+        started = time.perf_counter()
+        await future
+        SEND_WAIT_SECONDS.observe(time.perf_counter() - started, priority=_PRIORITY_NAMES[priority])
+
+    def pause(self, chat_id, seconds):
+        """Не отправлять seconds секунд ни в чат, ни в другие чаты.
+
+        По RetryAfter не видно, исчерпан лимит чата или всего бота,
+        поэтому ждут все; чат после паузы начинает с пустого ведра.
+        """
+        now = time.monotonic()
+        self._chat(chat_id, now).pause(now + seconds)
+        self._global.pause(now + seconds)
+
+    def _chat(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= 10_000:
+                # Чаты с полным ведром ничем не отличаются от новых
+                self._chats = {
+                    key: value for key, value in self._chats.items() if not value.full(now)
+                }
+            bucket = self._chats[chat_id] = _Bucket(self.chat_rate, self.chat_burst, now)
+        return bucket
+
+    async def _grant(self):
+        """Выдавать разрешения ожидающим запросам"""
+        while True:
+            self._waiters = [waiter for waiter in self._waiters if not waiter[3].done()]
+            SEND_WAITING.set(len(self._waiters))
+            if not self._waiters:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            delay = self._global.delay(now)
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+
+            chosen = None
+            delay = None
+            for waiter in self._waiters:
+                chat_delay = self._chat(waiter[2], now).delay(now)
+                if chat_delay:
+                    delay = chat_delay if delay is None else min(delay, chat_delay)
+                elif chosen is None or waiter[:2] < chosen[:2]:
+                    chosen = waiter
+            if chosen is None:
+                # Все чаты заняты: ждем первый освободившийся или новый запрос
+                self._wakeup.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                continue
+
+            self._waiters.remove(chosen)
+            self._global.take(now)
+            self._chat(chosen[2], now).take(now)
+            chosen[3].set_result(None)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+
+class NotificationSender:
+    """Отправка уведомлений из таблицы notifications с низким приоритетом"""
+
+    def __init__(self, bot, db, poll_interval=NOTIFICATIONS_POLL_INTERVAL,
+                 batch_size=NOTIFICATIONS_BATCH_SIZE, max_attempts=NOTIFICATION_ATTEMPTS):
+        self.bot = bot
+        self.db = db
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self):
+        with bulk_sends():
+            while True:
+                try:
+                    sent = await self.send_pending()
+                except Exception:
+                    logger.exception("Не удалось отправить уведомления")
+                    sent = 0
+                if sent < self.batch_size:
+                    await asyncio.sleep(self.poll_interval)
+
+    async def send_pending(self):
+        """Отправить очередную пачку уведомлений; возвращает ее размер"""
+        notifications = await self.db.get_pending_notifications(self.batch_size)
+        await asyncio.gather(*(self._send(*notification) for notification in notifications))
+        return len(notifications)
+
+    async def _send(self, notification_id, chat_id, text, attempts):
+        try:
+            await self.bot.send_message(chat_id, text)
+        except (TelegramForbiddenError, TelegramBadRequest) as error:
+            # Водитель заблокировал бота или чата нет: повтор не поможет
+            NOTIFICATIONS.inc(result='failed')
+            await self.db.mark_notification_failed(notification_id, str(error), True)
+        except Exception as error:
+            final = attempts + 1 >= self.max_attempts
+            NOTIFICATIONS.inc(result='failed' if final else 'retry')
+            logger.warning("Уведомление %s не отправлено: %s", notification_id, error)
+            await self.db.mark_notification_failed(notification_id, str(error), final)
+        else:
+            NOTIFICATIONS.inc(result='sent')
+            await self.db.mark_notification_sent(notification_id)
@@ -0,0 +1,219 @@
+"""Хранилище состояний FSM бота в базе данных.
+
+Состояние и данные каждого ключа FSM хранятся в таблице fsm_states,
+поэтому незаконченная регистрация или расход переживают перезапуск
+бота. Недавно использованные ключи держатся в памяти (LRU), изменения
+копятся и записываются в базу пакетом раз в flush_interval секунд.
+Ключи, не изменявшиеся дольше ttl секунд, удаляются в фоне.
+
+Кэш рассчитан на то, что все обновления одного пользователя
+обрабатывает один процесс (см. workers.py).
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+from database import get_connection_manager, now_ms
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Сколько ключей держать в памяти
+FSM_CACHE_SIZE = 10_000
+# Как часто (в секундах) записывать изменения в базу
+FSM_FLUSH_INTERVAL = 1.0
+# Через сколько секунд без изменений состояние считается брошенным
+FSM_STATE_TTL = 7 * 24 * 3600
+# Как часто (в секундах) удалять брошенные состояния
+FSM_GC_INTERVAL = 600
+
+CACHE_REQUESTS = REGISTRY.counter(
+    'fsm_cache_requests_total',
+    'Обращения к кэшу состояний FSM',
+    ['result']
+)
+CACHE_SIZE = REGISTRY.gauge('fsm_cache_size', 'Ключей FSM в памяти')
+FLUSH_SECONDS = REGISTRY.histogram('fsm_flush_seconds', 'Запись изменений FSM в базу')
+EXPIRED_STATES = REGISTRY.counter('fsm_expired_total', 'Удалено брошенных состояний FSM')
+
+_UPSERT = '''
+    INSERT INTO fsm_states (key, state, data, updated_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (key) DO UPDATE SET
+        state = excluded.state,
+        data = excluded.data,
+        updated_at = excluded.updated_at
+'''
+_EMPTY_DATA = '{}'
+
+
+class _Entry:
+    __slots__ = ('state', 'data', 'payload', 'updated_at')
+
+    def __init__(self, state, payload, updated_at):
+        self.state = state
+        self.payload = payload
+        self.data = json.loads(payload)
+        self.updated_at = updated_at
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в таблице fsm_states с кэшем отложенной записи"""
+
+    def __init__(self, db_file, cache_size=FSM_CACHE_SIZE, flush_interval=FSM_FLUSH_INTERVAL,
+                 ttl=FSM_STATE_TTL, gc_interval=FSM_GC_INTERVAL, key_builder=None):
+        self._manager = get_connection_manager(db_file)
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.gc_interval = gc_interval
+        self._key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = OrderedDict()
+        # Незаписанные изменения: ключ -> (state, data в JSON, updated_at)
+        self._dirty = {}
+        # Изменения, которые записываются прямо сейчас
+        self._flushing = {}
+        self._flush_lock = asyncio.Lock()
+        self._tasks = None
+
+    async def set_state(self, key, state=None):
+        key = self._key_builder.build(key)
+        entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._touch(key, entry)
+
+    async def get_state(self, key):
+        return (await self._entry(self._key_builder.build(key))).state
+
+    async def set_data(self, key, data):
+        key = self._key_builder.build(key)
+        entry = await self._entry(key)
+        # Сериализуем сразу, чтобы ошибка возникла в обработчике, а не при записи
+        entry.payload = json.dumps(data, ensure_ascii=False)
+        entry.data = dict(data)
+        self._touch(key, entry)
+
+    async def get_data(self, key):
+        return dict((await self._entry(self._key_builder.build(key))).data)
+
+    async def close(self):
+        """Остановить фоновые задачи и записать все изменения"""
+        if self._tasks:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = None
+        await self.flush()
+
+    async def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            self._flushing, self._dirty = self._dirty, {}
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._write, list(self._flushing.items()))
+            except Exception:
+                logger.exception("Не удалось записать состояния FSM")
+                # Повторим при следующей записи, если ключ не изменился снова
+                for key, snapshot in self._flushing.items():
+                    self._dirty.setdefault(key, snapshot)
+            finally:
+                self._flushing = {}
+                FLUSH_SECONDS.observe(time.perf_counter() - started)
+
+    async def collect_garbage(self):
+        """Удалить состояния, не изменявшиеся дольше ttl"""
+        cutoff = now_ms() - int(self.ttl * 1000)
+        removed = await asyncio.to_thread(self._delete_expired, cutoff)
+        EXPIRED_STATES.inc(removed)
+        for key in [key for key, entry in self._cache.items()
+                    if entry.updated_at < cutoff and key not in self._dirty]:
+            del self._cache[key]
+        CACHE_SIZE.set(len(self._cache))
+        return removed
+
+    async def _entry(self, key):
+        """Запись ключа из кэша; при промахе читается из базы"""
+        self._ensure_started()
+        entry = self._cache.get(key)
+        if entry is not None:
+            CACHE_REQUESTS.inc(result='hit')
+            self._cache.move_to_end(key)
+            return entry
+
+        CACHE_REQUESTS.inc(result='miss')
+        snapshot = self._dirty.get(key) or self._flushing.get(key)
+        if snapshot is None:
+            snapshot = await asyncio.to_thread(self._read, key)
+            # Пока шло чтение, ключ мог загрузить другой обработчик
+            entry = self._cache.get(key)
+            if entry is not None:
+                return entry
+        entry = _Entry(*snapshot)
+        self._cache[key] = entry
+        if len(self._cache) > self.cache_size:
+            # Незаписанные изменения вытесненного ключа остаются в _dirty
+            self._cache.popitem(last=False)
+        CACHE_SIZE.set(len(self._cache))
+        return entry
+
+    def _touch(self, key, entry):
+        """Пометить ключ измененным"""
+        entry.updated_at = now_ms()
+        self._dirty[key] = (entry.state, entry.payload, entry.updated_at)
+
+    def _ensure_started(self):
+        """Запустить фоновые задачи при первом обращении из цикла событий"""
+        if self._tasks is None:
+            self._tasks = [
+                asyncio.create_task(self._flush_loop()),
+                asyncio.create_task(self._gc_loop()),
+            ]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def _gc_loop(self):
+        while True:
+            try:
+                await self.collect_garbage()
+            except Exception:
+                logger.exception("Не удалось удалить устаревшие состояния FSM")
+            await asyncio.sleep(self.gc_interval)
+
+    def _read(self, key):
+        with self._manager.reader() as connection:
+            row = connection.execute(
+                "SELECT state, data, updated_at FROM fsm_states WHERE key = ?",
+                (key,)
+            ).fetchone()
+        return row or (None, _EMPTY_DATA, 0)
+
+    def _write(self, items):
+        upserts = []
+        deletes = []
+        for key, (state, payload, updated_at) in items:
+            # Пустое состояние не храним
+            if state is None and payload == _EMPTY_DATA:
+                deletes.append((key,))
+            else:
+                upserts.append((key, state, payload, updated_at))
+        with self._manager.writer() as connection:
+            connection.executemany(_UPSERT, upserts)
+            connection.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+
+    def _delete_expired(self, cutoff):
+        with self._manager.writer() as connection:
+            return connection.execute(
+                "DELETE FROM fsm_states WHERE updated_at < ?",
+                (cutoff,)
+            ).rowcount
@@ -0,0 +1,26 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from database import Database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Database на пустой базе во временном каталоге"""
+    database = Database(str(tmp_path / 'test.db'))
+    yield database
+    database.close()
+
+
+def add_route(db, name='Алматы - Астана', price=150000):
+    """Добавить маршрут (как страница управления маршрутами) и вернуть id"""
+    with db._manager.writer() as connection:
+        return connection.execute('''
+            INSERT INTO routes (route_name, start_point, end_point, distance, price, cargo_type)
+            VALUES (?, 'Алматы', 'Астана', 1200, ?, 'Общий')
+        ''', (name, price)).lastrowid
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from aiogram import Router
+from aiogram.types import CallbackQuery, User
+
+from callbacks import (
+    CallbackRouter, EXPENSE_DETAILS, EXPENSES_PAGE, MAX_CALLBACK_DATA_BYTES,
+    decode_int, encode_int, pack, unpack
+)
+
+
+@pytest.mark.parametrize('value', [0, 1, 35, 36, 123456, -42, 1_700_000_000_000, 2 ** 63 - 1])
+def test_int_round_trip(value):
+    """Число переживает запись в base36 и чтение"""
+    assert decode_int(encode_int(value)) == value
+
+
+def test_pack_and_unpack():
+    """Префикс и аргументы разбираются в том виде, в каком упакованы"""
+    data = pack(EXPENSES_PAGE, 'older', 1_700_000_000_000, 123456)
+    assert data == 'ep:older:loyw3v28:2n9c'
+    prefix, parts = unpack(data)
+    assert prefix == EXPENSES_PAGE
+    assert parts[0] == 'older'
+    assert [decode_int(part) for part in parts[1:]] == [1_700_000_000_000, 123456]
+    assert unpack(pack(EXPENSE_DETAILS)) == (EXPENSE_DETAILS, [])
+    assert unpack('') == (None, [])
+    assert unpack(None) == (None, [])
+
+
+def test_pack_rejects_invalid_data():
+    """Разделитель в строке и слишком длинные данные не упаковываются"""
+    with pytest.raises(ValueError):
+        pack(EXPENSES_PAGE, 'old:er', 1, 2)
+    with pytest.raises(ValueError):
+        pack(EXPENSE_DETAILS, 'x' * MAX_CALLBACK_DATA_BYTES)
+
+
+def test_resolve():
+    """Действие находится по префиксу, аргументы приводятся к типам"""
+    router = CallbackRouter()
+
+    @router.action(EXPENSES_PAGE, str, int, int)
+    async def show_page(callback, args):
+        return args
+
+    handler, args = router.resolve(pack(EXPENSES_PAGE, 'newer', 1000, 5))
+    assert handler.callback is show_page
+    assert args == ['newer', 1000, 5]
+
+    # Неизвестный префикс, другое число аргументов, не base36
+    assert router.resolve(pack(EXPENSE_DETAILS, 5)) is None
+    assert router.resolve(pack(EXPENSES_PAGE, 'newer', 1000)) is None
+    assert router.resolve('ep:newer:1000:5!') is None
+    assert router.resolve(None) is None
+
+    with pytest.raises(ValueError):
+        router.action(EXPENSES_PAGE, int)(show_page)
+
+
+def test_unknown_data_falls_through_to_fallback():
+    """Неизвестные и старые кнопки доходят до обработчика по умолчанию"""
+    router = Router()
+    callbacks = CallbackRouter()
+
+    @callbacks.action(EXPENSE_DETAILS, int)
+    async def show_expense(callback, args):
+        return 'expense', args
+
+    callbacks.register(router.callback_query)
+
+    @router.callback_query()
+    async def unknown_callback(callback):
+        return 'unknown'
+
+    async def press(data):
+        callback = CallbackQuery(
+            id='1', chat_instance='chat', data=data,
+            from_user=User(id=7, is_bot=False, first_name='Иван')
+        )
+        return await router.propagate_event('callback_query', callback)
+
+    async def scenario():
+        return [await press(data) for data in (
+            pack(EXPENSE_DETAILS, 123456),
+            # Формат кнопок до CallbackRouter
+            'expense_123456',
+            'route_details_5',
+            pack(EXPENSE_DETAILS, 'abc!'),
+            None,
+        )]
+
+    assert asyncio.run(scenario()) == [('expense', [123456])] + ['unknown'] * 4
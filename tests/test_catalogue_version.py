@@ -0,0 +1,40 @@
+from conftest import add_route
+
+
+def test_version_read_during_change_is_not_kept(db):
+    """Версия, прочитанная до изменения каталога, не переживает его сброс"""
+    add_route(db)
+    old_version = db.get_catalogue_version()
+    assert [route[0] for route in db.get_available_routes()] == [1]
+    execute_query = db._execute_query
+
+    def read_then_change(query, *args, **kwargs):
+        # Чтение версии видит данные до изменения, а фиксация
+        # изменения приходит, пока чтение еще не вернулось
+        result = execute_query(query, *args, **kwargs)
+        if 'cache_versions' in query:
+            add_route(db, 'Шымкент - Тараз')
+            db._invalidate_catalogue()
+        return result
+
+    db._catalogue_version = None
+    db._execute_query = read_then_change
+    assert db.get_catalogue_version() == old_version
+    db._execute_query = execute_query
+
+    assert db.get_catalogue_version() > old_version
+    assert [route[0] for route in db.get_available_routes()] == [1, 2]
+
+
+def test_version_never_goes_back(db):
+    """Запоздавшее чтение старой версии не откатывает запомненную"""
+    add_route(db)
+    version = db.get_catalogue_version()
+    db._catalogue_checked_at = 0.0
+    execute_query = db._execute_query
+    db._execute_query = lambda query, *args, **kwargs: (version - 1,)
+    try:
+        assert db.get_catalogue_version() == version
+    finally:
+        db._execute_query = execute_query
+    assert db._catalogue_version == version
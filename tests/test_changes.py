@@ -0,0 +1,49 @@
+from database import last_change_seq, read_changes
+
+
+def add_drivers(db, telegram_ids):
+    with db._manager.writer() as connection:
+        connection.executemany(
+            "INSERT INTO drivers (telegram_id, full_name, phone) VALUES (?, 'Водитель', '+7')",
+            [(telegram_id,) for telegram_id in telegram_ids]
+        )
+
+
+def test_changes_are_read_page_by_page(db):
+    """Изменения больше одной страницы читаются целиком, без перезагрузки"""
+    add_drivers(db, range(1, 11))
+    with db._manager.writer() as connection:
+        connection.execute("UPDATE drivers SET phone = '+77' WHERE telegram_id = 10")
+        connection.execute("DELETE FROM drivers WHERE telegram_id = 1")
+
+    with db._manager.reader() as connection:
+        seq, changes = read_changes(connection, 0, limit=3)
+        assert seq == last_change_seq(connection) == 12
+        assert read_changes(connection, seq, limit=3) == (seq, {})
+        # Страница заканчивается ровно на последнем изменении
+        assert read_changes(connection, 9, limit=3) == (12, {'drivers': {10: 'update', 1: 'delete'}})
+
+    assert list(changes) == ['drivers']
+    assert sorted(changes['drivers']) == list(range(1, 11))
+    assert changes['drivers'][1] == 'delete'
+    assert changes['drivers'][10] == 'update'
+    assert changes['drivers'][5] == 'insert'
+
+
+def test_reset_or_pruned_changes_require_reload(db):
+    """Сброс на любой странице или очищенный журнал требуют перезагрузки"""
+    add_drivers(db, range(1, 8))
+    with db._manager.writer() as connection:
+        connection.execute('''
+            INSERT INTO changes (entity, entity_id, op, changed_at)
+            VALUES ('*', 0, 'reset', 0)
+        ''')
+    add_drivers(db, [8])
+
+    with db._manager.reader() as connection:
+        assert read_changes(connection, 0, limit=3) == (0, None)
+        assert read_changes(connection, 8, limit=3) == (9, {'drivers': {8: 'insert'}})
+
+    db.prune_changes(2 ** 62)
+    with db._manager.reader() as connection:
+        assert read_changes(connection, 5, limit=3) == (5, None)
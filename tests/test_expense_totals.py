@@ -0,0 +1,76 @@
+from conftest import add_route
+
+
+def test_expense_is_linked_to_route_execution(db):
+    """Расход в пути попадает в итоги выполнения маршрута, а не маршрута"""
+    db.add_driver(7, 'Иван Иванов', '+77001234567')
+    # Первый маршрут не выполнялся, поэтому id выполнения и маршрута различаются
+    add_route(db, 'Шымкент - Тараз')
+    route_id = add_route(db)
+    execution_id = db.start_route(7, route_id)
+    assert execution_id != route_id
+
+    active_route = db.get_active_route(7)
+    assert active_route[0] == route_id
+    assert active_route[5] == execution_id
+    db.add_expense(7, 'fuel', 100.0, 'photo', 'Заправка', route_execution_id=active_route[5])
+
+    assert db.get_expense_totals_by_route_execution(7) == [
+        (execution_id, 'Алматы - Астана', 1, 100.0)
+    ]
+
+
+def test_migration_links_old_expenses_to_route_execution(db):
+    """Расходы, где бот сохранил id маршрута, переносятся на выполнение"""
+    from migrations import migrate
+
+    db.add_driver(7, 'Иван Иванов', '+77001234567')
+    add_route(db, 'Шымкент - Тараз')
+    route_id = add_route(db)
+    execution_id = db.start_route(7, route_id)
+    with db._manager.writer() as connection:
+        connection.execute('''
+            INSERT INTO expenses (driver_id, expense_type, amount, route_execution_id, created_at)
+            SELECT 7, 'fuel', 100.0, ?, start_time + 1000 FROM route_executions WHERE id = ?
+        ''', (route_id, execution_id))
+        connection.execute('PRAGMA user_version = 13')
+    with db._manager.writer() as connection:
+        migrate(connection)
+
+    assert db.get_expense_totals_by_route_execution(7) == [
+        (execution_id, 'Алматы - Астана', 1, 100.0)
+    ]
+
+
+def test_migration_ignores_earlier_execution_with_same_id(db):
+    """id маршрута, совпавший с id прошлого выполнения, все равно исправляется"""
+    from migrations import migrate
+
+    db.add_driver(7, 'Иван Иванов', '+77001234567')
+    routes = [add_route(db, name) for name in ('R1', 'R2', 'R3')]
+    with db._manager.writer() as connection:
+        connection.executemany('''
+            INSERT INTO route_executions (id, route_id, driver_id, start_time, end_time, status)
+            VALUES (?, ?, 7, ?, ?, ?)
+        ''', [
+            (1, routes[0], 1000, 2000, 'completed'),
+            (2, routes[2], 3000, 4000, 'completed'),
+            (3, routes[1], 5000, None, 'in_progress'),
+        ])
+        connection.executemany('''
+            INSERT INTO expenses (driver_id, expense_type, amount, route_execution_id, created_at)
+            VALUES (7, 'fuel', ?, ?, ?)
+        ''', [
+            # Старый бот: id маршрута R2 вместо выполнения 3
+            (100.0, routes[1], 6000),
+            # Верная привязка к завершенному выполнению
+            (10.0, 2, 3500),
+        ])
+        connection.execute('PRAGMA user_version = 13')
+    with db._manager.writer() as connection:
+        migrate(connection)
+
+    assert db.get_expense_totals_by_route_execution(7) == [
+        (3, 'R2', 1, 100.0),
+        (2, 'R3', 1, 10.0),
+    ]
@@ -0,0 +1,73 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import generate_test_data
+from database import last_change_seq, read_changes
+
+
+def trigger_names(db_file):
+    with closing(sqlite3.connect(db_file)) as connection:
+        return {name for (name,) in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger'"
+        )}
+
+
+def test_interrupted_load_restores_triggers(tmp_path, monkeypatch):
+    """Прерванная загрузка возвращает триггеры итогов и журнала изменений"""
+    db_file = str(tmp_path / 'test.db')
+    generate_test_data.generate(db_file, drivers=2, routes=3, executions_per_driver=2,
+                                expenses_per_driver=5, log=lambda *args: None)
+    expected = trigger_names(db_file)
+    with closing(sqlite3.connect(db_file)) as connection:
+        seq = last_change_seq(connection)
+
+    insert_batches = generate_test_data.insert_batches
+
+    def interrupted(conn, query, rows, batch_size=generate_test_data.BATCH_SIZE):
+        if 'INTO route_executions' in query:
+            raise KeyboardInterrupt
+        return insert_batches(conn, query, rows, batch_size)
+
+    monkeypatch.setattr(generate_test_data, 'insert_batches', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        generate_test_data.generate(db_file, drivers=2, append=True, log=lambda *args: None)
+
+    assert {name for name in expected if name.startswith(('trg_expense_totals_', 'trg_changes_'))}
+    assert trigger_names(db_file) == expected
+    with closing(sqlite3.connect(db_file)) as connection:
+        # Строки, загруженные без журнала, читатели должны перечитать целиком
+        assert read_changes(connection, seq) == (seq, None)
+        connection.execute('''
+            INSERT INTO expenses (driver_id, expense_type, amount, created_at)
+            VALUES (1, 'fuel', 100.0, 0)
+        ''')
+        total = connection.execute(
+            "SELECT total FROM expense_totals WHERE driver_id = 1 AND kind = 'type'"
+        ).fetchone()
+        assert total == (100.0,)
+        assert read_changes(connection, last_change_seq(connection) - 1)[1] == {
+            'expenses': {connection.execute('SELECT MAX(id) FROM expenses').fetchone()[0]: 'insert'}
+        }
+
+
+def test_migrate_restores_triggers_after_killed_load(tmp_path):
+    """Если загрузку убили до восстановления, триггеры вернет migrate()"""
+    from migrations import migrate
+
+    db_file = str(tmp_path / 'test.db')
+    with closing(sqlite3.connect(db_file)) as connection:
+        migrate(connection)
+    expected = trigger_names(db_file)
+    with closing(sqlite3.connect(db_file)) as connection:
+        generate_test_data.drop_triggers(connection, 'trg_expense_totals_')
+        generate_test_data.drop_triggers(connection, 'trg_changes_')
+        generate_test_data.drop_indexes(connection, ('route_executions',))
+        seq = last_change_seq(connection)
+        migrate(connection)
+        assert read_changes(connection, seq) == (seq, None)
+        assert connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'idx_route_executions_active'"
+        ).fetchone()
+    assert trigger_names(db_file) == expected
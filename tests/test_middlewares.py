@@ -0,0 +1,147 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.types import CallbackQuery, User
+
+from middlewares import DuplicateUpdateMiddleware, ThrottlingMiddleware
+
+USER = User(id=7, is_bot=False, first_name='Иван')
+
+
+class RecordingCallback(CallbackQuery):
+    """Нажатие кнопки, запоминающее ответы бота"""
+
+    async def answer(self, *args, **kwargs):
+        self.model_extra.setdefault('answers', []).append(args)
+
+
+def message(text, user=USER):
+    return SimpleNamespace(from_user=user, text=text)
+
+
+def callback(data):
+    return RecordingCallback(id='1', from_user=USER, chat_instance='chat', data=data)
+
+
+class SlowHandler:
+    """Обработчик, который ждет release и возвращает номер вызова"""
+
+    def __init__(self, error=None):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.error = error
+
+    async def __call__(self, event, data):
+        self.calls += 1
+        await self.release.wait()
+        if self.error:
+            raise self.error
+        return self.calls
+
+
+def test_duplicate_message_shares_first_result():
+    """Повтор сообщения ждет первое и получает его результат"""
+    async def scenario():
+        throttling = ThrottlingMiddleware(window=60)
+        handler = SlowHandler()
+        first = asyncio.create_task(throttling(handler, message('🚛 Маршруты'), {}))
+        second = asyncio.create_task(throttling(handler, message('🚛 Маршруты'), {}))
+        await asyncio.sleep(0.01)
+        assert not second.done()
+        handler.release.set()
+        # Пришел уже после первого, но в пределах окна
+        third = await throttling(handler, message('🚛 Маршруты'), {})
+        return await first, await second, third, handler.calls
+
+    assert asyncio.run(scenario()) == (1, 1, 1, 1)
+
+
+def test_requests_after_window_and_other_requests_pass():
+    """После окна, другой запрос, другой водитель и ввод в FSM не гасятся"""
+    async def scenario():
+        throttling = ThrottlingMiddleware(window=0.05)
+        handler = SlowHandler()
+        handler.release.set()
+        results = [
+            await throttling(handler, message('💰 Расходы'), {}),
+            await throttling(handler, message('🚛 Маршруты'), {}),
+            await throttling(handler, message('💰 Расходы', User(id=8, is_bot=False, first_name='Петр')), {}),
+            await throttling(handler, message('15000'), {'raw_state': 'Expense:amount'}),
+            await throttling(handler, message('15000'), {'raw_state': 'Expense:amount'}),
+        ]
+        await asyncio.sleep(0.1)
+        results.append(await throttling(handler, message('💰 Расходы'), {}))
+        return results
+
+    assert asyncio.run(scenario()) == [1, 2, 3, 4, 5, 6]
+
+
+def test_duplicate_callback_is_answered():
+    """На повторное нажатие кнопки бот сразу отвечает"""
+    async def scenario():
+        throttling = ThrottlingMiddleware(window=60)
+        handler = SlowHandler()
+        first = asyncio.create_task(throttling(handler, callback('rs:1'), {}))
+        await asyncio.sleep(0)
+        duplicate = callback('rs:1')
+        second = asyncio.create_task(throttling(handler, duplicate, {}))
+        await asyncio.sleep(0.01)
+        answered = duplicate.model_extra.get('answers')
+        handler.release.set()
+        return answered, await first, await second, handler.calls
+
+    assert asyncio.run(scenario()) == ([()], 1, 1, 1)
+
+
+def test_failed_request_fails_only_once():
+    """Исключение получает только первый запрос, повтор получает None"""
+    async def scenario():
+        throttling = ThrottlingMiddleware(window=60)
+        handler = SlowHandler(error=RuntimeError('база недоступна'))
+        first = asyncio.create_task(throttling(handler, message('🚛 Маршруты'), {}))
+        second = asyncio.create_task(throttling(handler, message('🚛 Маршруты'), {}))
+        await asyncio.sleep(0.01)
+        handler.release.set()
+        with pytest.raises(RuntimeError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_cancelled_duplicate_does_not_cancel_first():
+    """Отмена повтора не отменяет первый запрос"""
+    async def scenario():
+        throttling = ThrottlingMiddleware(window=60)
+        handler = SlowHandler()
+        first = asyncio.create_task(throttling(handler, message('🚛 Маршруты'), {}))
+        second = asyncio.create_task(throttling(handler, message('🚛 Маршруты'), {}))
+        await asyncio.sleep(0.01)
+        second.cancel()
+        await asyncio.sleep(0)
+        handler.release.set()
+        return await first
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_duplicate_update_is_dropped():
+    """Обновление с уже виденным update_id не обрабатывается"""
+    async def scenario():
+        middleware = DuplicateUpdateMiddleware(limit=2)
+        handled = []
+
+        async def handler(event, data):
+            handled.append(event.update_id)
+            return 'ok'
+
+        results = []
+        for update_id in (1, 2, 1, 3, 1):
+            results.append(await middleware(handler, SimpleNamespace(update_id=update_id), {}))
+        return results, handled
+
+    results, handled = asyncio.run(scenario())
+    # Помнит последние два update_id, поэтому 1 после 2 и 3 снова обрабатывается
+    assert results == ['ok', 'ok', None, 'ok', 'ok']
+    assert handled == [1, 2, 3, 1]
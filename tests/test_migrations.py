@@ -0,0 +1,75 @@
+import logging
+import shutil
+import sqlite3
+
+from conftest import ROOT
+from migrations import MIGRATIONS, migrate, rebuild_expense_totals, restore_schema_objects
+
+
+def upgrade_to(connection, version):
+    """Применить миграции до версии version включительно"""
+    for target, step in MIGRATIONS:
+        if target <= version:
+            step(connection)
+            connection.execute(f'PRAGMA user_version = {target}')
+    connection.commit()
+
+
+def expense_totals(connection):
+    return connection.execute(
+        'SELECT driver_id, kind, key, count, total FROM expense_totals WHERE count != 0 ORDER BY 1, 2, 3'
+    ).fetchall()
+
+
+def test_expense_without_created_at_gets_epoch_ms(db):
+    """Расход без created_at получает время в миллисекундах, а не текст"""
+    with db._manager.writer() as connection:
+        connection.execute("INSERT INTO expenses (driver_id, expense_type, amount) VALUES (7, 'fuel', 1.0)")
+    with db._manager.reader() as connection:
+        created_at, = connection.execute('SELECT created_at FROM expenses').fetchone()
+    assert isinstance(created_at, int)
+    assert abs(created_at - db.get_driver_expenses_page(7)['items'][0]['timestamp']) == 0
+
+
+def test_migration_converts_text_created_at(tmp_path, caplog):
+    """Миграция переводит текстовое время в миллисекунды, сообщает о
+    неразобранных значениях и сохраняет индексы, триггеры и AUTOINCREMENT"""
+    # В базе из репозитория таблица expenses создана со старым значением по умолчанию
+    shutil.copy(ROOT / 'transport_expenses.db', tmp_path / 'old.db')
+    connection = sqlite3.connect(str(tmp_path / 'old.db'))
+    try:
+        upgrade_to(connection, 14)
+        connection.execute('DELETE FROM expenses')
+        connection.execute("DELETE FROM sqlite_sequence WHERE name = 'expenses'")
+        connection.executemany(
+            "INSERT INTO expenses (driver_id, expense_type, amount) VALUES (7, ?, 10.0)",
+            [('fuel',), ('food',), ('repair',)]
+        )
+        connection.execute("UPDATE expenses SET created_at = 'вчера' WHERE expense_type = 'food'")
+        connection.execute("DELETE FROM expenses WHERE id = 3")
+        connection.execute("INSERT INTO expenses (driver_id, expense_type, amount) VALUES (7, 'repair', 10.0)")
+        connection.execute("DELETE FROM expenses WHERE id = 4")
+        connection.commit()
+
+        with caplog.at_level(logging.WARNING, logger='migrations'):
+            migrate(connection)
+
+        rows = connection.execute('SELECT id, created_at FROM expenses ORDER BY id').fetchall()
+        assert isinstance(rows[0][1], int)
+        assert rows[1] == (2, None)
+        assert 'expenses.created_at: 1' in caplog.text
+        assert restore_schema_objects(connection) == []
+
+        totals = expense_totals(connection)
+        rebuild_expense_totals(connection)
+        assert totals == expense_totals(connection)
+
+        expense_id = connection.execute(
+            "INSERT INTO expenses (driver_id, expense_type, amount) VALUES (7, 'fuel', 10.0)"
+        ).lastrowid
+        assert expense_id == 5
+        assert connection.execute(
+            'SELECT typeof(created_at) FROM expenses WHERE id = ?', (expense_id,)
+        ).fetchone() == ('integer',)
+    finally:
+        connection.close()
@@ -0,0 +1,86 @@
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from callbacks import CallbackRouter, EXPENSES_PAGE
+from keyboards import add_page_navigation
+
+
+def add_expenses(db, created_at):
+    """Добавить водителю 7 расходы с заданным временем и вернуть их id"""
+    with db._manager.writer() as connection:
+        return [connection.execute('''
+            INSERT INTO expenses (driver_id, expense_type, amount, created_at)
+            VALUES (7, 'fuel', 100.0, ?)
+        ''', (timestamp,)).lastrowid for timestamp in created_at]
+
+
+def all_pages(db, limit):
+    """Пройти расходы от новых к старым, затем обратно; вернуть id по страницам"""
+    older_pages, newer_pages = [], []
+    page = db.get_driver_expenses_page(7, limit=limit)
+    assert page['newer'] is None
+    older_pages.append([item['id'] for item in page['items']])
+    while page['older']:
+        page = db.get_driver_expenses_page(7, page['older'], 'older', limit)
+        older_pages.append([item['id'] for item in page['items']])
+    while page['newer']:
+        page = db.get_driver_expenses_page(7, page['newer'], 'newer', limit)
+        newer_pages.append([item['id'] for item in page['items']])
+    return older_pages, newer_pages
+
+
+def test_pages_round_trip(db):
+    """Курсоры обходят все расходы без пропусков и повторов в обе стороны"""
+    ids = add_expenses(db, [1000 * number for number in range(1, 8)])
+    older_pages, newer_pages = all_pages(db, limit=3)
+
+    newest_first = ids[::-1]
+    assert older_pages == [newest_first[:3], newest_first[3:6], newest_first[6:]]
+    assert newer_pages == [newest_first[3:6], newest_first[:3]]
+
+
+def test_equal_created_at_are_ordered_by_id(db):
+    """Расходы с одинаковым временем различаются по id и не теряются"""
+    ids = add_expenses(db, [5000] * 5 + [4000])
+    older_pages, newer_pages = all_pages(db, limit=2)
+
+    assert sum(older_pages, []) == ids[4::-1] + ids[5:]
+    assert newer_pages == [older_pages[1], older_pages[0]]
+
+
+def test_empty_pages(db):
+    """Без расходов и за последней страницей возвращается пустая страница"""
+    assert db.get_driver_expenses_page(7) == {'items': [], 'older': None, 'newer': None}
+
+    ids = add_expenses(db, [1000, 2000])
+    page = db.get_driver_expenses_page(7, limit=2)
+    assert [item['id'] for item in page['items']] == ids[::-1]
+    assert page['older'] is None
+    assert db.get_driver_expenses_page(7, (1000, ids[0]), 'older')['items'] == []
+    assert db.get_driver_expenses_page(7, (2000, ids[1]), 'newer')['items'] == []
+
+
+def test_rows_without_created_at_are_skipped(db):
+    """Расходы без времени не попадают в страницы и не ломают курсор"""
+    ids = add_expenses(db, [None, 1000, None, 2000])
+    page = db.get_driver_expenses_page(7, limit=3)
+
+    assert [item['id'] for item in page['items']] == [ids[3], ids[1]]
+    assert page['older'] is None
+
+
+def test_navigation_buttons_round_trip(db):
+    """Кнопки перехода передают обработчику курсор страницы без изменений"""
+    ids = add_expenses(db, [1_700_000_000_000 + number for number in range(3)])
+    page = db.get_driver_expenses_page(7, (1_700_000_000_002, ids[2]), 'older', 1)
+    assert page['older'] and page['newer']
+
+    router = CallbackRouter()
+    router.action(EXPENSES_PAGE, str, int, int)(lambda callback, args: None)
+    keyboard = InlineKeyboardBuilder()
+    add_page_navigation(keyboard, EXPENSES_PAGE, page['older'], page['newer'])
+    newer_button, older_button = keyboard.export()[0]
+
+    _, args = router.resolve(newer_button.callback_data)
+    assert args == ['newer', *page['newer']]
+    _, args = router.resolve(older_button.callback_data)
+    assert args == ['older', *page['older']]
@@ -0,0 +1,37 @@
+from check_query_plans import collect_queries, explain
+
+
+def test_hot_queries_do_not_scan_tables(db):
+    """Запросы бота не просматривают таблицы целиком"""
+    queries = collect_queries()
+    with db._manager.reader() as connection:
+        for query in queries:
+            explain(connection, query)
+
+    assert [query for query in queries if query.hot]
+    assert [
+        f"{query.source}:{query.line} {query.title}: {query.error or query.scans}"
+        for query in queries if query.failed
+    ] == []
+
+
+def test_fstring_queries(db, tmp_path):
+    """f-строки проверяются с ? вместо подстановок или пропускаются"""
+    (tmp_path / 'queries.py').write_text('''
+def load(conn, ids, column, order):
+    conn.execute(f"SELECT id FROM expenses WHERE id IN ({placeholders(ids)})", ids)
+    query = "SELECT id FROM expenses"
+    query += f" WHERE driver_id IN ({placeholders(ids)})"
+    conn.execute(f"SELECT id FROM expenses ORDER BY {column} {order}")
+''', encoding='utf-8')
+    queries = collect_queries(tmp_path, ['queries.py'])
+    with db._manager.reader() as connection:
+        for query in queries:
+            explain(connection, query)
+
+    assert {query.sql: bool(query.skipped) for query in queries} == {
+        "SELECT id FROM expenses WHERE id IN (?)": False,
+        "SELECT id FROM expenses": False,
+        "SELECT id FROM expenses WHERE driver_id IN (?)": False,
+        "SELECT id FROM expenses ORDER BY ? ?": True,
+    }
@@ -0,0 +1,27 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import receipts
+from receipts import _write_file, content_path
+
+
+def test_concurrent_writes_of_same_receipt(tmp_path, monkeypatch):
+    """Две задачи, одновременно сохраняющие одно фото, не мешают друг другу"""
+    content = bytes(range(256)) * 4096
+    path = content_path(tmp_path, 'ab' * 32, '.jpg')
+    # Переименование ждет, пока обе задачи запишут временные файлы
+    both_written = threading.Barrier(2, timeout=5)
+    replace = os.replace
+
+    def replace_together(source, destination):
+        both_written.wait()
+        replace(source, destination)
+
+    monkeypatch.setattr(receipts.os, 'replace', replace_together)
+    with ThreadPoolExecutor(2) as executor:
+        for future in [executor.submit(_write_file, path, content) for _ in range(2)]:
+            future.result()
+
+    assert path.read_bytes() == content
+    assert [file.name for file in path.parent.iterdir()] == [path.name]
@@ -0,0 +1,19 @@
+from conftest import add_route
+
+
+def test_history_stamp_changes_only_with_own_routes(db):
+    """Отметку истории водителя меняют только его завершенные маршруты"""
+    db.add_driver(7, 'Иван Иванов', '+77001234567')
+    db.add_driver(8, 'Петр Петров', '+77007654321')
+    route_id = add_route(db)
+    assert db.get_route_history_stamp(7) is None
+
+    execution_id = db.start_route(7, route_id)
+    assert db.get_route_history_stamp(7) is None
+    db.finish_route(7, route_id)
+    assert db.get_route_history_stamp(7) == execution_id
+
+    other_route = add_route(db, 'Шымкент - Тараз')
+    db.start_route(8, other_route)
+    db.finish_route(8, other_route)
+    assert db.get_route_history_stamp(7) == execution_id
@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from sender import SendLimiter
+
+
+def test_retry_after_pauses_other_chats():
+    """После RetryAfter в одном чате не отправляется и в другие"""
+    async def scenario():
+        limiter = SendLimiter(rate=100, chat_rate=100)
+        sent = {}
+        limited = asyncio.Event()
+
+        async def make_request(bot, method):
+            if method.chat_id == 1 and not limited.is_set():
+                limited.set()
+                raise TelegramRetryAfter(method, 'Flood control exceeded', 1)
+            sent[method.chat_id] = time.monotonic()
+            return True
+
+        async def send_later():
+            await limited.wait()
+            return await limiter(make_request, None, SendMessage(chat_id=2, text='b'))
+
+        try:
+            started = time.monotonic()
+            await asyncio.gather(
+                limiter(make_request, None, SendMessage(chat_id=1, text='a')),
+                send_later()
+            )
+        finally:
+            await limiter.close()
+        return started, sent
+
+    started, sent = asyncio.run(scenario())
+    assert sent[1] - started >= 0.9
+    assert sent[2] - started >= 0.9
@@ -0,0 +1,23 @@
+import asyncio
+
+from conftest import add_route
+from database import AsyncDatabase
+
+
+def test_concurrent_starts_give_one_active_route(tmp_path):
+    """Из двух одновременных нажатий маршрут начинает только одно"""
+    async def scenario():
+        db = AsyncDatabase(str(tmp_path / 'test.db'))
+        try:
+            await db.add_driver(7, 'Иван Иванов', '+77001234567')
+            first, second = add_route(db._db), add_route(db._db, 'Шымкент - Тараз')
+            results = await asyncio.gather(db.start_route(7, first), db.start_route(7, second))
+            return results, await db.get_active_route(7)
+        finally:
+            await db.close()
+
+    results, active_route = asyncio.run(scenario())
+    assert results.count(None) == 1
+    execution_id = next(result for result in results if result is not None)
+    assert isinstance(execution_id, int)
+    assert active_route[5] == execution_id
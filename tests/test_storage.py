@@ -0,0 +1,127 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from storage import SQLiteStorage, _Entry
+
+
+def key(user_id):
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def stored(db):
+    with db._manager.reader() as connection:
+        return {row[0]: (row[1], row[2]) for row in connection.execute(
+            'SELECT key, state, data FROM fsm_states'
+        )}
+
+
+def run(db_file, scenario, **options):
+    """Выполнить сценарий с хранилищем и закрыть его"""
+    options.setdefault('flush_interval', 3600)
+    options.setdefault('gc_interval', 3600)
+
+    async def main():
+        storage = SQLiteStorage(db_file, **options)
+        try:
+            return await scenario(storage)
+        finally:
+            await storage.close()
+
+    return asyncio.run(main())
+
+
+def test_flush_loop_writes_changes(db, tmp_path):
+    """Изменения попадают в базу фоновой записью, без явного flush()"""
+    async def scenario(storage):
+        await storage.set_state(key(1), 'Registration:phone')
+        await storage.set_data(key(1), {'name': 'Иван'})
+        assert stored(db) == {}
+        await asyncio.sleep(0.3)
+        return stored(db)
+
+    rows = run(str(tmp_path / 'test.db'), scenario, flush_interval=0.05)
+    assert list(rows.values()) == [('Registration:phone', '{"name": "Иван"}')]
+
+
+def test_failed_write_is_retried(db, tmp_path):
+    """После ошибки записи изменения остаются в очереди и пишутся следующим flush()"""
+    async def scenario(storage):
+        write = storage._write
+        failures = []
+
+        def failing_write(items):
+            if not failures:
+                failures.append(items)
+                raise RuntimeError('диск недоступен')
+            write(items)
+
+        storage._write = failing_write
+        await storage.set_state(key(1), 'Expense:amount')
+        await storage.set_state(key(2), 'Expense:amount')
+        await storage.flush()
+        assert len(failures) == 1 and stored(db) == {}
+
+        # Новое значение ключа важнее неудачного снимка
+        await storage.set_state(key(2), 'Expense:receipt')
+        await storage.flush()
+        return stored(db)
+
+    rows = run(str(tmp_path / 'test.db'), scenario)
+    assert sorted(state for state, _ in rows.values()) == ['Expense:amount', 'Expense:receipt']
+
+
+def test_evicted_key_is_reloaded(db, tmp_path):
+    """Вытесненный из памяти ключ читается из очереди записи или из базы"""
+    async def scenario(storage):
+        for user_id in (1, 2, 3):
+            await storage.set_state(key(user_id), f'State:{user_id}')
+        assert len(storage._cache) == 2
+        # Еще не записан: берется из незаписанных изменений
+        assert await storage.get_state(key(1)) == 'State:1'
+
+        await storage.flush()
+        for user_id in (4, 5):
+            await storage.get_state(key(user_id))
+        assert len(storage._cache) == 2 and not storage._dirty
+        # Уже записан: читается из базы
+        return await storage.get_state(key(1)), await storage.get_state(key(2))
+
+    assert run(str(tmp_path / 'test.db'), scenario, cache_size=2) == ('State:1', 'State:2')
+
+
+def test_cleared_state_deletes_row(db, tmp_path):
+    """Пустое состояние удаляет строку из базы"""
+    async def scenario(storage):
+        await storage.set_state(key(1), 'Registration:name')
+        await storage.set_data(key(1), {'phone': '+77001234567'})
+        await storage.set_state(key(2), 'Registration:name')
+        await storage.flush()
+        assert len(stored(db)) == 2
+
+        await storage.set_state(key(1), None)
+        await storage.set_data(key(1), {})
+        await storage.flush()
+        return stored(db)
+
+    rows = run(str(tmp_path / 'test.db'), scenario)
+    assert list(rows.values()) == [('Registration:name', '{}')]
+
+
+def test_gc_loop_removes_abandoned_states(db, tmp_path):
+    """Фоновая очистка удаляет брошенные состояния из базы и из памяти"""
+    with db._manager.writer() as connection:
+        connection.execute(
+            "INSERT INTO fsm_states (key, state, data, updated_at) VALUES ('old', 'Expense:amount', '{}', 0)"
+        )
+
+    async def scenario(storage):
+        await storage.set_state(key(1), 'Expense:amount')
+        await storage.flush()
+        storage._cache['stale'] = _Entry('Expense:amount', '{}', 0)
+        await asyncio.sleep(0.3)
+        return stored(db), list(storage._cache)
+
+    rows, cached = run(str(tmp_path / 'test.db'), scenario, ttl=60, gc_interval=0.05)
+    assert 'old' not in rows and len(rows) == 1
+    assert 'stale' not in cached and len(cached) == 1
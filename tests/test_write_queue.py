@@ -0,0 +1,74 @@
+import sqlite3
+import time
+
+import pytest
+
+from database import WriteQueue
+
+INSERT_DRIVER = 'INSERT INTO drivers (telegram_id, full_name, phone) VALUES (?, ?, ?)'
+
+
+class RecordingWriteQueue(WriteQueue):
+    """WriteQueue, запоминающая размеры выполненных пакетов"""
+
+    def __init__(self, *args, **kwargs):
+        self.batches = []
+        super().__init__(*args, **kwargs)
+
+    def _flush(self, batch):
+        self.batches.append(len(batch))
+        super()._flush(batch)
+
+
+def driver_ids(db):
+    with db._manager.reader() as connection:
+        return [row[0] for row in connection.execute(
+            'SELECT telegram_id FROM drivers ORDER BY telegram_id'
+        )]
+
+
+def test_failed_write_does_not_affect_batch(db):
+    """Ошибка одного изменения отменяет только его, остальные фиксируются"""
+    writes = RecordingWriteQueue(db._manager, batch_size=10, window=1.0)
+    try:
+        futures = [
+            writes.submit(INSERT_DRIVER, (1, 'Первый', '+7')),
+            # telegram_id уникален
+            writes.submit(INSERT_DRIVER, (1, 'Повтор', '+7')),
+            writes.submit(INSERT_DRIVER, (2, 'Второй', '+7'), lambda cursor: cursor.lastrowid),
+        ]
+        assert futures[0].result(5).rowcount == 1
+        with pytest.raises(sqlite3.IntegrityError):
+            futures[1].result(5)
+        assert futures[2].result(5) > 0
+    finally:
+        writes.close()
+
+    assert writes.batches == [3]
+    assert driver_ids(db) == [1, 2]
+
+
+def test_close_commits_pending_writes(db):
+    """close() не ждет окна пакета и фиксирует все поставленные изменения"""
+    writes = WriteQueue(db._manager, batch_size=100, window=30)
+    futures = [writes.submit(INSERT_DRIVER, (number, 'Водитель', '+7')) for number in range(5)]
+    started = time.monotonic()
+    writes.close()
+
+    assert time.monotonic() - started < 5
+    assert all(future.done() and future.exception() is None for future in futures)
+    assert driver_ids(db) == list(range(5))
+
+
+def test_cancelled_write_is_skipped(db):
+    """Изменение, отмененное до записи, не выполняется"""
+    writes = WriteQueue(db._manager, batch_size=10, window=0.5)
+    try:
+        cancelled = writes.submit(INSERT_DRIVER, (1, 'Отменен', '+7'))
+        kept = writes.submit(INSERT_DRIVER, (2, 'Водитель', '+7'))
+        assert cancelled.cancel()
+        kept.result(5)
+    finally:
+        writes.close()
+
+    assert driver_ids(db) == [2]
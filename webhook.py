@@ -0,0 +1,74 @@
+"""HTTP-сервер бота для режима webhook.
+
+Telegram отправляет обновления POST-запросами на путь webhook. Запрос
+подтверждается сразу, а обновление обрабатывается диспетчером в
+отдельной задаче, поэтому долгий обработчик не задерживает ответ.
+Заголовок X-Telegram-Bot-Api-Secret-Token сверяется с secret_token.
+"""
+import logging
+
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+logger = logging.getLogger(__name__)
+
+
+async def health(request):
+    """Процесс жив и принимает запросы"""
+    return web.Response(text='ok')
+
+
+async def readiness(request):
+    """Бот запущен и база данных отвечает"""
+    app = request.app
+    if not app['ready']:
+        return web.Response(status=503, text='starting')
+    check = app['ready_check']
+    if check is not None:
+        try:
+            await check()
+        except Exception as error:
+            logger.warning("Проверка готовности не пройдена: %s", error)
+            return web.Response(status=503, text='not ready')
+    return web.Response(text='ready')
+
+
+def create_webhook_app(dispatcher, bot, path='/webhook', secret_token=None, ready_check=None):
+    """Приложение aiohttp с путем webhook и проверками /health и /ready.
+
+    ready_check — корутинная функция без аргументов; если она бросает
+    исключение, /ready отвечает 503.
+    """
+    app = web.Application()
+    app['ready'] = False
+    app['ready_check'] = ready_check
+
+    SimpleRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        secret_token=secret_token,
+        handle_in_background=True
+    ).register(app, path=path)
+    # Запуск и остановка диспетчера вместе с приложением
+    setup_application(app, dispatcher, bot=bot)
+
+    async def mark_ready(app):
+        app['ready'] = True
+
+    async def mark_stopping(app):
+        app['ready'] = False
+
+    app.on_startup.append(mark_ready)
+    app.on_shutdown.insert(0, mark_stopping)
+
+    app.router.add_get('/health', health)
+    app.router.add_get('/ready', readiness)
+    return app
+
+
+async def start_webhook_server(app, host, port):
+    """Запустить приложение; возвращает runner для остановки"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,390 @@
+"""Запуск бота в нескольких процессах.
+
+Процесс-диспетчер получает обновления (long polling или webhook, как
+задано в BOT_MODE) и передает каждое в один из N рабочих процессов по
+telegram_id отправителя. Все обновления одного водителя попадают в
+один процесс и обрабатываются там по очереди, поэтому порядок его
+сообщений и кэш его состояния FSM остаются согласованными. Обновления
+разных водителей обрабатываются параллельно.
+
+Рабочие процессы открывают базу сами; изменения из разных процессов
+разводит блокировка записи SQLite (BEGIN IMMEDIATE и busy_timeout).
+
+Очереди рабочих процессов ограничены: если процесс не успевает, диспетчер
+перестает забирать обновления (long polling) или отвечает Telegram
+ошибкой, и тот повторит доставку позже (webhook). Упавший рабочий процесс
+перезапускается; если он падает слишком часто, диспетчер
+останавливается с ненулевым кодом выхода.
+
+Пример:
+    python workers.py --workers 4
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+from collections import defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+# Сколько обновлений рабочий процесс забирает из очереди за раз
+RECEIVE_BATCH_SIZE = 256
+# Тайм-аут long polling в секундах
+POLLING_TIMEOUT = 30
+# Сколько обновлений может ждать в очереди одного рабочего процесса
+WORKER_QUEUE_SIZE = 10000
+# Как часто (в секундах) проверять, что рабочие процессы живы
+WORKER_CHECK_INTERVAL = 1.0
+# Больше WORKER_RESTARTS падений одного процесса за WORKER_RESTART_WINDOW
+# секунд останавливают диспетчер
+WORKER_RESTARTS = 3
+WORKER_RESTART_WINDOW = 60
+# Пауза перед повторной попыткой поставить обновление в заполненную очередь
+DISPATCH_RETRY_DELAY = 0.1
+
+
+def update_user_id(update):
+    """telegram_id отправителя обновления (или чата, если отправителя нет)"""
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        sender = value.get('from') or value.get('user')
+        if sender:
+            return sender['id']
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat:
+            return chat['id']
+    return update.get('update_id', 0)
+
+
+def worker_index(update, workers):
+    """Номер рабочего процесса для обновления"""
+    return hash(update_user_id(update)) % workers
+
+
+# --- Рабочий процесс ---------------------------------------------------------
+
+def _receive(updates):
+    """Забрать из очереди одно или несколько обновлений (блокирует поток)"""
+    batch = [updates.get()]
+    while len(batch) < RECEIVE_BATCH_SIZE:
+        try:
+            batch.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+async def _serve(main, updates):
+    """Обрабатывать обновления из очереди до получения None"""
+    loop = asyncio.get_running_loop()
+    dp, bot = main.dp, main.bot
+    # Обновления одного водителя выполняются по очереди под его блокировкой
+    locks = {}
+    pending = defaultdict(int)
+    tasks = set()
+
+    async def handle(update):
+        user_id = update_user_id(update)
+        pending[user_id] += 1
+        lock = locks.setdefault(user_id, asyncio.Lock())
+        try:
+            async with lock:
+                await dp.feed_raw_update(bot, update)
+        except Exception:
+            logger.exception("Ошибка обработки обновления %s", update.get('update_id'))
+        finally:
+            pending[user_id] -= 1
+            if not pending[user_id]:
+                del pending[user_id]
+                del locks[user_id]
+
+    await dp.emit_startup(bot=bot, dispatcher=dp, **dp.workflow_data)
+    try:
+        stopping = False
+        while not stopping:
+            for update in await loop.run_in_executor(None, _receive, updates):
+                if update is None:
+                    stopping = True
+                    break
+                task = asyncio.create_task(handle(update))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp, **dp.workflow_data)
+        await bot.session.close()
+        await main.db.close()
+
+
+def _worker_main(index, workers, updates, metrics_port):
+    """Точка входа рабочего процесса"""
+    # Останавливает процессы диспетчер: сначала дает обработать то, что
+    # уже в очереди, поэтому сигналы остановки здесь не обрабатываются
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    os.environ['METRICS_PORT'] = str(metrics_port) if metrics_port else ''
+    # Не скачанные ранее чеки и уведомления из базы отправляет, а журнал
+    # изменений очищает только первый процесс; общий лимит сообщений
+    # делится между процессами
+    os.environ['RECEIPT_BACKFILL'] = '1' if index == 0 else '0'
+    if index:
+        os.environ['NOTIFICATIONS_POLL_INTERVAL'] = '0'
+        os.environ['CHANGES_RETENTION_DAYS'] = '0'
+    os.environ['SEND_RATE_LIMIT'] = str(float(os.getenv('SEND_RATE_LIMIT', '30')) / workers)
+    import main
+
+    async def run():
+        metrics_runner = None
+        if main.METRICS_PORT:
+            metrics_runner = await main.start_metrics_server(main.METRICS_HOST, int(main.METRICS_PORT))
+        try:
+            await _serve(main, updates)
+        finally:
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+
+    logger.info("Рабочий процесс %s запущен (pid %s)", index, os.getpid())
+    asyncio.run(run())
+
+
+# --- Процесс-диспетчер -------------------------------------------------------
+
+class WorkerFailed(Exception):
+    """Рабочий процесс падает чаще, чем допускает WORKER_RESTARTS"""
+
+
+class Supervisor:
+    """Запускает рабочие процессы и распределяет между ними обновления"""
+
+    def __init__(self, workers, metrics_port=None, queue_size=WORKER_QUEUE_SIZE,
+                 restarts=WORKER_RESTARTS, restart_window=WORKER_RESTART_WINDOW):
+        self.workers = workers
+        self.metrics_port = metrics_port
+        self.restarts = restarts
+        self.restart_window = restart_window
+        self._context = multiprocessing.get_context('spawn')
+        self.queue_size = queue_size
+        self.queues = [self._context.Queue(queue_size) for _ in range(workers)]
+        self.processes = [self._create_process(index) for index in range(workers)]
+        # Время последних перезапусков каждого процесса
+        self._restarted_at = [deque() for _ in range(workers)]
+
+    def _create_process(self, index):
+        metrics_port = self.metrics_port + 1 + index if self.metrics_port else None
+        return self._context.Process(
+            target=_worker_main,
+            args=(index, self.workers, self.queues[index], metrics_port),
+            name=f'bot-worker-{index}',
+            daemon=True
+        )
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def dispatch(self, update):
+        """Передать обновление (словарь в формате Bot API) рабочему процессу.
+
+        Возвращает False, если очередь процесса заполнена.
+        """
+        index = worker_index(update, self.workers)
+        if not self.processes[index].is_alive():
+            # Не ставить обновление в очередь, которую уже никто не прочитает
+            self.check()
+        try:
+            self.queues[index].put_nowait(update)
+        except queue.Full:
+            return False
+        return True
+
+    async def deliver(self, update):
+        """Передать обновление, дождавшись места в очереди процесса"""
+        while not self.dispatch(update):
+            self.check()
+            await asyncio.sleep(DISPATCH_RETRY_DELAY)
+
+    def alive(self):
+        return all(process.is_alive() for process in self.processes)
+
+    def check(self):
+        """Перезапустить упавшие рабочие процессы.
+
+        Новый процесс получает новую очередь: упавший мог оставить
+        блокировку чтения старой захваченной, и из нее уже никто не
+        прочитает. Обновления в старой очереди теряются, их число пишется
+        в журнал. Если процесс падает слишком часто, бросает WorkerFailed.
+        """
+        now = time.monotonic()
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                continue
+            restarted_at = self._restarted_at[index]
+            while restarted_at and now - restarted_at[0] > self.restart_window:
+                restarted_at.popleft()
+            if len(restarted_at) >= self.restarts:
+                raise WorkerFailed(
+                    f"рабочий процесс {index} упал {len(restarted_at) + 1} раз "
+                    f"за {self.restart_window} с (код {process.exitcode})"
+                )
+            restarted_at.append(now)
+            logger.error("Рабочий процесс %s завершился с кодом %s, перезапуск; "
+                         "потеряно обновлений: %s", index, process.exitcode,
+                         self._discard_queue(index))
+            self.queues[index] = self._context.Queue(self.queue_size)
+            self.processes[index] = self._create_process(index)
+            self.processes[index].start()
+
+    def _discard_queue(self, index):
+        """Закрыть очередь упавшего процесса; возвращает число обновлений в ней"""
+        updates = self.queues[index]
+        try:
+            lost = updates.qsize()
+        except NotImplementedError:
+            lost = None
+        # Иначе выход диспетчера ждал бы записи в очередь, которую не читают
+        updates.cancel_join_thread()
+        updates.close()
+        return lost
+
+    async def watch(self, interval=WORKER_CHECK_INTERVAL):
+        """Проверять рабочие процессы, пока не придется остановиться"""
+        while True:
+            self.check()
+            await asyncio.sleep(interval)
+
+    def stop(self, timeout=30):
+        """Дождаться обработки отправленных обновлений и остановить процессы"""
+        for process, updates in zip(self.processes, self.queues):
+            if process.is_alive():
+                try:
+                    updates.put(None, timeout=timeout)
+                except queue.Full:
+                    pass
+        for process, updates in zip(self.processes, self.queues):
+            process.join(timeout)
+            if process.is_alive():
+                process.kill()
+            if process.exitcode:
+                updates.cancel_join_thread()
+
+
+async def poll_updates(bot, supervisor, allowed_updates):
+    """Получать обновления long polling и раздавать их рабочим процессам"""
+    offset = None
+    while True:
+        supervisor.check()
+        try:
+            updates = await bot.get_updates(
+                offset=offset,
+                timeout=POLLING_TIMEOUT,
+                allowed_updates=allowed_updates
+            )
+        except Exception as error:
+            logger.warning("Ошибка получения обновлений: %s", error)
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            # Пока очередь заполнена, следующие обновления остаются в Telegram
+            await supervisor.deliver(update.model_dump(mode='json', by_alias=True, exclude_none=True))
+            offset = update.update_id + 1
+
+
+def create_supervisor_app(supervisor, path, secret_token=None):
+    """Приложение aiohttp, раздающее обновления webhook рабочим процессам"""
+    from aiohttp import web
+    from webhook import health
+
+    async def receive(request):
+        if secret_token and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != secret_token:
+            return web.Response(status=401, text='Unauthorized')
+        if not supervisor.dispatch(await request.json()):
+            # Telegram повторит доставку позже
+            return web.Response(status=503, text='busy')
+        return web.json_response({})
+
+    async def readiness(request):
+        if not supervisor.alive():
+            return web.Response(status=503, text='worker down')
+        return web.Response(text='ready')
+
+    app = web.Application()
+    app.router.add_post(path, receive)
+    app.router.add_get('/health', health)
+    app.router.add_get('/ready', readiness)
+    return app
+
+
+async def run_supervisor(supervisor):
+    # Настройки берутся из main.py, как у бота в одном процессе
+    import main
+    from metrics import start_metrics_server
+    from webhook import start_webhook_server
+
+    metrics_runner = None
+    if main.METRICS_PORT:
+        metrics_runner = await start_metrics_server(main.METRICS_HOST, int(main.METRICS_PORT))
+    try:
+        allowed_updates = main.dp.resolve_used_update_types()
+        if main.BOT_MODE == 'webhook':
+            app = create_supervisor_app(supervisor, main.WEBHOOK_PATH, main.WEBHOOK_SECRET)
+            runner = await start_webhook_server(app, main.WEBHOOK_HOST, main.WEBHOOK_PORT)
+            try:
+                if main.WEBHOOK_BASE_URL:
+                    await main.bot.set_webhook(
+                        main.WEBHOOK_BASE_URL.rstrip('/') + main.WEBHOOK_PATH,
+                        secret_token=main.WEBHOOK_SECRET,
+                        allowed_updates=allowed_updates
+                    )
+                await supervisor.watch()
+            finally:
+                await runner.cleanup()
+        else:
+            await poll_updates(main.bot, supervisor, allowed_updates)
+    finally:
+        await main.bot.session.close()
+        await main.db.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Запуск бота в нескольких процессах")
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv('BOT_WORKERS', os.cpu_count() or 1)),
+                        help="число рабочих процессов (BOT_WORKERS)")
+    parser.add_argument('--queue-size', type=int,
+                        default=int(os.getenv('WORKER_QUEUE_SIZE', WORKER_QUEUE_SIZE)),
+                        help="обновлений в очереди одного процесса (WORKER_QUEUE_SIZE)")
+    args = parser.parse_args(argv)
+
+    metrics_port = os.getenv('METRICS_PORT', '9100')
+    supervisor = Supervisor(args.workers, int(metrics_port) if metrics_port else None,
+                            args.queue_size)
+    # SIGTERM останавливает бота так же, как Ctrl+C
+    signal.signal(signal.SIGTERM, _terminate)
+    supervisor.start()
+    try:
+        asyncio.run(run_supervisor(supervisor))
+    except KeyboardInterrupt:
+        pass
+    except WorkerFailed as error:
+        logger.error("Бот остановлен: %s", error)
+        return 1
+    finally:
+        supervisor.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())